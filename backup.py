@@ -0,0 +1,332 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import yaml
+
+
+logger = logging.getLogger("Backup")
+
+CHUNK_SIZE = 1024 * 1024
+TELEGRAM_PART_SIZE_MB = 45
+# <name>-YYYYmmdd-HHMMSS-mmm; copies made before milliseconds were added end at the seconds
+BACKUP_NAME_RE = re.compile(
+    r"^(?P<base>.+-(?P<stamp>\d{8}-\d{6}(?:-\d{3})?))\.db\.gz(?:\.part(?P<part>\d{3}))?$"
+)
+
+
+def backup_settings(config: dict) -> dict:
+    raw = config.get("backup") or {}
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "dir": raw.get("dir") or "backups",
+        "interval_hours": float(raw.get("interval_hours", 24)),
+        "keep": int(raw.get("keep", 7)),
+        "part_size_mb": float(raw.get("part_size_mb", TELEGRAM_PART_SIZE_MB)),
+        "method": raw.get("method") or "backup",
+        "pages_per_step": int(raw.get("pages_per_step", 256)),
+        "step_sleep_ms": float(raw.get("step_sleep_ms", 5)),
+        "max_restarts": int(raw.get("max_restarts", 3)),
+        "verify": bool(raw.get("verify", True)),
+    }
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def snapshot_database(
+    db_path: str,
+    dest_path: str,
+    method: str = "backup",
+    pages_per_step: int = 256,
+    step_sleep_ms: float = 5,
+    max_restarts: int = 3,
+) -> None:
+    # Consistent copy of a live database. "backup" copies pages_per_step pages at a time
+    # and yields between steps so writers are never stalled for long; "vacuum" uses
+    # VACUUM INTO, which reads inside a single transaction and also compacts the copy.
+    # A write from another connection restarts a stepped backup from the first page; after
+    # max_restarts of those the copy is taken with VACUUM INTO instead, so a busy database
+    # cannot keep the backup looping forever.
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    src = sqlite3.connect(db_path, timeout=30)
+    try:
+        if method == "vacuum":
+            src.execute("VACUUM INTO ?", (dest_path,))
+        else:
+            pause = max(0.0, float(step_sleep_ms) / 1000)
+            restarts = 0
+            last_remaining = None
+
+            def progress(status, remaining, total):
+                nonlocal restarts, last_remaining
+                if last_remaining is not None and remaining > last_remaining:
+                    restarts += 1
+                    if restarts > max_restarts:
+                        raise _TooManyRestarts()
+                last_remaining = remaining
+                if remaining and pause:
+                    time.sleep(pause)
+
+            dst = sqlite3.connect(dest_path)
+            try:
+                src.backup(dst, pages=max(1, int(pages_per_step)), progress=progress)
+                fallback = False
+            except _TooManyRestarts:
+                fallback = True
+            finally:
+                dst.close()
+            if fallback:
+                logger.warning(
+                    f"Бэкап {db_path}: копирование перезапускалось из-за записей {restarts} раз, снимаю через VACUUM INTO"
+                )
+                os.remove(dest_path)
+                src.execute("VACUUM INTO ?", (dest_path,))
+    finally:
+        src.close()
+    # The snapshot must be self-contained: no WAL sidecar files next to it
+    dst = sqlite3.connect(dest_path)
+    try:
+        dst.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dst.close()
+
+
+def compress_to_parts(src_path: str, dest_base: str, part_size: int) -> list[str]:
+    # Streams src_path through gzip into dest_base.db.gz; when the compressed output
+    # would exceed part_size it is split into .part001, .part002, ... which
+    # concatenate back into one valid gzip stream.
+    part_size = max(CHUNK_SIZE, int(part_size))
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    parts: list[str] = []
+    out = None
+    written = 0
+
+    def write(data: bytes):
+        nonlocal out, written
+        while data:
+            if out is None or written >= part_size:
+                if out is not None:
+                    out.close()
+                parts.append(f"{dest_base}.db.gz.part{len(parts) + 1:03d}")
+                out = open(parts[-1], "wb")
+                written = 0
+            room = part_size - written
+            out.write(data[:room])
+            written += min(room, len(data))
+            data = data[room:]
+
+    try:
+        with open(src_path, "rb") as f:
+            while True:
+                chunk = f.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                write(compressor.compress(chunk))
+        write(compressor.flush())
+    finally:
+        if out is not None:
+            out.close()
+
+    if len(parts) == 1:
+        single = f"{dest_base}.db.gz"
+        os.replace(parts[0], single)
+        parts = [single]
+    return parts
+
+
+def create_backup(db_path: str, backup_dir: str, settings: dict | None = None) -> list[str]:
+    settings = settings or backup_settings({})
+    os.makedirs(backup_dir, exist_ok=True)
+    now = datetime.datetime.now()
+    stamp = f"{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}"
+    name = os.path.splitext(os.path.basename(db_path))[0] or "db"
+    dest_base = os.path.join(backup_dir, f"{name}-{stamp}")
+    if any(BACKUP_NAME_RE.match(f) and f.startswith(f"{name}-{stamp}.") for f in os.listdir(backup_dir)):
+        # Never mix parts with another copy of the same name
+        raise FileExistsError(f"backup {dest_base} уже существует")
+    fd, snapshot_path = tempfile.mkstemp(prefix=f"{name}-", suffix=".snapshot", dir=backup_dir)
+    os.close(fd)
+    started = time.monotonic()
+    try:
+        snapshot_database(
+            db_path,
+            snapshot_path,
+            method=settings["method"],
+            pages_per_step=settings["pages_per_step"],
+            step_sleep_ms=settings["step_sleep_ms"],
+            max_restarts=settings["max_restarts"],
+        )
+        raw_size = os.path.getsize(snapshot_path)
+        parts = compress_to_parts(snapshot_path, dest_base, int(settings["part_size_mb"] * 1024 * 1024))
+    finally:
+        for path in (snapshot_path, snapshot_path + "-journal"):
+            if os.path.exists(path):
+                os.remove(path)
+    packed = sum(os.path.getsize(p) for p in parts)
+    logger.info(
+        f"Backup создан: {os.path.basename(dest_base)} ({raw_size} → {packed} байт, "
+        f"частей: {len(parts)}, {time.monotonic() - started:.1f}с)"
+    )
+    return parts
+
+
+def list_backups(backup_dir: str) -> dict[str, list[str]]:
+    if not os.path.isdir(backup_dir):
+        return {}
+    groups: dict[str, list[str]] = {}
+    stamps: dict[str, str] = {}
+    for fname in os.listdir(backup_dir):
+        m = BACKUP_NAME_RE.match(fname)
+        if not m:
+            continue
+        groups.setdefault(m.group("base"), []).append(os.path.join(backup_dir, fname))
+        stamps[m.group("base")] = m.group("stamp")
+    for base in groups:
+        groups[base].sort()
+    # Oldest first; a stamp without milliseconds sorts before the same second with them
+    return dict(sorted(groups.items(), key=lambda kv: stamps[kv[0]]))
+
+
+def prune_backups(backup_dir: str, keep: int) -> list[str]:
+    groups = list_backups(backup_dir)
+    removed: list[str] = []
+    if keep <= 0 or len(groups) <= keep:
+        return removed
+    for base in list(groups)[: len(groups) - keep]:
+        for path in groups[base]:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except OSError as e:
+                logger.error(f"Не удалось удалить старый backup {path}: {e}")
+    if removed:
+        logger.info(f"Удалено старых файлов backup: {len(removed)}")
+    return removed
+
+
+def verify_backup(parts: list[str]) -> dict:
+    # Restore-verification: decompress the parts into a scratch file and make sure it
+    # opens as a healthy database with readable tables.
+    parts = sorted(parts)
+    decompressor = zlib.decompressobj(31)
+    fd, restored = tempfile.mkstemp(suffix=".restore.db")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for path in parts:
+                with open(path, "rb") as f:
+                    while True:
+                        chunk = f.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        out.write(decompressor.decompress(chunk))
+            out.write(decompressor.flush())
+        if not decompressor.eof:
+            return {"ok": False, "error": "truncated gzip stream", "tables": {}}
+
+        conn = sqlite3.connect(restored)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+            tables = [
+                r[0]
+                for r in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+                )
+            ]
+            counts = {t: conn.execute(f'SELECT COUNT(*) FROM "{t}"').fetchone()[0] for t in tables}
+        finally:
+            conn.close()
+        return {"ok": integrity == "ok", "integrity": integrity, "tables": counts, "size": os.path.getsize(restored)}
+    except (OSError, zlib.error, sqlite3.DatabaseError) as e:
+        return {"ok": False, "error": str(e), "tables": {}}
+    finally:
+        if os.path.exists(restored):
+            os.remove(restored)
+
+
+async def run_backup(db_path: str, settings: dict) -> list[str]:
+    parts = await asyncio.to_thread(create_backup, db_path, settings["dir"], settings)
+    if settings["verify"]:
+        result = await asyncio.to_thread(verify_backup, parts)
+        if not result.get("ok"):
+            logger.error(f"Проверка backup не пройдена: {result.get('error') or result.get('integrity')}")
+    await asyncio.to_thread(prune_backups, settings["dir"], settings["keep"])
+    return parts
+
+
+async def backup_loop(config: dict):
+    settings = backup_settings(config)
+    db_path = config["database"]["db_path"]
+    interval = max(60.0, settings["interval_hours"] * 3600)
+    while True:
+        try:
+            await run_backup(db_path, settings)
+            await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка планового backup: {e}")
+            await asyncio.sleep(300)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite backups: create, verify, list")
+    subparsers = parser.add_subparsers(dest="command", help="Command to execute")
+
+    parser_create = subparsers.add_parser("create", help="Take a consistent compressed backup now")
+    parser_create.add_argument("--dir", default=None, help="Backup directory (default from config.yaml)")
+
+    parser_verify = subparsers.add_parser("verify", help="Restore a backup into a scratch file and check it")
+    parser_verify.add_argument("paths", nargs="*", help="Backup file or parts (default: latest backup)")
+
+    subparsers.add_parser("list", help="List backups")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    try:
+        with open("config.yaml", "r") as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        config = {}
+    settings = backup_settings(config)
+    db_path = config.get("database", {}).get("db_path", "rewards.db")
+
+    if args.command == "create":
+        backup_dir = args.dir or settings["dir"]
+        parts = create_backup(db_path, backup_dir, settings)
+        for p in parts:
+            print(p)
+    elif args.command == "verify":
+        parts = args.paths
+        if not parts:
+            groups = list_backups(settings["dir"])
+            if not groups:
+                print("No backups found.")
+                raise SystemExit(1)
+            parts = list(groups.values())[-1]
+        result = verify_backup(parts)
+        print(f"Integrity: {result.get('integrity') or result.get('error')}")
+        for table, count in result.get("tables", {}).items():
+            print(f"{table:<28} {count}")
+        if not result.get("ok"):
+            raise SystemExit(1)
+    elif args.command == "list":
+        for base, parts in list_backups(settings["dir"]).items():
+            size = sum(os.path.getsize(p) for p in parts)
+            print(f"{os.path.basename(base):<32} parts={len(parts):<3} size={size}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,382 @@
+import argparse
+import asyncio
+import copy
+import datetime
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import aiosqlite
+import yaml
+
+import bot as bot_module
+from bot import TwitchBot
+from db import Database
+
+
+DEFAULT_MIX = "chat=90,number=5,ping=3,link=2"
+
+
+class FakeAuthor:
+    def __init__(self, name: str, is_broadcaster: bool = False):
+        self.name = name
+        self.display_name = name
+        self.id = str(abs(hash(name)) % 10**9)
+        self.is_broadcaster = is_broadcaster
+        self.is_mod = is_broadcaster
+        self.mention = f"@{name}"
+        self._ws = None
+
+
+class FakeChannel:
+    def __init__(self, name: str):
+        self.name = name
+        self.sent = 0
+
+    async def send(self, content: str):
+        self.sent += 1
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeAuthor, channel: FakeChannel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.echo = False
+        self.tags: dict = {}
+        self.timestamp = datetime.datetime.now()
+
+
+class FakeHelix:
+    # Stands in for HelixClient so the benchmark never leaves the machine
+    def __init__(self, online: bool = True):
+        self.online = online
+        self.calls = 0
+
+    async def is_stream_online(self, user_login: str) -> bool:
+        self.calls += 1
+        return self.online
+
+    async def get_user_id(self, user_login: str) -> str | None:
+        self.calls += 1
+        return "1"
+
+    async def create_clip(self, broadcaster_id: str, has_delay: bool = True) -> str | None:
+        self.calls += 1
+        return None
+
+
+class CommitCounter:
+    # Counts commits made through aiosqlite while the benchmark runs
+    def __init__(self):
+        self.count = 0
+        self._orig = aiosqlite.Connection.commit
+
+    def __enter__(self):
+        counter = self
+        orig = self._orig
+
+        async def commit(conn):
+            counter.count += 1
+            return await orig(conn)
+
+        aiosqlite.Connection.commit = commit
+        return self
+
+    def __exit__(self, *exc):
+        aiosqlite.Connection.commit = self._orig
+
+
+async def make_bot(config: dict, db_path: str, channel: str, online: bool = True) -> tuple[TwitchBot, FakeChannel]:
+    config = copy.deepcopy(config)
+    config["database"]["db_path"] = db_path
+    db = Database(db_path)
+    await db.init()
+    channel_id = await db.ensure_channel(channel, None)
+
+    twitch_bot = TwitchBot(config, "0", channel, channel_id)
+    fake_channel = FakeChannel(channel)
+    twitch_bot.helix = FakeHelix(online)
+    twitch_bot.get_channel = lambda name: fake_channel
+    twitch_bot.channel_user_id = "1"
+    twitch_bot.is_stream_online = online
+    if online:
+        twitch_bot.current_stream_session_id = await db.start_stream_session(channel)
+    return twitch_bot, fake_channel
+
+
+def stub_telegram() -> dict:
+    sent = {"count": 0}
+
+    async def notify_user(telegram_id: int, text: str):
+        sent["count"] += 1
+
+    bot_module.notify_user = notify_user
+    return sent
+
+
+def parse_mix(spec: str) -> tuple[list[str], list[int]]:
+    kinds, weights = [], []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        kinds.append(name.strip())
+        weights.append(int(weight or 1))
+    return kinds, weights
+
+
+def message_text(kind: str, rnd: random.Random) -> str:
+    if kind == "number":
+        return str(rnd.randint(1, 100))
+    if kind == "ping":
+        return "!ping"
+    if kind == "link":
+        return f"!link {''.join(rnd.choices('ABCDEFGHJKLMNPQRSTUVWXYZ23456789', k=6))}"
+    return rnd.choice(["привет", "gg", "LUL", "когда розыгрыш?", "kappa", "хаха", "+", "ну давай"])
+
+
+def seed(db_path: str, channel: str, users: list[str], pending: int, linked: float, rnd: random.Random):
+    conn = sqlite3.connect(db_path)
+    now = datetime.datetime.now()
+    cur = conn.execute(
+        "INSERT INTO rewards (channel_id, name, description, weight, quantity, enabled) VALUES (NULL, '10 GOLD', '', 1, 1, 1)"
+    )
+    reward_id = cur.lastrowid
+    conn.executemany(
+        "INSERT INTO draws (channel, nickname, reward_id, created_at, status, expires_at, notified_in_tg) "
+        "VALUES (?, ?, ?, ?, 'pending', ?, 0)",
+        [(channel, rnd.choice(users), reward_id, now, now + datetime.timedelta(hours=1)) for _ in range(pending)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO telegram_users (telegram_id, twitch_username) VALUES (?, ?)",
+        [(5_000_000 + i, name) for i, name in enumerate(users) if rnd.random() < linked],
+    )
+    conn.commit()
+    conn.close()
+
+
+def db_size(db_path: str) -> int:
+    return sum(os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
+
+
+async def run_chat_bench(
+    config: dict,
+    db_path: str,
+    messages: int,
+    rate: float,
+    users: int,
+    mix: str,
+    pending: int = 200,
+    linked: float = 0.3,
+    online: bool = True,
+    seed_value: int = 1,
+    channel: str = "benchchan",
+    before_start=None,
+) -> dict:
+    rnd = random.Random(seed_value)
+    population = [f"viewer{i}" for i in range(users)]
+    kinds, weights = parse_mix(mix)
+
+    twitch_bot, fake_channel = await make_bot(config, db_path, channel, online)
+    seed(db_path, channel, population, pending, linked, rnd)
+    if "number" in kinds:
+        twitch_bot.number_game = {"active": True, "number": 1000, "min": 1, "max": 100, "reward_id": 0}
+    telegram = stub_telegram()
+    size_before = db_size(db_path)
+    if before_start:
+        before_start()
+
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    in_flight = 0
+    max_in_flight = 0
+    by_kind: dict[str, int] = {}
+
+    async def handle(msg: FakeMessage, scheduled: float):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            await twitch_bot.event_message(msg)
+        except Exception as e:
+            reason = f"{type(e).__name__}: {e}"[:80]
+            errors[reason] = errors.get(reason, 0) + 1
+        finally:
+            in_flight -= 1
+            latencies.append(time.perf_counter() - scheduled)
+
+    tasks: list[asyncio.Task] = []
+    with CommitCounter() as commits:
+        started = time.perf_counter()
+        for i in range(messages):
+            # Open loop: messages arrive on schedule whether or not the bot keeps up,
+            # so latency includes time spent queued behind earlier messages
+            scheduled = started + (i / rate if rate > 0 else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                scheduled = time.perf_counter() if rate <= 0 else scheduled
+            kind = rnd.choices(kinds, weights)[0]
+            by_kind[kind] = by_kind.get(kind, 0) + 1
+            msg = FakeMessage(message_text(kind, rnd), FakeAuthor(rnd.choice(population)), fake_channel)
+            tasks.append(asyncio.create_task(handle(msg, scheduled)))
+            if rate <= 0 and i % 100 == 99:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        commit_count = commits.count
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "elapsed": elapsed,
+        "messages": messages,
+        "msgs_per_s": messages / elapsed if elapsed else 0.0,
+        "commits": commit_count,
+        "commits_per_s": commit_count / elapsed if elapsed else 0.0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_in_flight": max_in_flight,
+        "errors": errors,
+        "by_kind": by_kind,
+        "chat_replies": fake_channel.sent,
+        "telegram_sent": telegram["count"],
+        "db_growth": db_size(db_path) - size_before,
+    }
+
+
+def process_bench(config: dict, db_path: str, index: int, kwargs: dict, start, results) -> None:
+    # One channel per process, as a supervisor worker would run it; all share one database
+    res = asyncio.run(
+        run_chat_bench(config, db_path, channel=f"benchchan{index}", seed_value=kwargs.pop("seed_value") + index, before_start=start.wait, **kwargs)
+    )
+    results.put(res)
+
+
+def run_processes(config: dict, db_path: str, processes: int, **kwargs) -> dict:
+    # The schema is created once up front so the processes do not race for the migrations
+    asyncio.run(Database(db_path).init())
+    ctx = multiprocessing.get_context("spawn")
+    start, results = ctx.Barrier(processes), ctx.Queue()
+    kwargs["messages"] = kwargs["messages"] // processes
+    workers = [
+        ctx.Process(target=process_bench, args=(config, db_path, i, dict(kwargs), start, results)) for i in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    parts = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    elapsed = max(r["elapsed"] for r in parts)
+    messages = sum(r["messages"] for r in parts)
+    commits = sum(r["commits"] for r in parts)
+    errors: dict[str, int] = {}
+    by_kind: dict[str, int] = {}
+    for r in parts:
+        for key, count in r["errors"].items():
+            errors[key] = errors.get(key, 0) + count
+        for key, count in r["by_kind"].items():
+            by_kind[key] = by_kind.get(key, 0) + count
+    return {
+        "elapsed": elapsed,
+        "messages": messages,
+        "msgs_per_s": messages / elapsed if elapsed else 0.0,
+        "commits": commits,
+        "commits_per_s": commits / elapsed if elapsed else 0.0,
+        # Worst process: the slowest shard is what its chat sees
+        "p50_ms": max(r["p50_ms"] for r in parts),
+        "p95_ms": max(r["p95_ms"] for r in parts),
+        "p99_ms": max(r["p99_ms"] for r in parts),
+        "max_in_flight": max(r["max_in_flight"] for r in parts),
+        "errors": errors,
+        "by_kind": by_kind,
+        "chat_replies": sum(r["chat_replies"] for r in parts),
+        "telegram_sent": sum(r["telegram_sent"] for r in parts),
+        "db_growth": sum(r["db_growth"] for r in parts),
+        "per_process": [r["msgs_per_s"] for r in parts],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive TwitchBot.event_message with synthetic chat traffic")
+    parser.add_argument("--messages", type=int, default=5000, help="Total messages to send")
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second (0 = as fast as possible)")
+    parser.add_argument("--users", type=int, default=500, help="Distinct chatters")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Message mix, kind=weight (default: {DEFAULT_MIX})")
+    parser.add_argument("--pending", type=int, default=200, help="Pending draws seeded for random chatters")
+    parser.add_argument("--linked", type=float, default=0.3, help="Share of chatters linked to Telegram")
+    parser.add_argument("--offline", action="store_true", help="Simulate an offline stream")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--db", default=None, help="SQLite file to use (default: temporary file)")
+    parser.add_argument("--processes", type=int, default=1, help="Channels in separate processes on one database (supervisor workers)")
+    args = parser.parse_args()
+
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    tmp_dir = None
+    db_path = args.db
+    if not db_path:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, "bench.db")
+
+    try:
+        if args.processes > 1:
+            res = run_processes(
+                config,
+                db_path,
+                args.processes,
+                messages=args.messages,
+                rate=args.rate / args.processes,
+                users=args.users,
+                mix=args.mix,
+                pending=args.pending,
+                linked=args.linked,
+                online=not args.offline,
+                seed_value=args.seed,
+            )
+        else:
+            res = asyncio.run(
+                run_chat_bench(
+                    config,
+                    db_path,
+                    args.messages,
+                    args.rate,
+                    args.users,
+                    args.mix,
+                    pending=args.pending,
+                    linked=args.linked,
+                    online=not args.offline,
+                    seed_value=args.seed,
+                )
+            )
+    finally:
+        if tmp_dir:
+            tmp_dir.cleanup()
+
+    rate = f"{args.rate:.0f}/s" if args.rate > 0 else "max"
+    print(f"Messages: {res['messages']}, users: {args.users}, rate: {rate}, mix: {res['by_kind']}")
+    print(f"Elapsed: {res['elapsed']:.3f}s")
+    print(f"Throughput: {res['msgs_per_s']:.0f} msg/s")
+    if "per_process" in res:
+        print(f"  {args.processes} processes: " + ", ".join(f"{v:.0f}" for v in res["per_process"]) + " msg/s; latency below is the worst process")
+    print(f"Latency p50/p95/p99: {res['p50_ms']:.1f} / {res['p95_ms']:.1f} / {res['p99_ms']:.1f} ms")
+    print(f"Commits: {res['commits']} ({res['commits_per_s']:.0f}/s)")
+    print(f"Max in flight: {res['max_in_flight']}, errors: {sum(res['errors'].values())}")
+    for reason, count in sorted(res["errors"].items(), key=lambda kv: -kv[1]):
+        print(f"  {count:>6}  {reason}")
+    print(f"Chat replies: {res['chat_replies']}, Telegram notifications: {res['telegram_sent']}")
+    print(f"DB growth: {res['db_growth'] / 1024:.1f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from db import Database
+from sqlite_stats import STMT_STATUS, StmtStats, stmt_stats_factory
+
+
+CHANNELS = 10
+REWARDS = 20
+CHECKS = 100
+
+
+def users_for(rows: int) -> int:
+    return max(100, rows // 10)
+
+
+def sessions_for(rows: int) -> int:
+    return max(1, rows // 10000)
+
+
+def generate_dataset(db_path: str, rows: int) -> None:
+    asyncio.run(Database(db_path).init())
+    users = users_for(rows)
+    sessions = sessions_for(rows)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("BEGIN")
+
+    def seq(count: int, select: str, insert: str):
+        # Rows are produced inside SQLite so 10M-row datasets take seconds, not minutes
+        conn.execute(
+            f"WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i + 1 < :n) "
+            f"{insert} {select}",
+            {"n": count, "users": users, "sessions": sessions},
+        )
+
+    now = "datetime('now', 'localtime', '-' || (i % 86400) || ' seconds')"
+    later = "datetime('now', 'localtime', '+1 day')"
+
+    seq(
+        CHANNELS,
+        f"SELECT 'chan' || i, NULL, 1, {now} FROM seq",
+        "INSERT INTO channels (login, owner_telegram_id, enabled, created_at)",
+    )
+    seq(
+        CHANNELS,
+        f"SELECT i + 1, 10, 30, 15, 7, 1, {now} FROM seq",
+        "INSERT INTO channel_settings (channel_id, min_interval_minutes, max_interval_minutes, "
+        "active_timeout_minutes, claim_timeout_minutes, drops_enabled, updated_at)",
+    )
+    seq(
+        REWARDS,
+        f"SELECT 1 + i % {CHANNELS}, (i + 1) * 5 || ' GOLD', '', 1 + i, 1, 1 FROM seq",
+        "INSERT INTO rewards (channel_id, name, description, weight, quantity, enabled)",
+    )
+    seq(
+        users,
+        f"SELECT 1000000 + i, CASE WHEN i % 2 = 0 THEN 'user' || i END, {now} FROM seq",
+        "INSERT INTO telegram_users (telegram_id, twitch_username, created_at)",
+    )
+    seq(
+        users,
+        f"SELECT 1000000 + i, 100 + i % 1000, {now} FROM seq",
+        "INSERT INTO gold_balances (telegram_id, balance, updated_at)",
+    )
+    seq(
+        rows,
+        f"SELECT 'chan' || (i % {CHANNELS}), 'user' || (i / {CHANNELS}), i % 50000, {now} FROM seq",
+        "INSERT INTO watch_time (channel, nickname, seconds, last_seen_at)",
+    )
+    seq(
+        rows,
+        f"SELECT 'chan' || (i % {CHANNELS}), 'user' || (i / {CHANNELS}), {now} FROM seq",
+        "INSERT INTO active_users (channel, nickname, last_active_at)",
+    )
+    seq(
+        rows,
+        f"""SELECT 'chan' || (i % {CHANNELS}), 'user' || (i % :users), 1 + i % {REWARDS}, {now},
+            CASE WHEN i % 100 = 0 THEN 'pending' WHEN i % 10 < 5 THEN 'claimed' ELSE 'expired' END,
+            CASE WHEN i % 100 = 0 THEN {later} ELSE {now} END, 1
+        FROM seq""",
+        "INSERT INTO draws (channel, nickname, reward_id, created_at, status, expires_at, notified_in_tg)",
+    )
+    seq(
+        rows,
+        f"SELECT 1000000 + i % :users, 1, 'seed', i, {now} FROM seq",
+        "INSERT INTO gold_transactions (telegram_id, amount, source_type, source_id, created_at)",
+    )
+    seq(
+        CHECKS,
+        f"SELECT 'BENCH' || i, 1, 2000000000, 0, 'active', 0, {now} FROM seq",
+        "INSERT INTO gold_checks (code, amount, max_activations, activated_count, status, created_by, created_at)",
+    )
+    seq(
+        rows,
+        f"SELECT 1 + i % {CHECKS}, 1000000 + i / {CHECKS}, {now} FROM seq",
+        "INSERT INTO gold_check_activations (check_id, telegram_id, activated_at)",
+    )
+    seq(
+        rows,
+        f"""SELECT 1, {now}, {now}, 'random', 1 + i % {CHANNELS} FROM seq""",
+        "INSERT INTO giveaway_triggers (requested_by, created_at, processed_at, trigger_type, channel_id)",
+    )
+    seq(
+        max(1, rows // 100),
+        f"SELECT 1, {now}, NULL, 'random', 1 + i % {CHANNELS} FROM seq",
+        "INSERT INTO giveaway_triggers (requested_by, created_at, processed_at, trigger_type, channel_id)",
+    )
+    seq(
+        min(rows, 10000),
+        f"""SELECT 1 + i % {CHANNELS}, 1 + i % {REWARDS}, 'plan ' || i, 1,
+            CASE WHEN i % 4 = 0 THEN 'planned' ELSE 'triggered' END, 1, {now} FROM seq""",
+        "INSERT INTO planned_giveaways (channel_id, reward_id, title, winners_count, status, created_by, created_at)",
+    )
+    seq(
+        sessions,
+        f"SELECT 'chan' || (i % {CHANNELS}), {now}, {now} FROM seq",
+        "INSERT INTO stream_sessions (channel, started_at, ended_at)",
+    )
+    seq(
+        rows,
+        f"SELECT 1 + i % :sessions, 'user' || (i / :sessions), i % 7200, {now} FROM seq",
+        "INSERT INTO stream_watch_time (session_id, nickname, seconds, last_seen_at)",
+    )
+    seq(
+        min(rows, 100000),
+        "SELECT i, 1000000 + i % :users, 'user' || i, 'AK-47', 'available' FROM seq",
+        "INSERT INTO item_claims (draw_id, telegram_id, twitch_username, reward_name, status)",
+    )
+    conn.execute("COMMIT")
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+
+
+def dataset_path(data_dir: str, rows: int) -> str:
+    path = os.path.join(data_dir, f"bench_db_{rows}.db")
+    marker = path + ".ready"
+    if not os.path.exists(marker):
+        for p in (path, path + "-wal", path + "-shm"):
+            if os.path.exists(p):
+                os.remove(p)
+        started = time.perf_counter()
+        print(f"Generating dataset with {rows} rows per large table...", flush=True)
+        generate_dataset(path, rows)
+        with open(marker, "w") as f:
+            f.write(str(rows))
+        print(f"  done in {time.perf_counter() - started:.1f}s, {os.path.getsize(path) / 1024 / 1024:.1f} MiB", flush=True)
+    return path
+
+
+def method_cases(rows: int) -> dict:
+    # Each case builds call arguments from the random generator so lookups hit
+    # existing (and occasionally missing) keys across the whole dataset
+    users = users_for(rows)
+    sessions = sessions_for(rows)
+    counter = iter(range(10**12))
+
+    def user(r: random.Random) -> str:
+        return f"user{r.randrange(users)}"
+
+    def tg(r: random.Random) -> int:
+        return 1000000 + r.randrange(users)
+
+    def chan(r: random.Random) -> str:
+        return f"chan{r.randrange(CHANNELS)}"
+
+    return {
+        "update_watch_time": lambda r: (chan(r), user(r)),
+        "get_watch_time_seconds": lambda r: (chan(r), user(r)),
+        "update_stream_watch_time": lambda r: (1 + r.randrange(sessions), user(r)),
+        "get_stream_watch_time_seconds": lambda r: (1 + r.randrange(sessions), user(r)),
+        "get_stream_eligible_users": lambda r: (1 + r.randrange(sessions), 600),
+        "get_user_stats": lambda r: (user(r),),
+        "get_telegram_user": lambda r: (tg(r),),
+        "get_telegram_id_by_twitch_username": lambda r: (user(r),),
+        "get_gold_balance": lambda r: (tg(r),),
+        "credit_gold_once": lambda r: (tg(r), 1, "bench", next(counter)),
+        "apply_gold_delta_once": lambda r: (tg(r), 1, "bench_delta", next(counter)),
+        "get_gold_check_by_code": lambda r: (f"BENCH{r.randrange(CHECKS)}",),
+        "activate_gold_check": lambda r: (f"BENCH{r.randrange(CHECKS)}", 50_000_000 + next(counter)),
+        "create_giveaway_trigger": lambda r: (1 + r.randrange(CHANNELS), 1),
+        "claim_giveaway_trigger": lambda r: (1 + r.randrange(CHANNELS),),
+        "expire_pending_draws": lambda r: (),
+        "get_pending_notifications": lambda r: (),
+        "list_planned_giveaways": lambda r: (1 + r.randrange(CHANNELS), "planned"),
+        "list_available_item_claims": lambda r: (tg(r),),
+        "list_enabled_channels": lambda r: (),
+        "get_channel_settings": lambda r: (1 + r.randrange(CHANNELS),),
+        "list_rewards": lambda r: (1 + r.randrange(CHANNELS),),
+        "get_linked_users_count": lambda r: (),
+        "get_total_draws_count": lambda r: (),
+        "get_all_linked_telegram_ids": lambda r: (),
+    }
+
+
+async def bench_method(db: Database, stats: StmtStats, name: str, make_args, iterations: int, max_seconds: float, seed: int) -> dict:
+    rnd = random.Random(seed)
+    method = getattr(db, name)
+    latencies: list[float] = []
+    stats.take()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        await method(*make_args(rnd))
+        latencies.append(time.perf_counter() - t0)
+        if time.perf_counter() - started > max_seconds:
+            break
+    elapsed = time.perf_counter() - started
+    # Group-committed activations close their connection in the background drain task
+    await asyncio.sleep(0)
+    counters = stats.take()
+
+    latencies.sort()
+    n = len(latencies)
+
+    def pct(p: float) -> float:
+        return latencies[min(n - 1, int(n * p))] * 1000 if n else 0.0
+
+    result = {
+        "iterations": n,
+        "ops_per_s": n / elapsed if elapsed else 0.0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "stmt_stats": counters["connections"] > 0,
+    }
+    for key in STMT_STATUS:
+        result[f"{key}_per_op"] = counters[key] / n if n else 0.0
+    return result
+
+
+async def run_size(db_path: str, rows: int, methods: list[str], iterations: int, max_seconds: float, seed: int) -> dict:
+    stats = StmtStats()
+    db = Database(db_path, connection_factory=stmt_stats_factory(stats))
+    cases = method_cases(rows)
+    results = {}
+    for name in methods:
+        results[name] = await bench_method(db, stats, name, cases[name], iterations, max_seconds, seed)
+        r = results[name]
+        print(
+            f"  {name:<36} {r['ops_per_s']:>9.0f} ops/s  p50 {r['p50_ms']:>7.2f}  p95 {r['p95_ms']:>7.2f}  "
+            f"p99 {r['p99_ms']:>7.2f} ms  scan/op {r['fullscan_step_per_op']:>10.0f}  vm/op {r['vm_step_per_op']:>11.0f}",
+            flush=True,
+        )
+    return results
+
+
+def compare(old_path: str, new_path: str, threshold: float, min_scan: float) -> int:
+    with open(old_path, "r") as f:
+        old = json.load(f)
+    with open(new_path, "r") as f:
+        new = json.load(f)
+
+    regressions = 0
+    for size, methods in new["results"].items():
+        base = old["results"].get(size)
+        if not base:
+            continue
+        print(f"Rows: {size}")
+        for name, cur in methods.items():
+            prev = base.get(name)
+            if not prev:
+                continue
+            flags = []
+            if prev["ops_per_s"] and cur["ops_per_s"] < prev["ops_per_s"] * (1 - threshold):
+                flags.append("ops/s")
+            if prev["p95_ms"] and cur["p95_ms"] > prev["p95_ms"] * (1 + threshold):
+                flags.append("p95")
+            scan_prev, scan_cur = prev["fullscan_step_per_op"], cur["fullscan_step_per_op"]
+            if scan_cur > min_scan and scan_cur > scan_prev * (1 + threshold):
+                flags.append("full scans")
+            change = (cur["ops_per_s"] / prev["ops_per_s"] - 1) * 100 if prev["ops_per_s"] else 0.0
+            mark = "REGRESSION " + ",".join(flags) if flags else "ok"
+            print(
+                f"  {name:<36} {prev['ops_per_s']:>9.0f} -> {cur['ops_per_s']:>9.0f} ops/s ({change:+6.1f}%)  "
+                f"p95 {prev['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms  scan/op {scan_prev:.0f} -> {scan_cur:.0f}  {mark}"
+            )
+            regressions += bool(flags)
+    print(f"Regressions: {regressions}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-method db.Database microbenchmarks")
+    subparsers = parser.add_subparsers(dest="command", help="Command to execute")
+
+    parser_run = subparsers.add_parser("run", help="Run the benchmarks")
+    parser_run.add_argument("--sizes", default="10000,1000000", help="Comma-separated dataset sizes (rows per large table)")
+    parser_run.add_argument("--methods", default=None, help="Comma-separated method names (default: all)")
+    parser_run.add_argument("--iterations", type=int, default=200, help="Calls per method")
+    parser_run.add_argument("--max-seconds", type=float, default=5.0, help="Time budget per method")
+    parser_run.add_argument("--data-dir", default=None, help="Keep generated datasets here and reuse them")
+    parser_run.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser_run.add_argument("--json", default=None, help="Write results to this JSON file")
+
+    parser_compare = subparsers.add_parser("compare", help="Compare two JSON result files")
+    parser_compare.add_argument("old", help="Baseline results")
+    parser_compare.add_argument("new", help="New results")
+    parser_compare.add_argument("--threshold", type=float, default=0.2, help="Relative change treated as regression")
+    parser_compare.add_argument("--min-scan", type=float, default=100, help="Ignore full-scan growth below this many rows/op")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        if compare(args.old, args.new, args.threshold, args.min_scan):
+            raise SystemExit(1)
+        return
+    if args.command != "run":
+        parser.print_help()
+        return
+
+    all_methods = list(method_cases(1))
+    methods = [m.strip() for m in args.methods.split(",")] if args.methods else all_methods
+    unknown = [m for m in methods if m not in all_methods]
+    if unknown:
+        parser.error(f"unknown methods: {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    tmp_dir = None
+    data_dir = args.data_dir
+    if not data_dir:
+        tmp_dir = tempfile.TemporaryDirectory()
+        data_dir = tmp_dir.name
+    os.makedirs(data_dir, exist_ok=True)
+
+    report = {
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "iterations": args.iterations,
+        "results": {},
+    }
+    try:
+        for rows in sizes:
+            path = dataset_path(data_dir, rows)
+            # Write methods change the data, so every run starts from a fresh copy
+            work_path = os.path.join(data_dir, f"bench_db_{rows}_work.db")
+            shutil.copyfile(path, work_path)
+            print(f"Rows: {rows}")
+            try:
+                report["results"][str(rows)] = asyncio.run(
+                    run_size(work_path, rows, methods, args.iterations, args.max_seconds, args.seed)
+                )
+            finally:
+                for p in (work_path, work_path + "-wal", work_path + "-shm"):
+                    if os.path.exists(p):
+                        os.remove(p)
+    finally:
+        if tmp_dir:
+            tmp_dir.cleanup()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Saved: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
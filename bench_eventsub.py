@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+from eventsub import KEEPALIVE_MARGIN, EventSubClient
+from fake_eventsub import FakeEventSubServer
+from twitch_helix import CircuitBreaker, HelixCache, HelixClient, HelixScheduler
+
+
+async def wait_until(predicate, timeout: float) -> float | None:
+    started = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started > timeout:
+            return None
+        await asyncio.sleep(0.005)
+    return time.perf_counter() - started
+
+
+def fmt_seconds(value: float | None) -> str:
+    return "never" if value is None else f"{value:.2f}s"
+
+
+async def run_bench(args) -> None:
+    server = FakeEventSubServer(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, max_total_cost=args.max_cost, seed=args.seed
+    )
+    await server.start()
+    rnd = random.Random(args.seed)
+    helix = HelixClient(
+        "bench-client",
+        "bench-secret",
+        user_token="bench-user",
+        api_base=server.api_base,
+        auth_base=server.auth_base,
+        cache=HelixCache(),
+        scheduler=HelixScheduler("bench"),
+        user_scheduler=HelixScheduler("bench-user"),
+        breakers={e: CircuitBreaker(e) for e in ("streams", "users", "eventsub/subscriptions")},
+    )
+    client = EventSubClient(helix, server.ws_url, args.keepalive, reconnect_max_seconds=5)
+    logins = {server.user_id(f"channel{i}"): f"channel{i}" for i in range(args.channels)}
+    received: dict[str, list[tuple[bool, float]]] = {bid: [] for bid in logins}
+
+    def watcher(bid: str):
+        return lambda online: received[bid].append((online, time.perf_counter()))
+
+    def covered() -> int:
+        return client.covered_count()
+
+    task = asyncio.create_task(client.run())
+    try:
+        for bid in logins:
+            client.watch(bid, watcher(bid))
+        took = await wait_until(client.settled, 30)
+        print(
+            f"subscribe: {covered()} of {len(logins)} channels on EventSub after {fmt_seconds(took)}, "
+            f"{server.stats.get('eventsub', 0)} subscription requests; the rest stays on polling "
+            f"(max_total_cost={args.max_cost})"
+        )
+
+        async def flips(phase: str) -> None:
+            on_eventsub = [bid for bid in logins if client.covers(bid)]
+            if not on_eventsub:
+                print(f"{phase:<28} no channel on EventSub")
+                return
+            latencies, missed = [], 0
+            for _ in range(args.flips):
+                bid = rnd.choice(on_eventsub)
+                before = len(received[bid])
+                sent_at = time.perf_counter()
+                await server.set_stream(logins[bid], not server.is_online(logins[bid]))
+                if await wait_until(lambda: len(received[bid]) > before, 5) is None:
+                    missed += 1
+                else:
+                    latencies.append((received[bid][-1][1] - sent_at) * 1000)
+            summary = f"median {statistics.median(latencies):.1f} ms, max {max(latencies):.1f} ms" if latencies else "-"
+            print(f"{phase:<28} {args.flips} stream changes: detected {summary}, missed {missed}")
+
+        await flips("steady")
+
+        requests_before = server.stats.get("eventsub", 0)
+        session_before = client.session_id
+        await server.request_reconnect()
+        took = await wait_until(lambda: client.session_id not in (None, session_before), 10)
+        print(
+            f"session_reconnect: migrated after {fmt_seconds(took)}, "
+            f"{server.stats.get('eventsub', 0) - requests_before} new subscription requests, "
+            f"{covered()} channels still on EventSub"
+        )
+        await flips("after session_reconnect")
+
+        requests_before = server.stats.get("eventsub", 0)
+        await server.drop_connections()
+        lost = await wait_until(lambda: covered() == 0, 5)
+        back = await wait_until(client.settled, 30)
+        print(
+            f"connection closed (4005): fell back to polling after {fmt_seconds(lost)}, "
+            f"on EventSub again after {fmt_seconds(back)} with {server.stats.get('eventsub', 0) - requests_before} subscription requests"
+        )
+        await flips("after reconnect")
+
+        server.silence()
+        lost = await wait_until(lambda: covered() == 0, args.keepalive + KEEPALIVE_MARGIN + 5)
+        back = await wait_until(client.settled, 30)
+        print(
+            f"silent connection: noticed after {fmt_seconds(lost)} (keepalive {args.keepalive}s + {KEEPALIVE_MARGIN}s), "
+            f"on EventSub again after {fmt_seconds(back)}"
+        )
+
+        victim = next((bid for bid in logins if client.covers(bid)), None)
+        if victim:
+            await server.revoke(logins[victim])
+            took = await wait_until(lambda: not client.covers(victim), 5)
+            print(f"revocation: {logins[victim]} back on polling after {fmt_seconds(took)}")
+
+        on_eventsub = covered()
+        polled = len(logins) - on_eventsub
+        per_hour_polling = len(logins) * 3600 / args.poll_interval
+        per_hour_eventsub = on_eventsub * 60 / args.verify_minutes + polled * 3600 / args.poll_interval
+        print(
+            f"polling every {args.poll_interval:g}s: go-live noticed after {args.poll_interval / 2:g}s on average "
+            f"(up to {args.poll_interval:g}s), {per_hour_polling:.0f} /streams requests per hour"
+        )
+        print(
+            f"with EventSub: {on_eventsub} channels notified within milliseconds and checked every "
+            f"{args.verify_minutes:g} min, {polled} polled; {per_hour_eventsub:.0f} /streams requests per hour"
+        )
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EventSub WebSocket client against a local EventSub stand-in")
+    parser.add_argument("--channels", type=int, default=20, help="Watched channels")
+    parser.add_argument("--max-cost", type=int, default=10, help="Subscription cost limit (Twitch: 10 for WebSocket)")
+    parser.add_argument("--flips", type=int, default=20, help="Stream starts/ends per phase")
+    parser.add_argument("--keepalive", type=int, default=10, help="keepalive_timeout_seconds asked for")
+    parser.add_argument("--poll-interval", type=float, default=60, help="stream_check_interval_seconds to compare with")
+    parser.add_argument("--verify-minutes", type=float, default=10, help="eventsub.verify_minutes to compare with")
+    parser.add_argument("--latency-ms", type=float, default=20, help="Stand-in response latency")
+    parser.add_argument("--jitter-ms", type=float, default=5, help="Random +/- latency jitter")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="Show client logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    asyncio.run(run_bench(args))
+
+
+if __name__ == "__main__":
+    main()
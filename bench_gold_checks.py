@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from db import Database
+
+
+async def run_bench(db_path: str, users: int, max_activations: int, concurrency: int, amount: int) -> dict:
+    db = Database(db_path)
+    await db.init()
+    code = f"BENCH{int(time.time() * 1000)}"
+    check_id = await db.create_gold_check(amount, max_activations, 0, 0, code)
+
+    sem = asyncio.Semaphore(concurrency)
+    statuses: dict[str, int] = {}
+    latencies: list[float] = []
+
+    async def press(telegram_id: int):
+        async with sem:
+            started = time.perf_counter()
+            result = await db.activate_gold_check(code, telegram_id)
+            latencies.append(time.perf_counter() - started)
+            status = result.get("status") or "unknown"
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(press(1_000_000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(db_path)
+    activated_count, status = conn.execute(
+        "SELECT activated_count, status FROM gold_checks WHERE id = ?", (check_id,)
+    ).fetchone()
+    ledger_rows = conn.execute(
+        "SELECT COUNT(*) FROM gold_check_activations WHERE check_id = ?", (check_id,)
+    ).fetchone()[0]
+    credited = conn.execute(
+        "SELECT COALESCE(SUM(amount), 0) FROM gold_transactions WHERE source_type = 'check_activation'"
+    ).fetchone()[0]
+    conn.close()
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "elapsed": elapsed,
+        "presses_per_s": users / elapsed if elapsed else 0.0,
+        "activations_per_s": statuses.get("activated", 0) / elapsed if elapsed else 0.0,
+        "statuses": statuses,
+        "activated_count": int(activated_count),
+        "check_status": status,
+        "ledger_rows": int(ledger_rows),
+        "credited": int(credited),
+        "expected_activations": min(users, max_activations),
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark GOLD check activation under a burst of deep-link presses")
+    parser.add_argument("--users", type=int, default=2000, help="Number of distinct users pressing the link")
+    parser.add_argument("--activations", type=int, default=1000, help="max_activations of the check")
+    parser.add_argument("--concurrency", type=int, default=200, help="Concurrent activations in flight")
+    parser.add_argument("--amount", type=int, default=10, help="GOLD per activation")
+    parser.add_argument("--target", type=float, default=1000.0, help="Target activations per second")
+    parser.add_argument("--db", default=None, help="SQLite file to use (default: temporary file)")
+    args = parser.parse_args()
+
+    tmp_dir = None
+    db_path = args.db
+    if not db_path:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, "bench.db")
+
+    try:
+        res = asyncio.run(run_bench(db_path, args.users, args.activations, args.concurrency, args.amount))
+    finally:
+        if tmp_dir:
+            tmp_dir.cleanup()
+
+    print(f"Presses: {args.users}, max_activations: {args.activations}, concurrency: {args.concurrency}")
+    print(f"Elapsed: {res['elapsed']:.3f}s")
+    print(f"Presses/s: {res['presses_per_s']:.0f}")
+    print(f"Activations/s: {res['activations_per_s']:.0f} (target {args.target:.0f})")
+    print(f"Latency p50/p95/p99: {res['p50_ms']:.1f} / {res['p95_ms']:.1f} / {res['p99_ms']:.1f} ms")
+    print(f"Statuses: {res['statuses']}")
+    print(
+        f"Check: activated_count={res['activated_count']} status={res['check_status']} "
+        f"ledger_rows={res['ledger_rows']} credited={res['credited']}"
+    )
+
+    ok = (
+        res["activated_count"] == res["expected_activations"]
+        and res["ledger_rows"] == res["expected_activations"]
+        and res["credited"] == res["expected_activations"] * args.amount
+    )
+    print("Consistency: OK" if ok else "Consistency: FAILED (overshoot or lost activation)")
+    if res["activations_per_s"] < args.target:
+        print("Throughput: below target")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
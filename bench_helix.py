@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+from fake_helix import FakeHelixServer, add_server_arguments
+from twitch_helix import CircuitBreaker, HelixCache, HelixClient, HelixScheduler
+
+
+async def run_case(
+    server: FakeHelixServer,
+    channels: int,
+    rounds: int,
+    shared: bool,
+    cache_dir: str,
+    poll_reserve: float,
+    outage_rounds: int = 0,
+) -> dict:
+    server.reset_stats()
+    server.tokens.clear()
+    server.buckets.clear()
+    logins = [f"channel{i}" for i in range(channels)]
+    cache_path = os.path.join(cache_dir, f"helix_cache_{channels}.json")
+    cache = HelixCache(cache_path)
+    scheduler = HelixScheduler("bench", poll_reserve)
+    breakers = {endpoint: CircuitBreaker(endpoint) for endpoint in ("streams", "users")}
+
+    def make_client() -> HelixClient:
+        return HelixClient(
+            "bench-client",
+            "bench-secret",
+            api_base=server.api_base,
+            auth_base=server.auth_base,
+            cache=cache,
+            scheduler=scheduler,
+            breakers=breakers,
+        )
+
+    # Today every TwitchBot owns its HelixClient; --shared models one client for all channels
+    shared_client = make_client() if shared else None
+    clients = {login: shared_client or make_client() for login in logins}
+
+    latencies: list[float] = []
+    wrong = 0
+
+    async def call(coro_factory):
+        started = time.perf_counter()
+        result = await coro_factory()
+        latencies.append(time.perf_counter() - started)
+        return result
+
+    started = time.perf_counter()
+    # Startup: each bot resolves its channel id (event_ready)
+    ids = await asyncio.gather(*(call(lambda l=login: clients[l].get_user_id(l)) for login in logins))
+    wrong += sum(1 for login, uid in zip(logins, ids) if uid != server.user_id(login))
+    startup = time.perf_counter() - started
+
+    round_times: list[float] = []
+    for _ in range(rounds):
+        round_started = time.perf_counter()
+        results = await asyncio.gather(*(call(lambda l=login: clients[l].is_stream_online(l)) for login in logins))
+        wrong += sum(1 for login, online in zip(logins, results) if online != server.is_online(login))
+        round_times.append(time.perf_counter() - round_started)
+    elapsed = time.perf_counter() - started
+
+    calls = channels * (rounds + 1)
+    api_requests = server.stats.get("streams", 0) + server.stats.get("users", 0)
+    token_requests = server.stats.get("token", 0)
+    latencies.sort()
+
+    # Restart: a new process loads the cache file and every bot resolves its channel again
+    stats_before = dict(server.stats)
+    cache = HelixCache(cache_path)
+    restarted = {login: make_client() for login in logins}
+    await asyncio.gather(*(restarted[login].get_user_id(login) for login in logins))
+    restart_requests = sum(server.stats.get(k, 0) - stats_before.get(k, 0) for k in ("token", "users", "streams"))
+
+    # Outage: Helix answers 503 to everything; polling must neither stall nor flip streams offline
+    outage_max = 0.0
+    outage_wrong = 0
+    if outage_rounds > 0:
+        error_5xx, server.error_5xx = server.error_5xx, 1.0
+        try:
+            for _ in range(outage_rounds):
+                round_started = time.perf_counter()
+                results = await asyncio.gather(*(clients[l].is_stream_online(l) for l in logins))
+                outage_wrong += sum(1 for login, online in zip(logins, results) if online != server.is_online(login))
+                outage_max = max(outage_max, time.perf_counter() - round_started)
+        finally:
+            server.error_5xx = error_5xx
+
+    def pct(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000 if latencies else 0.0
+
+    return {
+        "channels": channels,
+        "calls": calls,
+        "elapsed": elapsed,
+        "calls_per_s": calls / elapsed if elapsed else 0.0,
+        "startup_s": startup,
+        "round_max_s": max(round_times) if round_times else 0.0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "api_requests": api_requests,
+        "amplification": api_requests / calls if calls else 0.0,
+        "token_requests": token_requests,
+        "restart_requests": restart_requests,
+        "status_401": server.stats.get("status_401", 0),
+        "status_429": server.stats.get("status_429", 0),
+        "status_5xx": sum(v for k, v in server.stats.items() if k.startswith("status_5")),
+        "wrong_results": wrong,
+        "outage_round_max_s": outage_max,
+        "outage_wrong": outage_wrong,
+        "breaker": breakers["streams"].state,
+    }
+
+
+async def run_bench(args) -> list[dict]:
+    server = FakeHelixServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_401=args.error_401,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        bucket_size=args.bucket,
+        refill_per_minute=args.refill,
+        token_ttl=args.token_ttl,
+        seed=args.seed,
+    )
+    await server.start()
+    cache_dir = tempfile.TemporaryDirectory()
+    try:
+        results = []
+        for channels in [int(c) for c in args.channels.split(",") if c.strip()]:
+            res = await run_case(
+                server, channels, args.rounds, args.shared, cache_dir.name, args.poll_reserve, args.outage_rounds
+            )
+            results.append(res)
+            print(
+                f"channels={res['channels']:<5} calls={res['calls']:<6} {res['calls_per_s']:>7.0f} calls/s  "
+                f"p50/p95/p99 {res['p50_ms']:.0f}/{res['p95_ms']:.0f}/{res['p99_ms']:.0f} ms  "
+                f"round max {res['round_max_s']:.2f}s",
+                flush=True,
+            )
+            print(
+                f"               requests={res['api_requests']} amplification={res['amplification']:.2f}x  "
+                f"token fetches={res['token_requests']}  401={res['status_401']} 429={res['status_429']} "
+                f"5xx={res['status_5xx']}  wrong results={res['wrong_results']}  "
+                f"Helix calls on restart={res['restart_requests']}",
+                flush=True,
+            )
+            if args.outage_rounds:
+                print(
+                    f"               outage: {args.outage_rounds} rounds, round max {res['outage_round_max_s']:.2f}s  "
+                    f"wrong results={res['outage_wrong']}  breaker={res['breaker']}",
+                    flush=True,
+                )
+        return results
+    finally:
+        cache_dir.cleanup()
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HelixClient load benchmark against a local Helix stand-in")
+    parser.add_argument("--channels", default="1,100,1000", help="Comma-separated monitored channel counts")
+    parser.add_argument("--rounds", type=int, default=3, help="Stream-check rounds after startup")
+    parser.add_argument("--shared", action="store_true", help="One HelixClient for all channels")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for injected failures")
+    parser.add_argument("--poll-reserve", type=float, default=0.1, help="Share of the bucket stream polling may not use")
+    parser.add_argument("--outage-rounds", type=int, default=2, help="Stream-check rounds with Helix answering 503")
+    parser.add_argument("--verbose", action="store_true", help="Show HelixClient retry logs")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not args.verbose:
+        logging.getLogger("Helix").setLevel(logging.CRITICAL)
+
+    asyncio.run(run_bench(args))
+
+
+if __name__ == "__main__":
+    main()
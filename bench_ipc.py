@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from ipc import BusClient, BusError, BusServer
+
+
+def summary_us(samples: list[float]) -> str:
+    if not samples:
+        return "-"
+    samples = sorted(samples)
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return f"p50 {statistics.median(samples) * 1e6:.0f} us, p99 {p99 * 1e6:.0f} us, max {samples[-1] * 1e6:.0f} us"
+
+
+def worker(path: str, index: int, queue_size: int, slow_ms: float, verbose: bool) -> None:
+    logging.basicConfig(level=logging.INFO if verbose else logging.CRITICAL)
+    asyncio.run(run_worker(path, index, queue_size, slow_ms))
+
+
+async def run_worker(path: str, index: int, queue_size: int, slow_ms: float) -> None:
+    # Stands in for a Twitch worker process: answers requests, counts events and asks the
+    # hub back when told to
+    bus = BusClient(path, f"worker{index}", queue_size=queue_size, reconnect_max_seconds=0.5)
+    arrivals: list[float] = []
+    slow = {"count": 0}
+
+    def sink(data):
+        arrivals.append(time.perf_counter() - data["sent"])
+
+    def slow_sink(data):
+        # Blocks the loop, like a handler doing synchronous work
+        time.sleep(slow_ms / 1000)
+        slow["count"] += 1
+
+    def report(data):
+        result = {"arrivals": len(arrivals), "latency": list(arrivals), "slow": slow["count"]}
+        arrivals.clear()
+        return result
+
+    async def ask_hub(data):
+        samples = []
+        for i in range(int(data["requests"])):
+            started = time.perf_counter()
+            await bus.request("echo", i)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    bus.on(f"echo:{index}", lambda data: data)
+    bus.on(f"sink:{index}", sink)
+    bus.on(f"slow:{index}", slow_sink)
+    bus.on(f"report:{index}", report)
+    bus.on(f"ask_hub:{index}", ask_hub)
+    await bus.run()
+
+
+async def wait_until(predicate, timeout: float) -> float | None:
+    started = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started > timeout:
+            return None
+        await asyncio.sleep(0.001)
+    return time.perf_counter() - started
+
+
+async def run_bench(args, path: str) -> None:
+    hub = BusServer(path, queue_size=args.queue_size, send_timeout=args.send_timeout)
+    hub.on("echo", lambda data: data)
+    server = asyncio.create_task(hub.run())
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=worker, args=(path, i, args.queue_size, args.slow_ms, args.verbose), daemon=True) for i in range(args.workers)]
+    for w in workers:
+        w.start()
+    try:
+        took = await wait_until(lambda: len(hub.peers) == args.workers, 30)
+        print(f"{args.workers} workers connected after {took:.2f}s")
+
+        samples = []
+        for i in range(args.requests):
+            started = time.perf_counter()
+            await hub.request(f"echo:{i % args.workers}", {"n": i})
+            samples.append(time.perf_counter() - started)
+        print(f"request hub -> worker      {args.requests} sequential: {summary_us(samples)}")
+
+        samples = await hub.request("ask_hub:0", {"requests": args.requests}, timeout=60)
+        print(f"request worker -> hub      {args.requests} sequential: {summary_us(samples)}")
+
+        for i in range(args.requests):
+            await hub.publish(f"sink:{i % args.workers}", {"sent": time.perf_counter()})
+            await asyncio.sleep(0.0005)
+        latency = []
+        for i in range(args.workers):
+            latency += (await hub.request(f"report:{i}"))["latency"]
+        print(f"publish one way            {len(latency)} spaced events: {summary_us(latency)}")
+
+        started = time.perf_counter()
+        for i in range(args.events):
+            await hub.publish(f"sink:{i % args.workers}", {"sent": time.perf_counter()})
+        received = 0
+        for i in range(args.workers):
+            # Requests queue behind the events on the same connection, so this returns after them
+            received += (await hub.request(f"report:{i}", timeout=60))["arrivals"]
+        elapsed = time.perf_counter() - started
+        print(f"publish burst              {args.events} events: {received / elapsed:.0f} events/s, received {received}")
+
+        text = "x" * 1000
+        started = time.perf_counter()
+        sent = dropped = 0
+        max_queue = 0
+        for i in range(args.slow_events):
+            if await hub.publish("slow:0", {"n": i, "text": text}):
+                sent += 1
+            else:
+                dropped += 1
+            max_queue = max(max_queue, max(p.queue.qsize() for p in hub.peers))
+        publish_elapsed = time.perf_counter() - started
+        handled = {"slow": 0}
+
+        async def poll_handled() -> bool:
+            handled.update(await hub.request("report:0", timeout=120))
+            return handled["slow"] >= sent
+
+        while not await poll_handled() and time.perf_counter() - started < 120:
+            await asyncio.sleep(0.1)
+        print(
+            f"slow consumer ({args.slow_ms:g} ms/event, 1 KB) {args.slow_events} events: publisher held back for {publish_elapsed:.2f}s, "
+            f"hub queue peaked at {max_queue} of {args.queue_size}, sent {sent}, dropped {dropped} "
+            f"(send_timeout {args.send_timeout:g}s), handled {handled['slow']} after {time.perf_counter() - started:.2f}s"
+        )
+
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        await wait_until(lambda: not hub.peers, 5)
+        await asyncio.sleep(args.outage)
+        server = asyncio.create_task(hub.run())
+        started = time.perf_counter()
+        back = await wait_until(lambda: len(hub.peers) == args.workers, 30) or float("nan")
+        ok = 0
+        for i in range(args.workers):
+            try:
+                await hub.request(f"echo:{i}", i, timeout=2)
+                ok += 1
+            except BusError:
+                pass
+        print(
+            f"hub restart ({args.outage:g}s down): all workers back {back:.3f}s after it listened again, "
+            f"{ok} of {args.workers} answering"
+        )
+        print(
+            f"DB polling for comparison: giveaway_triggers every 3s -> 1.5s on average, up to 3s; "
+            f"settings re-read every stream check (60s)"
+        )
+    finally:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.join()
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IPC bus between a hub and worker processes over a Unix socket")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes")
+    parser.add_argument("--requests", type=int, default=2000, help="Sequential requests per direction")
+    parser.add_argument("--events", type=int, default=50000, help="Events in the burst")
+    parser.add_argument("--slow-events", type=int, default=3000, help="Events sent to a slow handler")
+    parser.add_argument("--slow-ms", type=float, default=2, help="Time the slow handler blocks per event")
+    parser.add_argument("--queue-size", type=int, default=1000, help="ipc.queue_size")
+    parser.add_argument("--send-timeout", type=float, default=1, help="ipc.send_timeout_seconds")
+    parser.add_argument("--outage", type=float, default=0.5, help="Seconds the hub is down")
+    parser.add_argument("--verbose", action="store_true", help="Show bus logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run_bench(args, os.path.join(tmp, "bench.sock")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import random
+import resource
+import sqlite3
+import tempfile
+import time
+
+import yaml
+
+import clock
+from bench_chat import FakeAuthor, FakeHelix, FakeMessage, make_bot, message_text, parse_mix, stub_telegram
+from clock import ScaledClock
+
+
+LOOPS = ("stream_check_loop", "giveaway_loop", "expire_loop", "instant_giveaway_loop")
+
+
+class LoopStats:
+    def __init__(self):
+        self.iterations = 0
+        self.work: list[float] = []
+        self.late: list[float] = []
+        self.woke_at: float | None = None
+
+    def take(self) -> tuple[int, list[float], list[float]]:
+        taken = (self.iterations, self.work, self.late)
+        self.iterations, self.work, self.late = 0, [], []
+        return taken
+
+
+class SoakClock(ScaledClock):
+    # ScaledClock that times the bot loops: real time spent working between two sleeps, and
+    # how much later than requested (in virtual seconds) each sleep returned
+    def __init__(self, speed: float, start: datetime.datetime | None = None):
+        super().__init__(speed, start)
+        self.loops: dict[str, LoopStats] = {}
+
+    def track(self, name: str) -> None:
+        self.loops[name] = LoopStats()
+
+    async def sleep(self, seconds: float) -> None:
+        task = asyncio.current_task()
+        stats = self.loops.get(task.get_name()) if task else None
+        if stats is None:
+            await super().sleep(seconds)
+            return
+        started = time.perf_counter()
+        if stats.woke_at is not None:
+            stats.work.append(started - stats.woke_at)
+            stats.iterations += 1
+        await super().sleep(seconds)
+        woke = time.perf_counter()
+        stats.late.append(max(0.0, (woke - started) * self.speed - seconds))
+        stats.woke_at = woke
+
+
+class StreamSchedule:
+    def __init__(self, start_hour: float, stream_hours: float):
+        self.start_hour = start_hour
+        self.stream_hours = stream_hours
+
+    def hour_of_day(self, moment: datetime.datetime) -> float:
+        return moment.hour + moment.minute / 60 + moment.second / 3600
+
+    def online(self, moment: datetime.datetime) -> bool:
+        return (self.hour_of_day(moment) - self.start_hour) % 24 < self.stream_hours
+
+    def seconds_until_online(self, moment: datetime.datetime) -> float:
+        return ((self.start_hour - self.hour_of_day(moment)) % 24) * 3600
+
+
+class ScheduledHelix(FakeHelix):
+    def __init__(self, schedule: StreamSchedule):
+        super().__init__(online=False)
+        self.schedule = schedule
+
+    async def is_stream_online(self, user_login: str) -> bool:
+        self.calls += 1
+        return self.schedule.online(clock.now())
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def seed(db_path: str, channel: str, viewers: list[str], linked: float, rnd: random.Random) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO rewards (channel_id, name, description, weight, quantity, enabled) VALUES (NULL, ?, '', ?, ?, 1)",
+        [("10 GOLD", 3, 2), ("50 GOLD", 1, 1), ("AK-47 | Redline", 1, 1)],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO telegram_users (telegram_id, twitch_username) VALUES (?, ?)",
+        [(6_000_000 + i, name) for i, name in enumerate(viewers) if rnd.random() < linked],
+    )
+    conn.commit()
+    conn.close()
+
+
+def db_state(db_path: str) -> tuple[int, dict[str, int]]:
+    # Logical size (pages in use, WAL included) rather than file size, which jumps at checkpoints
+    conn = sqlite3.connect(db_path)
+    try:
+        pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        size = pages * conn.execute("PRAGMA page_size").fetchone()[0]
+        return size, dict(conn.execute("SELECT status, COUNT(*) FROM draws GROUP BY status").fetchall())
+    finally:
+        conn.close()
+
+
+def pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_soak(config: dict, db_path: str, args) -> list[dict]:
+    rnd = random.Random(args.seed)
+    random.seed(args.seed)
+    channel = "soakchan"
+    schedule = StreamSchedule(args.stream_start_hour, args.stream_hours)
+    day_start = datetime.datetime.combine(datetime.date.today(), datetime.time())
+    soak_clock = SoakClock(args.speed, day_start + datetime.timedelta(hours=args.stream_start_hour - 1))
+    clock.install(soak_clock)
+
+    config = dict(config, recording={"enabled": False})
+    twitch_bot, fake_channel = await make_bot(config, db_path, channel, online=False)
+    twitch_bot.helix = ScheduledHelix(schedule)
+    twitch_bot.current_stream_session_id = None
+
+    async def ready():
+        return True
+
+    twitch_bot.wait_for_ready = ready
+    viewers = [f"viewer{i}" for i in range(args.viewers)]
+    seed(db_path, channel, viewers, args.linked, rnd)
+    telegram = stub_telegram()
+    kinds, weights = parse_mix(args.mix)
+
+    for name in LOOPS:
+        soak_clock.track(name)
+    loop_tasks = [asyncio.create_task(getattr(twitch_bot, name)(), name=name) for name in LOOPS]
+
+    chat_tasks: set[asyncio.Task] = set()
+    chat = {"handled": 0, "errors": 0, "lag": []}
+
+    async def handle(msg: FakeMessage, sent_at: float):
+        try:
+            await twitch_bot.event_message(msg)
+        except Exception:
+            chat["errors"] += 1
+        chat["handled"] += 1
+        chat["lag"].append(time.perf_counter() - sent_at)
+
+    async def chat_loop():
+        while True:
+            moment = clock.now()
+            if not schedule.online(moment):
+                await clock.sleep(min(300.0, max(1.0, schedule.seconds_until_online(moment))))
+                continue
+            await clock.sleep(rnd.expovariate(args.chat_rate))
+            kind = rnd.choices(kinds, weights)[0]
+            msg = FakeMessage(message_text(kind, rnd), FakeAuthor(rnd.choice(viewers)), fake_channel)
+            task = asyncio.create_task(handle(msg, time.perf_counter()))
+            chat_tasks.add(task)
+            task.add_done_callback(chat_tasks.discard)
+
+    chat_task = asyncio.create_task(chat_loop(), name="chat")
+
+    samples: list[dict] = []
+    sample_seconds = args.sample_minutes * 60
+    total_seconds = args.days * 86400
+    print(
+        f"Soak: {args.days:g} day(s) at {args.speed:g}x (~{total_seconds / args.speed:.0f}s real), "
+        f"stream {args.stream_hours:g}h/day from {args.stream_start_hour:g}:00, chat {args.chat_rate:g} msg/s while live"
+    )
+    print(
+        f"{'virtual':>16} {'real s':>7} {'rss MB':>7} {'tasks':>6} {'db KiB':>8} {'msgs':>6} {'lag p95':>8} "
+        f"{'draws p/c/e':>12}  loops: work p95 ms / late max s"
+    )
+    try:
+        while soak_clock.elapsed() < total_seconds:
+            await clock.sleep(sample_seconds)
+            lag = chat["lag"]
+            chat["lag"] = []
+            size, draws = await asyncio.to_thread(db_state, db_path)
+            loops = {}
+            for name, stats in soak_clock.loops.items():
+                iterations, work, late = stats.take()
+                loops[name] = {
+                    "iterations": iterations,
+                    "work_p95_ms": pct(work, 0.95) * 1000,
+                    "late_max_s": max(late) if late else 0.0,
+                }
+            sample = {
+                "virtual": clock.now(),
+                "real": soak_clock.elapsed() / args.speed,
+                "rss_mb": rss_mb(),
+                "tasks": len(asyncio.all_tasks()),
+                "db_kib": size / 1024,
+                "messages": chat["handled"],
+                "lag_p95_ms": pct(lag, 0.95) * 1000,
+                "draws": draws,
+                "loops": loops,
+            }
+            samples.append(sample)
+            loop_cols = "  ".join(
+                f"{name.replace('_loop', '')} {v['work_p95_ms']:.1f}/{v['late_max_s']:.1f}" for name, v in loops.items()
+            )
+            print(
+                f"{sample['virtual']:%m-%d %H:%M:%S} {sample['real']:>7.1f} {sample['rss_mb']:>7.1f} {sample['tasks']:>6} "
+                f"{sample['db_kib']:>8.0f} {sample['messages']:>6} {sample['lag_p95_ms']:>6.1f}ms "
+                f"{draws.get('pending', 0):>4}/{draws.get('claimed', 0)}/{draws.get('expired', 0):<4}  {loop_cols}",
+                flush=True,
+            )
+    finally:
+        chat_task.cancel()
+        for task in loop_tasks:
+            task.cancel()
+        await asyncio.gather(chat_task, *loop_tasks, *chat_tasks, return_exceptions=True)
+        clock.install(None)
+
+    print(f"Chat errors: {chat['errors']}, Telegram notifications: {telegram['count']}, Helix checks: {twitch_bot.helix.calls}")
+    if len(samples) >= 3:
+        # First sample includes start-up allocations, so growth is measured from the second one
+        base, last = samples[1], samples[-1]
+        days = max((last["virtual"] - base["virtual"]).total_seconds() / 86400, 1e-9)
+        print(f"RSS growth: {(last['rss_mb'] - base['rss_mb']) / days:+.1f} MB/day")
+        print(f"Task count: {base['tasks']} -> {last['tasks']}")
+        print(f"DB growth: {(last['db_kib'] - base['db_kib']) / days:+.0f} KiB/day")
+        for name in LOOPS:
+            first = [s["loops"][name]["work_p95_ms"] for s in samples[1:4]]
+            recent = [s["loops"][name]["work_p95_ms"] for s in samples[-3:]]
+            print(f"{name}: work p95 {max(first):.1f} -> {max(recent):.1f} ms")
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Soak test: days of streams, chat and drops on a virtual clock")
+    parser.add_argument("--days", type=float, default=1, help="Virtual days to simulate")
+    parser.add_argument("--speed", type=float, default=500, help="Virtual seconds per real second")
+    parser.add_argument("--stream-hours", type=float, default=4, help="Stream length per day")
+    parser.add_argument("--stream-start-hour", type=float, default=18, help="Hour of day the stream starts")
+    parser.add_argument("--chat-rate", type=float, default=0.3, help="Chat messages per virtual second while live")
+    parser.add_argument("--viewers", type=int, default=300, help="Distinct chatters")
+    parser.add_argument("--linked", type=float, default=0.3, help="Share of chatters linked to Telegram")
+    parser.add_argument("--mix", default="chat=95,ping=3,link=2", help="Message mix, kind=weight")
+    parser.add_argument("--sample-minutes", type=float, default=60, help="Virtual minutes between samples")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--db", default=None, help="SQLite file to use (default: temporary file)")
+    parser.add_argument("--verbose", action="store_true", help="Show bot logs")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    tmp_dir = None
+    db_path = args.db
+    if not db_path:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, "soak.db")
+    try:
+        asyncio.run(run_soak(config, db_path, args))
+    finally:
+        if tmp_dir:
+            tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
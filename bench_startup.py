@@ -0,0 +1,191 @@
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+from db import Database
+from fake_helix import FakeHelixServer
+
+
+def measure_imports(module: str, top: int) -> tuple[float, list[tuple[float, str]]]:
+    # -X importtime prints "import time: self [us] | cumulative | package" for every import,
+    # children before their parent and indented two more spaces. The interpreter's own
+    # start-up imports come first at indent 0; after them, indent 2 is what `module` imports.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr else f"import {module} failed")
+    total = 0.0
+    direct: list[tuple[float, str]] = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        ms = int(cumulative) / 1000
+        indent = len(name) - len(name.lstrip()) - 1
+        if name.strip() == module and indent == 0:
+            total = ms
+        elif indent == 0:
+            direct = []
+        elif indent == 2:
+            direct.append((ms, name.strip()))
+    direct.sort(reverse=True)
+    return total, direct[:top]
+
+
+def set_user_version(db_path: str, version: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+    conn.commit()
+    conn.close()
+
+
+def seed(db_path: str, rows: int) -> None:
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO rewards (channel_id, name, description, weight, quantity, enabled) VALUES (NULL, ?, '', 1, 1, 1)",
+        [(f"reward {i}",) for i in range(max(1, rows // 100))],
+    )
+    conn.executemany(
+        "INSERT INTO giveaway_triggers (requested_by, created_at, processed_at, trigger_type, channel_id) "
+        "VALUES (1, '2024-01-01 00:00:00', '2024-01-01 00:00:01', 'random', NULL)",
+        [()] * rows,
+    )
+    conn.commit()
+    conn.close()
+
+
+def old_backfill(db_path: str, channel_id: int) -> None:
+    # What every start did before backfills were recorded: three full-table UPDATEs
+    conn = sqlite3.connect(db_path)
+    for table in ("rewards", "planned_giveaways", "giveaway_triggers"):
+        conn.execute(f"UPDATE {table} SET channel_id = ? WHERE channel_id IS NULL", (channel_id,))
+    conn.commit()
+    conn.close()
+
+
+async def timed(coro_factory, rounds: int) -> list[float]:
+    times = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await coro_factory()
+        times.append(time.perf_counter() - started)
+    return times
+
+
+def fmt(times: list[float]) -> str:
+    return f"median {statistics.median(times) * 1000:8.2f} ms  max {max(times) * 1000:8.2f} ms"
+
+
+async def run_bench(config: dict, work_dir: str, args) -> None:
+    import main
+    from bot import TwitchBot
+
+    print(f"{'stage':<52} time")
+
+    fresh_times = []
+    for i in range(args.rounds):
+        path = os.path.join(work_dir, f"fresh{i}.db")
+        fresh_times.extend(await timed(lambda: Database(path).init(), 1))
+    print(f"{'init, new database (all migrations)':<52} {fmt(fresh_times)}")
+
+    base = os.path.join(work_dir, "base.db")
+    await Database(base).init()
+
+    async def legacy_init():
+        set_user_version(base, 0)
+        await Database(base).init()
+
+    legacy = await timed(legacy_init, args.rounds)
+    print(f"{'init, unversioned database (every start before)':<52} {fmt(legacy)}")
+    warm = await timed(lambda: Database(base).init(), args.rounds)
+    print(f"{'init, schema up to date':<52} {fmt(warm)}")
+
+    db = Database(base)
+    seed(base, args.rows)
+    channel_id = await db.ensure_channel("benchchan", None)
+    first = await timed(lambda: db.backfill_channel_data(channel_id), 1)
+    print(f"{f'backfill, first run ({args.rows} triggers)':<52} {fmt(first)}")
+    again = await timed(lambda: db.backfill_channel_data(channel_id), args.rounds)
+    print(f"{'backfill, already applied':<52} {fmt(again)}")
+    old = []
+    for _ in range(args.rounds):
+        started = time.perf_counter()
+        await asyncio.to_thread(old_backfill, base, channel_id)
+        old.append(time.perf_counter() - started)
+    print(f"{'backfill, unconditional UPDATEs (before)':<52} {fmt(old)}")
+
+    server = FakeHelixServer(latency_ms=args.helix_ms)
+    await server.start()
+    try:
+        startup_config = dict(config)
+        startup_config["twitch"] = dict(
+            config.get("twitch") or {},
+            channel="benchchan",
+            bot_id=None,
+            bot_nick="benchbot",
+            client_id="bench-client",
+            client_secret="bench-secret",
+            helix_api_base=server.api_base,
+            auth_base=server.auth_base,
+        )
+
+        async def serial(path: str):
+            startup_db = Database(path)
+            await startup_db.init()
+            cid = await startup_db.ensure_channel("benchchan", None)
+            await startup_db.backfill_channel_data(cid)
+            await TwitchBot.resolve_bot_id(startup_config)
+
+        async def parallel(path: str):
+            await main.prepare_startup(startup_config, Database(path))
+
+        for name, func in (("serial", serial), ("parallel", parallel)):
+            times = []
+            for i in range(args.rounds):
+                path = os.path.join(work_dir, f"{name}{i}.db")
+                shutil.copy(base, path)
+                times.extend(await timed(lambda: func(path), 1))
+            print(f"{f'startup chain, warm DB, {name} (Helix {args.helix_ms:g} ms)':<52} {fmt(times)}")
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup time: imports, schema migrations, backfills, init order")
+    parser.add_argument("--rounds", type=int, default=5, help="Repetitions per stage")
+    parser.add_argument("--rows", type=int, default=200000, help="giveaway_triggers rows for the backfill stage")
+    parser.add_argument("--helix-ms", type=float, default=150, help="Latency of the local Helix stand-in")
+    parser.add_argument("--top", type=int, default=8, help="Slowest direct imports to list")
+    parser.add_argument("--modules", default="main,telegram_bot,db", help="Modules to time imports of")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    for module in [m.strip() for m in args.modules.split(",") if m.strip()]:
+        total, direct = measure_imports(module, args.top)
+        print(f"import {module}: {total:.0f} ms")
+        for ms, name in direct:
+            print(f"    {ms:8.1f} ms  {name}")
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        asyncio.run(run_bench(config, work_dir, args))
+
+
+if __name__ == "__main__":
+    main()
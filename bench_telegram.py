@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import telegram_bot as tb
+from db import Database
+from fake_telegram import FakeTelegramServer, add_server_arguments
+from live_messages import LiveMessageUpdater
+from metrics import TELEGRAM_EDITS_SKIPPED
+from sqlite_stats import StmtStats, stmt_stats_factory
+from telegram_webhook import WebhookServer
+
+
+USER_BASE = 7_000_000
+CHECK_CODE = "SIMCHECK"
+CHECK_CHAT_ID = -1001000000001
+# Every user's menu message, so a repeated button press edits the same message
+MENU_MESSAGE_ID = 1
+
+
+def seed(db_path: str, users: int, linked: int, check_activations: int) -> None:
+    conn = sqlite3.connect(db_path)
+    now = datetime.datetime.now()
+    conn.executemany(
+        "INSERT INTO telegram_users (telegram_id, twitch_username, created_at) VALUES (?, ?, ?)",
+        [(USER_BASE + i, f"viewer{i}", now) for i in range(max(users, linked))],
+    )
+    conn.executemany(
+        "INSERT INTO watch_time (channel, nickname, seconds, last_seen_at) VALUES (?, ?, ?, ?)",
+        [(tb.TWITCH_CHANNEL, f"viewer{i}", 600 + i % 5000, now) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT INTO gold_balances (telegram_id, balance, updated_at) VALUES (?, ?, ?)",
+        [(USER_BASE + i, 500 + i % 2000, now) for i in range(users)],
+    )
+    cur = conn.execute(
+        "INSERT INTO rewards (channel_id, name, description, weight, quantity, enabled) VALUES (NULL, 'AK-47 | Redline', '', 1, 1, 1)"
+    )
+    reward_id = cur.lastrowid
+    for i in range(users):
+        if i % 3:
+            continue
+        cur = conn.execute(
+            "INSERT INTO draws (channel, nickname, reward_id, created_at, status, expires_at, notified_in_tg) "
+            "VALUES (?, ?, ?, ?, 'claimed', ?, 1)",
+            (tb.TWITCH_CHANNEL, f"viewer{i}", reward_id, now, now),
+        )
+        conn.execute(
+            "INSERT INTO item_claims (draw_id, telegram_id, twitch_username, reward_name, status, claimed_at) "
+            "VALUES (?, ?, ?, 'AK-47 | Redline', 'available', ?)",
+            (cur.lastrowid, USER_BASE + i, f"viewer{i}", now),
+        )
+    conn.execute(
+        "INSERT INTO gold_checks (code, amount, max_activations, activated_count, status, created_by, created_at, channel_id, message_id) "
+        "VALUES (?, 10, ?, 0, 'active', 0, ?, ?, 1)",
+        (CHECK_CODE, check_activations, now, CHECK_CHAT_ID),
+    )
+    conn.commit()
+    conn.close()
+
+
+class UpdateTimer:
+    # Outer middleware on dp.update: wall time of every update from dispatch to handler exit,
+    # and from the push into the stand-in to dispatch (intake: getUpdates or webhook)
+    def __init__(self, pushed_at: dict[int, float] | None = None):
+        self.pushed_at = pushed_at if pushed_at is not None else {}
+        self.intake: list[float] = []
+        self.latencies: list[float] = []
+        self.errors = 0
+        self.handled = 0
+        self.expected = 0
+        self.done = asyncio.Event()
+
+    def expect(self, n: int) -> None:
+        self.intake = []
+        self.latencies = []
+        self.errors = 0
+        self.handled = 0
+        self.expected = n
+        self.done.clear()
+
+    async def __call__(self, handler, event, data):
+        started = time.perf_counter()
+        pushed = self.pushed_at.pop(event.update_id, None)
+        if pushed is not None:
+            self.intake.append(started - pushed)
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - started)
+            self.handled += 1
+            if self.handled >= self.expected:
+                self.done.set()
+
+
+def pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def run_phase(server: FakeTelegramServer, timer: UpdateTimer, stats: StmtStats, name: str, push, users: int, timeout: float) -> dict:
+    server.reset_stats()
+    stats.take()
+    timer.expect(users)
+    skipped = TELEGRAM_EDITS_SKIPPED.labels("cached").value
+    started = time.perf_counter()
+    for i in range(users):
+        push(USER_BASE + i)
+    try:
+        await asyncio.wait_for(timer.done.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = time.perf_counter() - started
+    db = stats.take()
+    handled = max(1, timer.handled)
+    return {
+        "phase": name,
+        "updates": users,
+        "handled": timer.handled,
+        "errors": timer.errors,
+        "elapsed": elapsed,
+        "updates_per_s": timer.handled / elapsed if elapsed else 0.0,
+        "p50_ms": pct(timer.latencies, 0.50),
+        "p95_ms": pct(timer.latencies, 0.95),
+        "p99_ms": pct(timer.latencies, 0.99),
+        "intake_p50_ms": pct(timer.intake, 0.50),
+        "intake_p95_ms": pct(timer.intake, 0.95),
+        "db_connections_per_update": (db["connections"] + db["untracked"]) / handled,
+        "db_vm_steps_per_update": db["vm_step"] / handled,
+        "db_fullscan_per_update": db["fullscan_step"] / handled,
+        "api_calls": sum(
+            v
+            for k, v in server.stats.items()
+            if k not in ("getUpdates", "updates_delivered", "flood_429", "not_modified") and not k.startswith("webhook_")
+        ),
+        "flood_429": server.stats.get("flood_429", 0),
+        "not_modified": server.stats.get("not_modified", 0),
+        "edits_skipped": TELEGRAM_EDITS_SKIPPED.labels("cached").value - skipped,
+    }
+
+
+async def run_broadcast(server: FakeTelegramServer, recipients: int, timeout: float) -> dict:
+    admin_id = next(iter(tb.ADMIN_IDS))
+    server.reset_stats()
+    done = server.wait_for(
+        lambda method, params: method == "sendMessage"
+        and str(params.get("chat_id")) == str(admin_id)
+        and str(params.get("text", "")).startswith("Отправлено")
+    )
+    started = time.perf_counter()
+    server.push_message(admin_id, "/broadcast Бенчмарк рассылки")
+    finished = True
+    try:
+        await asyncio.wait_for(asyncio.shield(done), timeout)
+    except asyncio.TimeoutError:
+        finished = False
+    elapsed = time.perf_counter() - started
+    delivered = sum(n for chat, n in server.sent_by_chat.items() if chat != admin_id)
+    rate = delivered / elapsed if elapsed else 0.0
+    return {
+        "recipients": recipients,
+        "finished": finished,
+        "elapsed": elapsed,
+        "delivered": delivered,
+        "msgs_per_s": rate,
+        "eta_s": elapsed if finished else (recipients / rate if rate else float("inf")),
+        "flood_429": server.stats.get("flood_429", 0),
+    }
+
+
+async def run_sim(args) -> None:
+    tmp_dir = tempfile.TemporaryDirectory()
+    db_path = os.path.join(tmp_dir.name, "sim.db")
+    server = FakeTelegramServer(latency_ms=args.latency_ms, global_rate=args.global_rate, chat_rate=args.chat_rate)
+    await server.start()
+
+    stats = StmtStats()
+    db = Database(db_path, connection_factory=stmt_stats_factory(stats))
+    await db.init()
+    seed(db_path, args.users, args.broadcast, args.check_activations or max(1, args.users // 2))
+
+    # Point the module-level bot, DB and live updater of telegram_bot at the stand-ins
+    sim_bot = Bot(token=tb.TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(server.base_url)))
+    if not args.no_edit_cache:
+        tb.install_edit_cache(sim_bot)
+    tb.bot = sim_bot
+    tb.db = db
+    tb.check_updater = LiveMessageUpdater(sim_bot, interval=float(tb.config["telegram"].get("live_edit_interval_seconds", 3)))
+    timer = UpdateTimer(server.pushed_at)
+    tb.dp.update.outer_middleware(timer)
+    webhook = None
+    if args.webhook:
+        # The stand-in POSTs every pushed update to the webhook once setWebhook was called
+        webhook = WebhookServer(tb.dp, sim_bot, secret_token="bench-secret", workers=args.webhook_workers)
+        base_url = await webhook.start(port=0)
+        await sim_bot.set_webhook(base_url + webhook.path, secret_token="bench-secret", max_connections=args.max_connections)
+        polling = asyncio.create_task(asyncio.Event().wait())
+    else:
+        polling = asyncio.create_task(tb.dp.start_polling(sim_bot, handle_signals=False, polling_timeout=1))
+
+    phases = {
+        "start": lambda uid: server.push_message(uid, "/start"),
+        "profile": lambda uid: server.push_callback(uid, "profile", message_id=MENU_MESSAGE_ID),
+        # The same button again on the same message: nothing changed, so nothing to edit
+        "refresh": lambda uid: server.push_callback(uid, "profile", message_id=MENU_MESSAGE_ID),
+        "convert": lambda uid: server.push_callback(uid, "convert_menu"),
+        "withdraw": lambda uid: server.push_callback(uid, "withdraw"),
+        "check": lambda uid: server.push_message(uid, f"/start check_{CHECK_CODE}"),
+    }
+    selected = [p.strip() for p in args.phases.split(",") if p.strip()]
+    try:
+        await asyncio.sleep(0.2)
+        intake = f"webhook, {args.webhook_workers} workers, max_connections {args.max_connections}" if args.webhook else "getUpdates"
+        print(f"Users: {args.users}, Bot API latency: {args.latency_ms:.0f} ms, updates via {intake}")
+        for name in selected:
+            # Keep per-chat flood limits from leaking between phases
+            if args.chat_rate:
+                await asyncio.sleep(1.1 / args.chat_rate)
+            res = await run_phase(server, timer, stats, name, phases[name], args.users, args.timeout)
+            print(
+                f"{res['phase']:<9} {res['handled']:>6}/{res['updates']:<6} {res['updates_per_s']:>7.0f} upd/s  "
+                f"p50/p95/p99 {res['p50_ms']:.1f}/{res['p95_ms']:.1f}/{res['p99_ms']:.1f} ms  "
+                f"intake p50/p95 {res['intake_p50_ms']:.1f}/{res['intake_p95_ms']:.1f} ms  "
+                f"db conn/upd {res['db_connections_per_update']:.1f}  vm/upd {res['db_vm_steps_per_update']:.0f}  "
+                f"scan/upd {res['db_fullscan_per_update']:.0f}  api calls {res['api_calls']}  429 {res['flood_429']}  "
+                f"edits skipped {res['edits_skipped']:.0f}  not modified {res['not_modified']}  "
+                f"errors {res['errors']}",
+                flush=True,
+            )
+        await tb.check_updater.flush()
+
+        if args.broadcast:
+            await asyncio.sleep(1.1)
+            res = await run_broadcast(server, args.broadcast, args.broadcast_timeout)
+            state = "finished" if res["finished"] else f"stopped after {args.broadcast_timeout:.0f}s"
+            print(
+                f"broadcast {res['recipients']} recipients: {state}, delivered {res['delivered']} "
+                f"({res['msgs_per_s']:.1f} msg/s), {'took' if res['finished'] else 'ETA'} {res['eta_s']:.0f}s, "
+                f"429 {res['flood_429']}",
+                flush=True,
+            )
+    finally:
+        if webhook:
+            await webhook.stop()
+        else:
+            await tb.dp.stop_polling()
+        polling.cancel()
+        await asyncio.gather(polling, return_exceptions=True)
+        await sim_bot.session.close()
+        await server.stop()
+        tmp_dir.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate Telegram users against a local Bot API stand-in")
+    parser.add_argument("--users", type=int, default=2000, help="Concurrent users per phase")
+    parser.add_argument("--phases", default="start,profile,refresh,convert,withdraw,check", help="Phases to run in order")
+    parser.add_argument("--no-edit-cache", action="store_true", help="Send every edit to the API (telegram.edit_cache_entries: 0)")
+    parser.add_argument("--check-activations", type=int, default=0, help="max_activations of the check (default: users/2)")
+    parser.add_argument("--broadcast", type=int, default=10000, help="Linked recipients for /broadcast (0 = skip)")
+    parser.add_argument("--broadcast-timeout", type=float, default=60, help="Stop waiting for the broadcast and extrapolate")
+    parser.add_argument("--timeout", type=float, default=120, help="Per-phase timeout")
+    parser.add_argument("--webhook", action="store_true", help="Receive updates through telegram_webhook.WebhookServer instead of getUpdates")
+    parser.add_argument("--webhook-workers", type=int, default=16, help="telegram_webhook.workers")
+    parser.add_argument("--max-connections", type=int, default=40, help="setWebhook max_connections")
+    parser.add_argument("--verbose", action="store_true", help="Log handler exceptions")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if not args.verbose:
+        # Handler failures (flood 429s included) are counted per phase instead of logged
+        logging.getLogger("aiogram.event").setLevel(logging.CRITICAL)
+        logging.getLogger("TelegramWebhook").setLevel(logging.CRITICAL)
+    asyncio.run(run_sim(args))
+
+
+if __name__ == "__main__":
+    main()
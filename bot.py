@@ -6,7 +6,12 @@ import datetime
 import logging
 import re
 import aiosqlite
+import clock
+from chat_recorder import ChatRecorder
 from db import Database
+from eventsub import EventSubClient, eventsub_settings
+from ipc import Bus, BusError, ipc_settings
+from metrics import CHAT_MESSAGES, CLAIMS, DRAWS, EXPIRED
 from telegram_bot import notify_user
 from twitch_helix import HelixClient
 
@@ -17,7 +22,15 @@ GOLD_RE = re.compile(r"^\s*(\d+)\s*GOLD\s*$", re.IGNORECASE)
 
 
 class TwitchBot(commands.Bot):
-    def __init__(self, config: dict, bot_id: str, channel_login: str, channel_id: int | None):
+    def __init__(
+        self,
+        config: dict,
+        bot_id: str,
+        channel_login: str,
+        channel_id: int | None,
+        eventsub: EventSubClient | None = None,
+        bus: Bus | None = None,
+    ):
         self.config = config
         self.db_path = self.config["database"]["db_path"]
         self.db = Database(self.db_path)
@@ -32,12 +45,21 @@ class TwitchBot(commands.Bot):
         self.min_interval_minutes = int(self.config["giveaway"].get("min_interval_minutes", 10))
         self.max_interval_minutes = int(self.config["giveaway"].get("max_interval_minutes", 30))
         self.drops_enabled = 1
-
-        self.helix = HelixClient(
-            client_id=self.config["twitch"]["client_id"],
-            client_secret=self.config["twitch"]["client_secret"],
-            user_token=self.config["twitch"].get("clip_token"),
-        )
+        self.recorder = ChatRecorder.from_config(self.config, self.channel_name)
+        self._chat_metric = CHAT_MESSAGES.labels(self.channel_name)
+        self._claims_metric = CLAIMS.labels(self.channel_name)
+        self._expired_metric = EXPIRED.labels(self.channel_name)
+        self._draws_pending_metric = DRAWS.labels(self.channel_name, "pending")
+        self._draws_instant_metric = DRAWS.labels(self.channel_name, "instant")
+
+        self.helix = HelixClient.from_config(self.config, user_token=self.config["twitch"].get("clip_token"))
+        self.eventsub = eventsub
+        self.eventsub_verify_seconds = eventsub_settings(self.config)["verify_minutes"] * 60
+        self._stream_changed = asyncio.Event()
+        self._stream_polled_at = float("-inf")
+        self.bus = bus
+        self.trigger_poll_seconds = ipc_settings(self.config)["poll_seconds"]
+        self._trigger_wake = asyncio.Event()
 
         raw_token = self.config["twitch"]["bot_token"]
         token_clean = raw_token.replace("oauth:", "") if raw_token.startswith("oauth:") else raw_token
@@ -77,10 +99,7 @@ class TwitchBot(commands.Bot):
             return bot_id
 
         logger.info("bot_id не найден в конфиге, пробуем получить через Helix...")
-        helix = HelixClient(
-            client_id=config["twitch"]["client_id"],
-            client_secret=config["twitch"]["client_secret"],
-        )
+        helix = HelixClient.from_config(config)
         bot_nick = config["twitch"]["bot_nick"]
         try:
             bot_id = await helix.get_user_id(bot_nick)
@@ -121,8 +140,11 @@ class TwitchBot(commands.Bot):
         except Exception as e:
             logger.error(f"Не удалось получить id канала {self.channel_name}: {e}")
             self.channel_user_id = None
+        if self.eventsub is not None and self.channel_user_id:
+            self.eventsub.watch(self.channel_user_id, self.on_stream_event)
 
         await self.apply_channel_settings()
+        self.subscribe_bus()
         
         # Явный джойн к каналу (иногда initial_channels не срабатывает как надо)
         try:
@@ -136,10 +158,11 @@ class TwitchBot(commands.Bot):
             logger.error(f"Ошибка присоединения к каналу {self.channel_name}: {e}")
 
         if not self._tasks:
-            self._tasks.append(asyncio.create_task(self.stream_check_loop()))
-            self._tasks.append(asyncio.create_task(self.giveaway_loop()))
-            self._tasks.append(asyncio.create_task(self.expire_loop()))
-            self._tasks.append(asyncio.create_task(self.instant_giveaway_loop()))
+            # Named so the loop monitor and task dumps can tell the channels apart
+            for loop in (self.stream_check_loop, self.giveaway_loop, self.expire_loop, self.instant_giveaway_loop):
+                self._tasks.append(asyncio.create_task(loop(), name=f"{self.channel_name}:{loop.__name__}"))
+            if self.recorder:
+                self._tasks.append(asyncio.create_task(self.recorder.run(), name=f"{self.channel_name}:recorder"))
 
     async def apply_channel_settings(self):
         if not self.channel_id and self.channel_name:
@@ -173,14 +196,66 @@ class TwitchBot(commands.Bot):
     async def cmd_test(self, ctx: commands.Context):
         await ctx.send(f"@{ctx.author.name}, Тест успешен! Я тут.")
 
+    def bus_topics(self) -> dict:
+        return {
+            f"trigger:{self.channel_id}": self.on_trigger,
+            f"settings:{self.channel_id}": self.on_settings_changed,
+            f"status:{self.channel_id}": self.status,
+        }
+
+    def subscribe_bus(self):
+        if self.bus is not None and self.channel_id:
+            for topic, handler in self.bus_topics().items():
+                self.bus.on(topic, handler)
+
+    def on_trigger(self, data=None):
+        self._trigger_wake.set()
+
+    async def on_settings_changed(self, data=None):
+        await self.apply_channel_settings()
+
+    def status(self, data=None) -> dict:
+        return {
+            "channel": self.channel_name,
+            "online": bool(self.is_stream_online),
+            "drops_enabled": bool(self.drops_enabled),
+            "number_game": bool(self.number_game),
+        }
+
+    async def notify(self, telegram_id: int, text: str):
+        # Through the bus to the Telegram process, as a request: the hub answers once it has
+        # sent the message, so a frame lost with a dropped connection is noticed. Straight to
+        # the Bot API when nobody answers (no bus, hub down, no reply in time)
+        if self.bus is not None:
+            try:
+                await self.bus.request("notify", {"telegram_id": int(telegram_id), "text": text})
+                return
+            except BusError as e:
+                logger.warning(f"Уведомление {telegram_id} через IPC не доставлено ({e}), отправляем напрямую")
+        await notify_user(telegram_id, text)
+
+    async def publish_stream_state(self):
+        if self.bus is not None and self.channel_id:
+            await self.bus.publish("stream", {"channel_id": self.channel_id, "channel": self.channel_name, "online": bool(self.is_stream_online)})
+
     async def close(self):
+        if self.eventsub is not None and self.channel_user_id:
+            self.eventsub.unwatch(self.channel_user_id)
+        if self.bus is not None and self.channel_id:
+            for topic in self.bus_topics():
+                self.bus.off(topic)
         for t in self._tasks:
             t.cancel()
+        if self.recorder:
+            await self.recorder.flush()
         await super().close()
 
     async def event_message(self, message):
         if message.echo:
             return
+        self._chat_metric.inc()
+        if self.recorder:
+            self.recorder.record(message)
 
         content = getattr(message, "content", "") or ""
         author = getattr(message, "author", None)
@@ -235,7 +310,7 @@ class TwitchBot(commands.Bot):
             return
         if not self.channel_user_id:
             return
-        now = datetime.datetime.now()
+        now = clock.now()
         if self.last_clip_at and (now - self.last_clip_at).total_seconds() < self.clip_cooldown_seconds:
             return
         clip_id = await self.helix.create_clip(self.channel_user_id, has_delay=True)
@@ -257,7 +332,7 @@ class TwitchBot(commands.Bot):
         telegram_id = await self.db.verify_twitch_link(author_name.lower(), code)
         if telegram_id:
             await message.channel.send(f"@{author_name}, аккаунт привязан.")
-            await notify_user(telegram_id, f"✅ Twitch аккаунт @{author_name} привязан к Telegram.")
+            await self.notify(telegram_id, f"✅ Twitch аккаунт @{author_name} привязан к Telegram.")
             return
 
         await message.channel.send(f"@{author_name}, код неверный или уже использован.")
@@ -278,14 +353,14 @@ class TwitchBot(commands.Bot):
         telegram_id = await self.db.verify_twitch_link(ctx.author.name.lower(), code)
         if telegram_id:
             await ctx.send(f"@{ctx.author.name}, аккаунт привязан.")
-            await notify_user(telegram_id, f"✅ Twitch аккаунт @{ctx.author.name} привязан к Telegram.")
+            await self.notify(telegram_id, f"✅ Twitch аккаунт @{ctx.author.name} привязан к Telegram.")
             return
 
         await ctx.send(f"@{ctx.author.name}, код неверный или уже использован.")
 
     async def update_active_user(self, username: str):
         async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+            now = clock.now()
             async with db.execute(
                 "SELECT id FROM active_users WHERE nickname = ? AND channel = ?",
                 (username, self.channel_name),
@@ -324,7 +399,7 @@ class TwitchBot(commands.Bot):
         except Exception:
             return
 
-        now = datetime.datetime.now()
+        now = clock.now()
         if guess < int(game["min"]) or guess > int(game["max"]):
             return
 
@@ -367,7 +442,7 @@ class TwitchBot(commands.Bot):
         await message.channel.send(f"@{author_name}, загаданное число {direction}.")
 
     async def claim_pending_draws(self, username: str):
-        now = datetime.datetime.now()
+        now = clock.now()
         async with aiosqlite.connect(self.db_path) as db:
             async with db.execute(
                 """
@@ -390,6 +465,7 @@ class TwitchBot(commands.Bot):
                 draw_ids,
             )
             await db.commit()
+        self._claims_metric.inc(len(draw_ids))
 
         channel = self.get_channel(self.channel_name)
         if channel:
@@ -425,7 +501,7 @@ class TwitchBot(commands.Bot):
                     parts.append(f"🎁 Награды подтверждены:{rewards_list}")
             if not parts:
                 parts.append("✅ Награда подтверждена.")
-            await notify_user(int(telegram_id), "\n\n".join(parts))
+            await self.notify(int(telegram_id), "\n\n".join(parts))
 
     async def stream_check_loop(self):
         await self.wait_for_ready()
@@ -433,8 +509,9 @@ class TwitchBot(commands.Bot):
         delay = 1
         while True:
             try:
+                self._stream_changed.clear()
                 await self.apply_channel_settings()
-                is_online_now = await self.helix.is_stream_online(self.channel_name)
+                is_online_now = await self.check_stream_online()
 
                 if is_online_now and not self.is_stream_online:
                     self.is_stream_online = True
@@ -444,11 +521,13 @@ class TwitchBot(commands.Bot):
                     except Exception as e:
                         logger.error(f"Не удалось создать stream session: {e}")
                         self.current_stream_session_id = None
+                    await self.publish_stream_state()
                     await self.send_stream_start_notifications()
 
                 if (not is_online_now) and self.is_stream_online:
                     self.is_stream_online = False
                     logger.info(f"Стрим {self.channel_name} закончился.")
+                    await self.publish_stream_state()
                     await self.send_stream_summary()
                     planned = await self.db.list_planned_giveaways(self.channel_id, "end")
                     for g in planned:
@@ -466,21 +545,39 @@ class TwitchBot(commands.Bot):
                     self.number_game = None
 
                 delay = 1
-                await asyncio.sleep(self.stream_check_interval_seconds)
+                await clock.wait(self._stream_changed, self.stream_check_interval_seconds)
             except asyncio.CancelledError:
                 raise
             except Exception as e:
                 logger.error(f"Ошибка проверки онлайна стрима: {e}")
-                await asyncio.sleep(min(60, delay))
+                await clock.sleep(min(60, delay))
                 delay = min(60, delay * 2)
 
+    def on_stream_event(self, online: bool):
+        self._stream_changed.set()
+
+    async def check_stream_online(self) -> bool:
+        # With EventSub covering the channel the state comes from notifications; /streams is
+        # polled once to learn the state after subscribing and then every verify_minutes in
+        # case a notification was lost
+        eventsub = self.eventsub
+        if eventsub is None or not self.channel_user_id or not eventsub.covers(self.channel_user_id):
+            return await self.helix.is_stream_online(self.channel_name)
+        state = eventsub.states.get(self.channel_user_id)
+        if state is not None and clock.monotonic() - self._stream_polled_at < self.eventsub_verify_seconds:
+            return state
+        online = await self.helix.is_stream_online(self.channel_name)
+        self._stream_polled_at = clock.monotonic()
+        eventsub.set_state(self.channel_user_id, online)
+        return online
+
     async def giveaway_loop(self):
         await self.wait_for_ready()
 
         while True:
             try:
                 next_minutes = random.randint(15, 30)
-                await asyncio.sleep(next_minutes * 60)
+                await clock.sleep(next_minutes * 60)
 
                 if not self.is_stream_online:
                     continue
@@ -490,15 +587,16 @@ class TwitchBot(commands.Bot):
                 raise
             except Exception as e:
                 logger.error(f"Ошибка цикла розыгрышей: {e}")
-                await asyncio.sleep(5)
+                await clock.sleep(5)
 
     async def instant_giveaway_loop(self):
         await self.wait_for_ready()
         while True:
             try:
                 if not self.channel_id:
-                    await asyncio.sleep(3)
+                    await clock.sleep(3)
                     continue
+                self._trigger_wake.clear()
                 trigger = await self.db.claim_giveaway_trigger(self.channel_id)
                 if trigger:
                     t = trigger.get("trigger_type")
@@ -521,12 +619,16 @@ class TwitchBot(commands.Bot):
                     else:
                         logger.info(f"Мгновенный розыгрыш запрошен: id={trigger['id']} by={trigger['requested_by']}")
                         await self.run_admin_giveaway_immediate()
-                await asyncio.sleep(3)
+                    continue
+                # The row stays the source of truth; the bus only says when to look. Without
+                # it (or while the hub is down) the table is polled every 3 s as before
+                connected = self.bus is not None and self.bus.connected
+                await clock.wait(self._trigger_wake, self.trigger_poll_seconds if connected else 3)
             except asyncio.CancelledError:
                 raise
             except Exception as e:
                 logger.error(f"Ошибка мгновенного розыгрыша: {e}")
-                await asyncio.sleep(3)
+                await clock.sleep(3)
 
     async def get_eligible_viewers(self, min_seconds: int = 600) -> list[str]:
         if not self.is_stream_online or not self.current_stream_session_id:
@@ -549,6 +651,7 @@ class TwitchBot(commands.Bot):
         reward_name = reward["name"] or ""
 
         draw_id = await self.db.create_draw_claimed(self.channel_name, winner, int(reward_id), notified_in_tg=1)
+        self._draws_instant_metric.inc()
 
         telegram_id = await self.db.get_telegram_id_by_twitch_username(winner)
         m = GOLD_RE.match(reward_name or "")
@@ -557,10 +660,10 @@ class TwitchBot(commands.Bot):
                 amount = int(m.group(1))
                 credited = await self.db.credit_gold_once(int(telegram_id), amount, "draw", int(draw_id))
                 if credited:
-                    await notify_user(int(telegram_id), f"💰 Начислено: {amount} GOLD")
+                    await self.notify(int(telegram_id), f"💰 Начислено: {amount} GOLD")
             else:
                 await self.db.record_item_claim(int(draw_id), int(telegram_id), winner, reward_name)
-                await notify_user(int(telegram_id), f"🎁 Ты выиграл: {reward_name}")
+                await self.notify(int(telegram_id), f"🎁 Ты выиграл: {reward_name}")
 
     async def run_admin_giveaway_immediate(self):
         if not self.is_stream_online or not self.drops_enabled or not self.channel_id:
@@ -642,7 +745,7 @@ class TwitchBot(commands.Bot):
             "number": number,
             "min": min_value,
             "max": max_value,
-            "started_at": datetime.datetime.now(),
+            "started_at": clock.now(),
             "last_hint_at": None,
             "last_hint_by_user": {},
         }
@@ -660,19 +763,20 @@ class TwitchBot(commands.Bot):
         while True:
             try:
                 expired = await self.db.expire_pending_draws()
+                self._expired_metric.inc(len(expired))
                 for row in expired:
                     nickname, reward_name, telegram_id = row
                     if telegram_id:
-                        await notify_user(
+                        await self.notify(
                             telegram_id,
                             f"⏳ Награда \"{reward_name}\" сгорела, причина: афк фарм.",
                         )
-                await asyncio.sleep(30)
+                await clock.sleep(30)
             except asyncio.CancelledError:
                 raise
             except Exception as e:
                 logger.error(f"Ошибка обработки истёкших наград: {e}")
-                await asyncio.sleep(5)
+                await clock.sleep(5)
 
     async def send_stream_start_notifications(self):
         telegram_ids = await self.db.get_all_linked_telegram_ids()
@@ -685,8 +789,8 @@ class TwitchBot(commands.Bot):
             "Заходи в чат, чтобы участвовать в дропах."
         )
         for tg_id in telegram_ids:
-            await notify_user(tg_id, text)
-            await asyncio.sleep(0.03)
+            await self.notify(tg_id, text)
+            await clock.sleep(0.03)
 
     async def send_stream_summary(self):
         pending = await self.db.get_pending_notifications()
@@ -703,7 +807,7 @@ class TwitchBot(commands.Bot):
         for tg_id, data in notifications.items():
             rewards_list = "\n- " + "\n- ".join(data["rewards"])
             msg = f"🏁 Стрим закончился! Вот что ты получил за просмотр:{rewards_list}"
-            await notify_user(tg_id, msg)
+            await self.notify(tg_id, msg)
             await self.db.mark_notified(data["draw_ids"])
 
     async def run_giveaway(self):
@@ -743,7 +847,7 @@ class TwitchBot(commands.Bot):
 
     async def get_active_users(self):
         async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+            now = clock.now()
             limit_time = now - datetime.timedelta(minutes=self.active_timeout)
             async with db.execute(
                 "SELECT nickname FROM active_users WHERE channel = ? AND last_active_at >= ?",
@@ -764,7 +868,7 @@ class TwitchBot(commands.Bot):
 
     async def record_draw_pending(self, winner: str, reward_id: int):
         async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+            now = clock.now()
             expires_at = now + datetime.timedelta(minutes=self.claim_timeout)
             await db.execute(
                 """
@@ -774,3 +878,4 @@ class TwitchBot(commands.Bot):
                 (self.channel_name, winner, reward_id, now, expires_at),
             )
             await db.commit()
+        self._draws_pending_metric.inc()
@@ -0,0 +1,189 @@
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import time
+
+
+logger = logging.getLogger("ChatRecorder")
+
+SEGMENT_NAME_RE = re.compile(r"^chat-(?P<channel>.+)-(?P<stamp>\d{8}-\d{6})\.jsonl\.gz$")
+AUTHOR_FIELDS = ("name", "display_name", "id", "is_broadcaster", "is_mod", "is_subscriber", "is_vip", "is_turbo")
+
+
+def recording_settings(config: dict) -> dict:
+    raw = config.get("recording") or {}
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "dir": raw.get("dir") or "recordings",
+        "segment_mb": float(raw.get("segment_mb", 64)),
+        "segment_minutes": float(raw.get("segment_minutes", 60)),
+        "flush_seconds": float(raw.get("flush_seconds", 2)),
+        "keep_segments": int(raw.get("keep_segments", 0)),
+    }
+
+
+def message_record(message, channel: str, ts: float | None = None) -> dict:
+    author = getattr(message, "author", None)
+    author_data = None
+    if author is not None:
+        author_data = {}
+        for field in AUTHOR_FIELDS:
+            try:
+                value = getattr(author, field, None)
+            except Exception:
+                value = None
+            if value is not None:
+                author_data[field] = value
+    tags = getattr(message, "tags", None) or {}
+    return {
+        "ts": time.time() if ts is None else ts,
+        "channel": channel,
+        "author": author_data,
+        "tags": {str(k): v for k, v in tags.items()},
+        "content": getattr(message, "content", "") or "",
+    }
+
+
+class ChatRecorder:
+    # Records incoming chat into gzip JSONL segments. record() only appends to an in-memory
+    # buffer; the buffer is written from a worker thread every flush_seconds, one gzip member
+    # per flush, so a crash loses at most the last flush window and a segment stays readable.
+    def __init__(
+        self,
+        directory: str,
+        channel: str,
+        segment_mb: float = 64,
+        segment_minutes: float = 60,
+        flush_seconds: float = 2,
+        keep_segments: int = 0,
+    ):
+        self.directory = directory
+        self.channel = channel
+        self.segment_bytes = int(segment_mb * 1024 * 1024)
+        self.segment_seconds = float(segment_minutes) * 60
+        self.flush_seconds = max(0.1, float(flush_seconds))
+        self.keep_segments = int(keep_segments)
+
+        self.recorded = 0
+        self.dropped = 0
+        self._buffer: list[str] = []
+        self._segment_path: str | None = None
+        self._segment_started = 0.0
+        self._segment_size = 0
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict, channel: str) -> "ChatRecorder | None":
+        settings = recording_settings(config)
+        if not settings["enabled"]:
+            return None
+        return cls(
+            settings["dir"],
+            channel,
+            segment_mb=settings["segment_mb"],
+            segment_minutes=settings["segment_minutes"],
+            flush_seconds=settings["flush_seconds"],
+            keep_segments=settings["keep_segments"],
+        )
+
+    def record(self, message) -> None:
+        try:
+            line = json.dumps(message_record(message, self.channel), ensure_ascii=False, default=str)
+        except Exception:
+            self.dropped += 1
+            return
+        self._buffer.append(line)
+        self.recorded += 1
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if not self._buffer:
+                return
+            lines, self._buffer = self._buffer, []
+            await asyncio.to_thread(self._write, lines)
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await asyncio.sleep(self.flush_seconds)
+                await self.flush()
+            except asyncio.CancelledError:
+                await self.flush()
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка записи чата {self.channel}: {e}")
+
+    def _new_segment(self) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"chat-{self.channel}-{stamp}.jsonl.gz")
+
+    def _write(self, lines: list[str]) -> None:
+        now = time.time()
+        if (
+            self._segment_path is None
+            or self._segment_size >= self.segment_bytes
+            or now - self._segment_started >= self.segment_seconds
+        ):
+            if self._segment_path is not None:
+                logger.info(f"Сегмент записи чата закрыт: {self._segment_path} ({self._segment_size} байт)")
+            self._segment_path = self._new_segment()
+            self._segment_started = now
+            self._segment_size = 0
+            self._prune()
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        with open(self._segment_path, "ab") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="ab", compresslevel=6) as f:
+                f.write(data)
+            # segment_mb limits the file on disk, i.e. the compressed size
+            self._segment_size = raw.tell()
+
+    def _prune(self) -> None:
+        if self.keep_segments <= 0:
+            return
+        segments = list_segments(self.directory, self.channel)
+        for path in segments[: max(0, len(segments) - self.keep_segments + 1)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить сегмент {path}: {e}")
+
+
+def list_segments(directory: str, channel: str | None = None) -> list[str]:
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in os.listdir(directory):
+        m = SEGMENT_NAME_RE.match(name)
+        if not m or (channel and m.group("channel") != channel):
+            continue
+        found.append(os.path.join(directory, name))
+    return sorted(found)
+
+
+def read_segments(paths: list[str]) -> list[dict]:
+    # Records from segment files or directories of segments, ordered by ts
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(list_segments(path))
+        else:
+            files.append(path)
+    records = []
+    for path in files:
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        records.append(json.loads(line))
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError) as e:
+            # Segment cut short by a crash: keep what was flushed before it
+            logger.warning(f"Сегмент {path} обрезан: {e}")
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records
@@ -0,0 +1,81 @@
+import asyncio
+import datetime
+import time
+
+
+class SystemClock:
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.now()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+    async def wait(self, event: asyncio.Event, seconds: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+class ScaledClock:
+    # Virtual time running `speed` times faster than the wall clock, starting at `start`.
+    # sleep(s) waits s / speed real seconds, so a 15-30 minute giveaway_loop pause takes
+    # under a second at speed 2000 while every timestamp written to the DB stays consistent.
+    def __init__(self, speed: float, start: datetime.datetime | None = None):
+        if speed <= 0:
+            raise ValueError("speed must be positive")
+        self.speed = float(speed)
+        self.start = start or datetime.datetime.now()
+        self._origin = time.monotonic()
+
+    def elapsed(self) -> float:
+        return (time.monotonic() - self._origin) * self.speed
+
+    def now(self) -> datetime.datetime:
+        return self.start + datetime.timedelta(seconds=self.elapsed())
+
+    def monotonic(self) -> float:
+        return self.elapsed()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(max(0.0, seconds) / self.speed)
+
+    async def wait(self, event: asyncio.Event, seconds: float) -> bool:
+        try:
+            await asyncio.wait_for(event.wait(), max(0.0, seconds) / self.speed)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+_clock: SystemClock | ScaledClock = SystemClock()
+
+
+def install(new_clock: SystemClock | ScaledClock | None) -> None:
+    global _clock
+    _clock = new_clock or SystemClock()
+
+
+def current() -> SystemClock | ScaledClock:
+    return _clock
+
+
+def now() -> datetime.datetime:
+    return _clock.now()
+
+
+def monotonic() -> float:
+    return _clock.monotonic()
+
+
+async def sleep(seconds: float) -> None:
+    await _clock.sleep(seconds)
+
+
+async def wait(event: asyncio.Event, seconds: float) -> bool:
+    # Sleeps like sleep() but returns early, with True, once the event is set
+    return await _clock.wait(event, seconds)
@@ -1,279 +1,467 @@
 import aiosqlite
+import asyncio
 import datetime
 import logging
+import sqlite3
+from collections import OrderedDict
+
+import clock
 
 logger = logging.getLogger("Database")
 
+CHECK_CLAIM_BATCH = 200
+
+# (version, Database method). init() applies the ones above PRAGMA user_version in order
+# and bumps it after each; a database already at SCHEMA_VERSION costs a single PRAGMA.
+# Append new steps here, never edit an applied one.
+MIGRATIONS = (
+    (1, "create_base_schema"),
+    (2, "create_backfills_table"),
+    (3, "create_retention_totals_table"),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Shared with retention.py, which may run on a database the bot has not migrated yet
+RETENTION_TOTALS_SQL = """
+    CREATE TABLE IF NOT EXISTS retention_totals (
+        table_name TEXT PRIMARY KEY,
+        removed INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+class CheckReservations:
+    # In-memory counter of free activations per GOLD check. Lets a burst of deep-link
+    # presses on a finished check be rejected without touching SQLite; the conditional
+    # UPDATE in Database._claim_gold_check stays the source of truth. The least recently
+    # used idle checks are dropped beyond max_entries; a dropped one is reloaded on demand.
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = int(max_entries)
+        self._checks: OrderedDict[str, dict] = OrderedDict()
+
+    def known(self, code: str) -> bool:
+        if code not in self._checks:
+            return False
+        self._checks.move_to_end(code)
+        return True
+
+    def _trim(self) -> None:
+        # Checks with claims in flight or waiters stay, whatever their age
+        excess = len(self._checks) - self.max_entries
+        idle = []
+        for code, state in self._checks.items():
+            if len(idle) >= excess:
+                break
+            if not state["inflight"] and not state["waiters"]:
+                idle.append(code)
+        for code in idle:
+            del self._checks[code]
+
+    def load(self, code: str, check: dict) -> None:
+        if code in self._checks:
+            return
+        self._checks[code] = {
+            "info": {
+                "check_id": int(check["id"]),
+                "amount": int(check["amount"]),
+                "max_activations": int(check["max_activations"]),
+                "activated_count": int(check["activated_count"]),
+                "channel_id": check.get("channel_id"),
+                "message_id": check.get("message_id"),
+            },
+            "status": check.get("status") or "active",
+            "remaining": int(check["max_activations"]) - int(check["activated_count"]),
+            "inflight": 0,
+            "waiters": [],
+        }
+        if len(self._checks) > self.max_entries:
+            self._trim()
+
+    def rejection(self, code: str) -> dict | None:
+        state = self._checks.get(code)
+        if not state:
+            return None
+        if state["status"] not in ("active", "finished"):
+            return {**state["info"], "status": "inactive"}
+        if state["status"] == "finished" or state["remaining"] <= 0:
+            return {**state["info"], "status": "finished"}
+        return None
+
+    def reserve(self, code: str) -> bool:
+        state = self._checks.get(code)
+        if not state:
+            return True
+        if state["remaining"] - state["inflight"] <= 0:
+            return False
+        state["inflight"] += 1
+        return True
+
+    def wait(self, code: str) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        state = self._checks.get(code)
+        if state:
+            state["waiters"].append(fut)
+        else:
+            fut.set_result(None)
+        return fut
+
+    def release(self, code: str) -> None:
+        state = self._checks.get(code)
+        if not state:
+            return
+        if state["inflight"] > 0:
+            state["inflight"] -= 1
+        waiters, state["waiters"] = state["waiters"], []
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(None)
+
+    def update(self, code: str, result: dict) -> None:
+        state = self._checks.get(code)
+        if not state:
+            return
+        status = result.get("status")
+        if status == "not_found":
+            self._checks.pop(code, None)
+            return
+        if "activated_count" in result:
+            count = int(result["activated_count"])
+            state["info"]["activated_count"] = max(state["info"]["activated_count"], count)
+            state["remaining"] = min(state["remaining"], int(state["info"]["max_activations"]) - count)
+        if status == "finished":
+            state["status"] = "finished"
+            state["remaining"] = 0
+        elif status == "inactive":
+            state["status"] = "inactive"
+        elif state["remaining"] <= 0:
+            state["status"] = "finished"
+
+
 class Database:
-    def __init__(self, db_path):
+    # Used when an instance has no connection_factory of its own (query profiling)
+    default_connection_factory: type[sqlite3.Connection] | None = None
+
+    def __init__(self, db_path, connection_factory: type[sqlite3.Connection] | None = None):
         self.db_path = db_path
+        # Optional sqlite3.Connection subclass for every connection (benchmarks, profiling)
+        self.connection_factory = connection_factory
+        self.check_reservations = CheckReservations()
+        self._check_claim_queue: list[tuple[str, int, asyncio.Future]] = []
+        self._check_claim_task: asyncio.Task | None = None
+
+    def _connect(self) -> aiosqlite.Connection:
+        factory = self.connection_factory or self.default_connection_factory
+        if factory is None:
+            return aiosqlite.connect(self.db_path)
+        return aiosqlite.connect(self.db_path, factory=factory)
 
     async def init(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            # Active Users
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS active_users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel TEXT,
-                    nickname TEXT,
-                    last_active_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS watch_time (
-                    channel TEXT NOT NULL,
-                    nickname TEXT NOT NULL,
-                    seconds INTEGER NOT NULL DEFAULT 0,
-                    last_seen_at DATETIME,
-                    PRIMARY KEY(channel, nickname)
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS stream_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel TEXT NOT NULL,
-                    started_at DATETIME,
-                    ended_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS stream_watch_time (
-                    session_id INTEGER NOT NULL,
-                    nickname TEXT NOT NULL,
-                    seconds INTEGER NOT NULL DEFAULT 0,
-                    last_seen_at DATETIME,
-                    PRIMARY KEY(session_id, nickname),
-                    FOREIGN KEY(session_id) REFERENCES stream_sessions(id)
-                )
-            ''')
-            
-            # Rewards
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS rewards (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel_id INTEGER,
-                    name TEXT,
-                    description TEXT,
-                    weight INTEGER,
-                    quantity INTEGER DEFAULT 1,
-                    enabled INTEGER DEFAULT 1
-                )
-            ''')
-            
-            # Draws (Updated)
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS draws (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel TEXT,
-                    nickname TEXT,
-                    reward_id INTEGER,
-                    created_at DATETIME,
-                    status TEXT DEFAULT 'pending', -- pending, claimed, expired
-                    expires_at DATETIME,
-                    notified_in_tg INTEGER DEFAULT 0,
-                    FOREIGN KEY(reward_id) REFERENCES rewards(id)
-                )
-            ''')
-
-            # Telegram Users
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS telegram_users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE,
-                    twitch_username TEXT,
-                    verification_code TEXT,
-                    created_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS withdrawals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    telegram_username TEXT,
-                    item_name TEXT NOT NULL,
-                    photo_file_id TEXT NOT NULL,
-                    price TEXT NOT NULL,
-                    pattern TEXT NOT NULL,
-                    status TEXT DEFAULT 'pending',
-                    reason TEXT,
-                    created_at DATETIME,
-                    decided_at DATETIME,
-                    admin_id INTEGER,
-                    admin_chat_id INTEGER,
-                    admin_message_id INTEGER
-                )
-            ''')
+        async with self._connect() as db:
+            # WAL lets readers run alongside the single writer (check activations, chat updates)
+            await db.execute("PRAGMA journal_mode=WAL")
+            async with db.execute("PRAGMA user_version") as cursor:
+                version = (await cursor.fetchone())[0]
+            if version >= SCHEMA_VERSION:
+                logger.info(f"Database initialized (schema v{version}).")
+                return
+            for target, name in MIGRATIONS:
+                if target <= version:
+                    continue
+                # Several processes may start at once: the version is re-read under the write
+                # lock, so each migration runs exactly once
+                await db.execute("BEGIN IMMEDIATE")
+                try:
+                    async with db.execute("PRAGMA user_version") as cursor:
+                        current = (await cursor.fetchone())[0]
+                    if current < target:
+                        await getattr(self, name)(db)
+                        await db.execute(f"PRAGMA user_version = {int(target)}")
+                        logger.info(f"Схема базы обновлена до v{target} ({name})")
+                    await db.execute("COMMIT")
+                except Exception:
+                    await db.execute("ROLLBACK")
+                    raise
+                version = max(version, target)
+            logger.info(f"Database initialized (schema v{version}).")
+
+    async def create_base_schema(self, db):
+        # v1: every table as of the first versioned release. Databases created before
+        # versioning also pass through here: IF NOT EXISTS keeps their tables and the
+        # migrate_* probes add the columns they may lack.
+
+        # Active Users
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS active_users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT,
+                nickname TEXT,
+                last_active_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS watch_time (
+                channel TEXT NOT NULL,
+                nickname TEXT NOT NULL,
+                seconds INTEGER NOT NULL DEFAULT 0,
+                last_seen_at DATETIME,
+                PRIMARY KEY(channel, nickname)
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS stream_sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT NOT NULL,
+                started_at DATETIME,
+                ended_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS stream_watch_time (
+                session_id INTEGER NOT NULL,
+                nickname TEXT NOT NULL,
+                seconds INTEGER NOT NULL DEFAULT 0,
+                last_seen_at DATETIME,
+                PRIMARY KEY(session_id, nickname),
+                FOREIGN KEY(session_id) REFERENCES stream_sessions(id)
+            )
+        ''')
+        
+        # Rewards
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS rewards (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id INTEGER,
+                name TEXT,
+                description TEXT,
+                weight INTEGER,
+                quantity INTEGER DEFAULT 1,
+                enabled INTEGER DEFAULT 1
+            )
+        ''')
+        
+        # Draws (Updated)
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS draws (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel TEXT,
+                nickname TEXT,
+                reward_id INTEGER,
+                created_at DATETIME,
+                status TEXT DEFAULT 'pending', -- pending, claimed, expired
+                expires_at DATETIME,
+                notified_in_tg INTEGER DEFAULT 0,
+                FOREIGN KEY(reward_id) REFERENCES rewards(id)
+            )
+        ''')
+
+        # Telegram Users
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS telegram_users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER UNIQUE,
+                twitch_username TEXT,
+                verification_code TEXT,
+                created_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS withdrawals (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER NOT NULL,
+                telegram_username TEXT,
+                item_name TEXT NOT NULL,
+                photo_file_id TEXT NOT NULL,
+                price TEXT NOT NULL,
+                pattern TEXT NOT NULL,
+                status TEXT DEFAULT 'pending',
+                reason TEXT,
+                created_at DATETIME,
+                decided_at DATETIME,
+                admin_id INTEGER,
+                admin_chat_id INTEGER,
+                admin_message_id INTEGER
+            )
+        ''')
 
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS gold_balances (
-                    telegram_id INTEGER PRIMARY KEY,
-                    balance INTEGER NOT NULL DEFAULT 0,
-                    updated_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS gold_transactions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    amount INTEGER NOT NULL,
-                    source_type TEXT NOT NULL,
-                    source_id INTEGER NOT NULL,
-                    created_at DATETIME,
-                    UNIQUE(telegram_id, source_type, source_id)
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS check_channels (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chat_id INTEGER UNIQUE,
-                    title TEXT,
-                    created_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS gold_checks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    code TEXT UNIQUE,
-                    amount INTEGER NOT NULL,
-                    max_activations INTEGER NOT NULL,
-                    activated_count INTEGER NOT NULL DEFAULT 0,
-                    status TEXT NOT NULL DEFAULT 'active',
-                    created_by INTEGER,
-                    created_at DATETIME,
-                    channel_id INTEGER,
-                    message_id INTEGER
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS gold_check_activations (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    check_id INTEGER NOT NULL,
-                    telegram_id INTEGER NOT NULL,
-                    activated_at DATETIME,
-                    UNIQUE(check_id, telegram_id),
-                    FOREIGN KEY(check_id) REFERENCES gold_checks(id)
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS giveaway_triggers (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    requested_by INTEGER,
-                    created_at DATETIME,
-                    processed_at DATETIME,
-                    trigger_type TEXT DEFAULT 'random',
-                    channel_id INTEGER,
-                    reward_id INTEGER,
-                    winners_count INTEGER,
-                    planned_giveaway_id INTEGER,
-                    guess_number INTEGER,
-                    guess_min INTEGER,
-                    guess_max INTEGER
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS planned_giveaways (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    channel_id INTEGER,
-                    reward_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    winners_count INTEGER NOT NULL DEFAULT 1,
-                    status TEXT NOT NULL DEFAULT 'planned',
-                    created_by INTEGER,
-                    created_at DATETIME,
-                    triggered_at DATETIME,
-                    FOREIGN KEY(reward_id) REFERENCES rewards(id)
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS item_claims (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    draw_id INTEGER UNIQUE,
-                    telegram_id INTEGER NOT NULL,
-                    twitch_username TEXT,
-                    reward_name TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'available',
-                    claimed_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS conversion_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    telegram_username TEXT,
-                    draw_id INTEGER NOT NULL,
-                    reward_name TEXT NOT NULL,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    requested_at DATETIME,
-                    decided_at DATETIME,
-                    admin_id INTEGER,
-                    gold_amount INTEGER,
-                    reason TEXT,
-                    admin_chat_id INTEGER,
-                    admin_message_id INTEGER,
-                    UNIQUE(draw_id)
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS channels (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    login TEXT UNIQUE,
-                    owner_telegram_id INTEGER,
-                    enabled INTEGER NOT NULL DEFAULT 1,
-                    created_at DATETIME
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS channel_settings (
-                    channel_id INTEGER PRIMARY KEY,
-                    min_interval_minutes INTEGER,
-                    max_interval_minutes INTEGER,
-                    active_timeout_minutes INTEGER,
-                    claim_timeout_minutes INTEGER,
-                    drops_enabled INTEGER DEFAULT 1,
-                    updated_at DATETIME,
-                    FOREIGN KEY(channel_id) REFERENCES channels(id)
-                )
-            ''')
-
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS channel_requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER NOT NULL,
-                    telegram_username TEXT,
-                    twitch_login TEXT NOT NULL,
-                    contact TEXT,
-                    note TEXT,
-                    status TEXT NOT NULL DEFAULT 'pending',
-                    created_at DATETIME,
-                    admin_chat_id INTEGER,
-                    admin_message_id INTEGER
-                )
-            ''')
-
-            # Migrations
-            await self.migrate_draws_table(db)
-            await self.migrate_withdrawals_table(db)
-            await self.migrate_gold_tables(db)
-            await self.migrate_giveaway_triggers_table(db)
-            await self.migrate_rewards_table(db)
-            await self.migrate_planned_giveaways_table(db)
-            
-            await db.commit()
-            logger.info("Database initialized.")
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS gold_balances (
+                telegram_id INTEGER PRIMARY KEY,
+                balance INTEGER NOT NULL DEFAULT 0,
+                updated_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS gold_transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER NOT NULL,
+                amount INTEGER NOT NULL,
+                source_type TEXT NOT NULL,
+                source_id INTEGER NOT NULL,
+                created_at DATETIME,
+                UNIQUE(telegram_id, source_type, source_id)
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS check_channels (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER UNIQUE,
+                title TEXT,
+                created_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS gold_checks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                code TEXT UNIQUE,
+                amount INTEGER NOT NULL,
+                max_activations INTEGER NOT NULL,
+                activated_count INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'active',
+                created_by INTEGER,
+                created_at DATETIME,
+                channel_id INTEGER,
+                message_id INTEGER
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS gold_check_activations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                check_id INTEGER NOT NULL,
+                telegram_id INTEGER NOT NULL,
+                activated_at DATETIME,
+                UNIQUE(check_id, telegram_id),
+                FOREIGN KEY(check_id) REFERENCES gold_checks(id)
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS giveaway_triggers (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                requested_by INTEGER,
+                created_at DATETIME,
+                processed_at DATETIME,
+                trigger_type TEXT DEFAULT 'random',
+                channel_id INTEGER,
+                reward_id INTEGER,
+                winners_count INTEGER,
+                planned_giveaway_id INTEGER,
+                guess_number INTEGER,
+                guess_min INTEGER,
+                guess_max INTEGER
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS planned_giveaways (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                channel_id INTEGER,
+                reward_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                winners_count INTEGER NOT NULL DEFAULT 1,
+                status TEXT NOT NULL DEFAULT 'planned',
+                created_by INTEGER,
+                created_at DATETIME,
+                triggered_at DATETIME,
+                FOREIGN KEY(reward_id) REFERENCES rewards(id)
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS item_claims (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                draw_id INTEGER UNIQUE,
+                telegram_id INTEGER NOT NULL,
+                twitch_username TEXT,
+                reward_name TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'available',
+                claimed_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS conversion_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER NOT NULL,
+                telegram_username TEXT,
+                draw_id INTEGER NOT NULL,
+                reward_name TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                requested_at DATETIME,
+                decided_at DATETIME,
+                admin_id INTEGER,
+                gold_amount INTEGER,
+                reason TEXT,
+                admin_chat_id INTEGER,
+                admin_message_id INTEGER,
+                UNIQUE(draw_id)
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS channels (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                login TEXT UNIQUE,
+                owner_telegram_id INTEGER,
+                enabled INTEGER NOT NULL DEFAULT 1,
+                created_at DATETIME
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS channel_settings (
+                channel_id INTEGER PRIMARY KEY,
+                min_interval_minutes INTEGER,
+                max_interval_minutes INTEGER,
+                active_timeout_minutes INTEGER,
+                claim_timeout_minutes INTEGER,
+                drops_enabled INTEGER DEFAULT 1,
+                updated_at DATETIME,
+                FOREIGN KEY(channel_id) REFERENCES channels(id)
+            )
+        ''')
+
+        await db.execute('''
+            CREATE TABLE IF NOT EXISTS channel_requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                telegram_id INTEGER NOT NULL,
+                telegram_username TEXT,
+                twitch_login TEXT NOT NULL,
+                contact TEXT,
+                note TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                created_at DATETIME,
+                admin_chat_id INTEGER,
+                admin_message_id INTEGER
+            )
+        ''')
+
+        # Migrations
+        await self.migrate_draws_table(db)
+        await self.migrate_withdrawals_table(db)
+        await self.migrate_gold_tables(db)
+        await self.migrate_giveaway_triggers_table(db)
+        await self.migrate_rewards_table(db)
+        await self.migrate_planned_giveaways_table(db)
+
+    async def create_backfills_table(self, db):
+        # v2: one-time data fixes that need runtime input (e.g. the default channel id)
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS backfills (
+                name TEXT PRIMARY KEY,
+                applied_at DATETIME
+            )
+        """)
+
+    async def create_retention_totals_table(self, db):
+        # v3: rows retention.py moved out of each table, so all-time totals survive it
+        await db.execute(RETENTION_TOTALS_SQL)
 
     async def migrate_draws_table(self, db):
         async with db.execute("PRAGMA table_info(draws)") as cursor:
@@ -355,7 +543,7 @@ class Database:
             await db.execute("ALTER TABLE planned_giveaways ADD COLUMN channel_id INTEGER")
 
     async def get_telegram_user(self, telegram_id):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("SELECT * FROM telegram_users WHERE telegram_id = ?", (telegram_id,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
@@ -369,8 +557,8 @@ class Database:
                 return None
 
     async def create_telegram_verification(self, telegram_id, code):
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             # Upsert
             await db.execute("""
                 INSERT INTO telegram_users (telegram_id, verification_code, created_at) 
@@ -380,7 +568,7 @@ class Database:
             await db.commit()
 
     async def verify_twitch_link(self, twitch_username, code):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("SELECT telegram_id FROM telegram_users WHERE verification_code = ?", (code,)) as cursor:
                 row = await cursor.fetchone()
                 if row:
@@ -391,7 +579,7 @@ class Database:
                 return None
     
     async def get_user_stats(self, twitch_username):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             # Count wins
             async with db.execute("SELECT COUNT(*) FROM draws WHERE nickname = ? AND status = 'claimed'", (twitch_username,)) as cursor:
                 wins = (await cursor.fetchone())[0]
@@ -409,7 +597,7 @@ class Database:
             return {'wins': wins, 'last_win': last_win}
 
     async def get_pending_notifications(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("""
                 SELECT d.id, d.nickname, r.name, tu.telegram_id
                 FROM draws d
@@ -422,13 +610,13 @@ class Database:
     async def mark_notified(self, draw_ids):
         if not draw_ids:
             return
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             placeholders = ','.join('?' * len(draw_ids))
             await db.execute(f"UPDATE draws SET notified_in_tg = 1 WHERE id IN ({placeholders})", draw_ids)
             await db.commit()
 
     async def get_telegram_id_by_twitch_username(self, twitch_username: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT telegram_id FROM telegram_users WHERE twitch_username = ?",
                 (twitch_username,),
@@ -437,7 +625,7 @@ class Database:
                 return row[0] if row else None
 
     async def get_all_linked_telegram_ids(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT telegram_id FROM telegram_users WHERE twitch_username IS NOT NULL"
             ) as cursor:
@@ -445,8 +633,8 @@ class Database:
                 return [row[0] for row in rows]
 
     async def expire_pending_draws(self):
-        now = datetime.datetime.now()
-        async with aiosqlite.connect(self.db_path) as db:
+        now = clock.now()
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT d.id, d.nickname, r.name, tu.telegram_id
@@ -473,22 +661,28 @@ class Database:
         return [(row[1], row[2], row[3]) for row in rows]
 
     async def get_linked_users_count(self):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT COUNT(*) FROM telegram_users WHERE twitch_username IS NOT NULL"
             ) as cursor:
                 return (await cursor.fetchone())[0]
 
     async def get_total_draws_count(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.execute("SELECT COUNT(*) FROM draws") as cursor:
+        # Expired draws archived by retention still count
+        async with self._connect() as db:
+            async with db.execute(
+                """
+                SELECT (SELECT COUNT(*) FROM draws)
+                    + COALESCE((SELECT removed FROM retention_totals WHERE table_name = 'draws'), 0)
+                """
+            ) as cursor:
                 return (await cursor.fetchone())[0]
 
     async def ensure_channel(self, login: str, owner_telegram_id: int | None = None, enabled: int = 1) -> int:
         login = (login or "").strip().lower()
         if not login:
             raise ValueError("bad channel login")
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute("SELECT id, owner_telegram_id FROM channels WHERE login = ?", (login,)) as cursor:
                 row = await cursor.fetchone()
             if row:
@@ -499,7 +693,7 @@ class Database:
                     )
                     await db.commit()
                 return int(row[0])
-            now = datetime.datetime.now()
+            now = clock.now()
             cur = await db.execute(
                 "INSERT INTO channels (login, owner_telegram_id, enabled, created_at) VALUES (?, ?, ?, ?)",
                 (login, owner_telegram_id, int(enabled), now),
@@ -511,7 +705,7 @@ class Database:
         login = (login or "").strip().lower()
         if not login:
             return None
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT id, login, owner_telegram_id, enabled FROM channels WHERE login = ?",
                 (login,),
@@ -527,7 +721,7 @@ class Database:
             }
 
     async def get_channel_by_id(self, channel_id: int) -> dict | None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT id, login, owner_telegram_id, enabled FROM channels WHERE id = ?",
                 (int(channel_id),),
@@ -543,7 +737,7 @@ class Database:
             }
 
     async def list_enabled_channels(self) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT id, login, owner_telegram_id FROM channels WHERE enabled = 1 ORDER BY id ASC"
             ) as cursor:
@@ -558,7 +752,7 @@ class Database:
             ]
 
     async def list_all_channels(self) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT id, login, owner_telegram_id, enabled FROM channels ORDER BY id ASC"
             ) as cursor:
@@ -574,7 +768,7 @@ class Database:
             ]
 
     async def list_channels_by_owner(self, telegram_id: int) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT id, login, enabled FROM channels WHERE owner_telegram_id = ? ORDER BY id ASC",
                 (int(telegram_id),),
@@ -583,23 +777,41 @@ class Database:
             return [{"id": int(r[0]), "login": r[1], "enabled": int(r[2])} for r in rows]
 
     async def backfill_channel_data(self, channel_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute(
-                "UPDATE rewards SET channel_id = ? WHERE channel_id IS NULL",
-                (int(channel_id),),
-            )
-            await db.execute(
-                "UPDATE planned_giveaways SET channel_id = ? WHERE channel_id IS NULL",
-                (int(channel_id),),
-            )
-            await db.execute(
-                "UPDATE giveaway_triggers SET channel_id = ? WHERE channel_id IS NULL",
-                (int(channel_id),),
-            )
-            await db.commit()
+        # Rows from before multi-channel support go to the default channel, once
+        await self.run_backfill_once(
+            "channel_data",
+            [
+                ("UPDATE rewards SET channel_id = ? WHERE channel_id IS NULL", (int(channel_id),)),
+                ("UPDATE planned_giveaways SET channel_id = ? WHERE channel_id IS NULL", (int(channel_id),)),
+                ("UPDATE giveaway_triggers SET channel_id = ? WHERE channel_id IS NULL", (int(channel_id),)),
+            ],
+        )
+
+    async def run_backfill_once(self, name: str, statements: list[tuple[str, tuple]]) -> bool:
+        async with self._connect() as db:
+            async with db.execute("SELECT 1 FROM backfills WHERE name = ?", (name,)) as cursor:
+                if await cursor.fetchone():
+                    return False
+            await db.execute("BEGIN IMMEDIATE")
+            try:
+                cur = await db.execute(
+                    "INSERT OR IGNORE INTO backfills (name, applied_at) VALUES (?, ?)", (name, clock.now())
+                )
+                if cur.rowcount == 0:
+                    # Another process got here first
+                    await db.execute("ROLLBACK")
+                    return False
+                for sql, params in statements:
+                    await db.execute(sql, params)
+                await db.execute("COMMIT")
+            except Exception:
+                await db.execute("ROLLBACK")
+                raise
+            logger.info(f"Разовое заполнение {name} выполнено")
+            return True
 
     async def get_channel_settings(self, channel_id: int) -> dict | None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT min_interval_minutes, max_interval_minutes, active_timeout_minutes, claim_timeout_minutes, drops_enabled
@@ -627,8 +839,8 @@ class Database:
         claim_timeout_minutes: int,
         drops_enabled: int = 1,
     ) -> None:
-        now = datetime.datetime.now()
-        async with aiosqlite.connect(self.db_path) as db:
+        now = clock.now()
+        async with self._connect() as db:
             await db.execute(
                 """
                 INSERT INTO channel_settings
@@ -662,10 +874,10 @@ class Database:
             values.append(int(value) if isinstance(value, bool) else value)
         if not fields:
             return
-        values.append(datetime.datetime.now())
+        values.append(clock.now())
         values.append(int(channel_id))
         sql = f"UPDATE channel_settings SET {', '.join(fields)}, updated_at = ? WHERE channel_id = ?"
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(sql, values)
             await db.commit()
 
@@ -679,8 +891,8 @@ class Database:
         admin_chat_id: int | None = None,
         admin_message_id: int | None = None,
     ) -> int:
-        now = datetime.datetime.now()
-        async with aiosqlite.connect(self.db_path) as db:
+        now = clock.now()
+        async with self._connect() as db:
             cur = await db.execute(
                 """
                 INSERT INTO channel_requests
@@ -702,7 +914,7 @@ class Database:
             return int(cur.lastrowid)
 
     async def set_channel_request_admin_message(self, request_id: int, admin_chat_id: int, admin_message_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 "UPDATE channel_requests SET admin_chat_id = ?, admin_message_id = ? WHERE id = ?",
                 (int(admin_chat_id), int(admin_message_id), int(request_id)),
@@ -710,7 +922,7 @@ class Database:
             await db.commit()
 
     async def get_channel_request(self, request_id: int) -> dict | None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT id, telegram_id, telegram_username, twitch_login, contact, note, status, admin_chat_id, admin_message_id
@@ -734,7 +946,7 @@ class Database:
             }
 
     async def set_channel_request_status(self, request_id: int, status: str) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 "UPDATE channel_requests SET status = ? WHERE id = ?",
                 (status, int(request_id)),
@@ -750,7 +962,7 @@ class Database:
         quantity: int = 1,
         enabled: int = 0,
     ) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 """
                 INSERT INTO rewards (channel_id, name, description, weight, quantity, enabled)
@@ -762,7 +974,7 @@ class Database:
             return int(cur.lastrowid)
 
     async def get_reward(self, reward_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT id, channel_id, name, description, weight, quantity, enabled FROM rewards WHERE id = ?",
                 (reward_id,),
@@ -781,7 +993,7 @@ class Database:
                 }
 
     async def list_rewards(self, channel_id: int) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT id, name, description, weight, quantity, enabled
@@ -805,7 +1017,7 @@ class Database:
                 ]
 
     async def set_reward_enabled(self, reward_id: int, enabled: int) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             cur = await db.execute(
                 "UPDATE rewards SET enabled = ? WHERE id = ?",
                 (int(enabled), int(reward_id)),
@@ -826,8 +1038,8 @@ class Database:
             quantity=winners_count,
             enabled=0,
         )
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO planned_giveaways (channel_id, reward_id, title, winners_count, status, created_by, created_at)
@@ -839,7 +1051,7 @@ class Database:
             return int(cur.lastrowid)
 
     async def list_planned_giveaways(self, channel_id: int | None = None, status: str | None = None) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             if status and channel_id is not None:
                 async with db.execute(
                     """
@@ -897,8 +1109,8 @@ class Database:
             ]
 
     async def mark_planned_giveaway_triggered(self, planned_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute(
                 "UPDATE planned_giveaways SET status = 'triggered', triggered_at = ? WHERE id = ? AND status = 'planned'",
                 (now, planned_id),
@@ -909,9 +1121,9 @@ class Database:
         status = (status or "").strip()
         if status not in ("planned", "end", "triggered"):
             return False
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             if status == "triggered":
-                now = datetime.datetime.now()
+                now = clock.now()
                 await db.execute(
                     "UPDATE planned_giveaways SET status = 'triggered', triggered_at = ? WHERE id = ?",
                     (now, int(planned_id)),
@@ -926,7 +1138,7 @@ class Database:
 
     async def create_planned_giveaway_trigger(self, planned_giveaway_id: int, requested_by: int) -> int:
         planned_giveaway_id = int(planned_giveaway_id)
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT channel_id, reward_id, winners_count, status FROM planned_giveaways WHERE id = ?",
                 (planned_giveaway_id,),
@@ -937,7 +1149,7 @@ class Database:
             channel_id = int(row[0]) if row[0] is not None else None
             reward_id = int(row[1])
             winners_count = int(row[2])
-            now = datetime.datetime.now()
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO giveaway_triggers
@@ -951,8 +1163,8 @@ class Database:
             return int(cur.lastrowid)
 
     async def record_item_claim(self, draw_id: int, telegram_id: int, twitch_username: str, reward_name: str) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute(
                 """
                 INSERT INTO item_claims (draw_id, telegram_id, twitch_username, reward_name, status, claimed_at)
@@ -964,7 +1176,7 @@ class Database:
             await db.commit()
 
     async def list_available_item_claims(self, telegram_id: int) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT draw_id, reward_name, claimed_at
@@ -980,8 +1192,8 @@ class Database:
     async def create_conversion_request(self, telegram_id: int, telegram_username: str, draw_id: int) -> int | None:
         telegram_id = int(telegram_id)
         draw_id = int(draw_id)
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute("BEGIN IMMEDIATE")
             async with db.execute(
                 "SELECT reward_name, status FROM item_claims WHERE draw_id = ? AND telegram_id = ?",
@@ -1013,7 +1225,7 @@ class Database:
             return int(cur.lastrowid)
 
     async def get_conversion_request(self, request_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT * FROM conversion_requests WHERE id = ?",
                 (int(request_id),),
@@ -1038,7 +1250,7 @@ class Database:
                 }
 
     async def set_conversion_admin_message(self, request_id: int, admin_chat_id: int, admin_message_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 """
                 UPDATE conversion_requests
@@ -1058,7 +1270,7 @@ class Database:
         reason: str | None = None,
     ) -> bool:
         request_id = int(request_id)
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("BEGIN IMMEDIATE")
             async with db.execute(
                 "SELECT status, draw_id, telegram_id FROM conversion_requests WHERE id = ?",
@@ -1070,7 +1282,7 @@ class Database:
                 return False
             draw_id = int(row[1])
             telegram_id = int(row[2])
-            now = datetime.datetime.now()
+            now = clock.now()
             await db.execute(
                 """
                 UPDATE conversion_requests
@@ -1097,8 +1309,8 @@ class Database:
         gold_amount = int(gold_amount)
         if gold_amount <= 0:
             return {"ok": False, "status": "bad_amount"}
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute("BEGIN IMMEDIATE")
             async with db.execute(
                 "SELECT status, draw_id, telegram_id FROM conversion_requests WHERE id = ?",
@@ -1161,8 +1373,8 @@ class Database:
         price: str,
         pattern: str,
     ) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO withdrawals
@@ -1178,7 +1390,7 @@ class Database:
     async def set_withdrawal_admin_message(
         self, withdrawal_id: int, admin_chat_id: int, admin_message_id: int
     ) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 """
                 UPDATE withdrawals
@@ -1190,7 +1402,7 @@ class Database:
             await db.commit()
 
     async def get_withdrawal(self, withdrawal_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT * FROM withdrawals WHERE id = ?",
                 (withdrawal_id,),
@@ -1218,7 +1430,7 @@ class Database:
     async def decide_withdrawal(
         self, withdrawal_id: int, status: str, admin_id: int, reason: str | None = None
     ) -> bool:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT status FROM withdrawals WHERE id = ?",
                 (withdrawal_id,),
@@ -1229,7 +1441,7 @@ class Database:
                 if row[0] != "pending":
                     return False
 
-            now = datetime.datetime.now()
+            now = clock.now()
             await db.execute(
                 """
                 UPDATE withdrawals
@@ -1242,12 +1454,12 @@ class Database:
             return True
 
     async def delete_withdrawal(self, withdrawal_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("DELETE FROM withdrawals WHERE id = ?", (withdrawal_id,))
             await db.commit()
 
     async def get_gold_balance(self, telegram_id: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT balance FROM gold_balances WHERE telegram_id = ?",
                 (telegram_id,),
@@ -1260,8 +1472,8 @@ class Database:
     ) -> bool:
         if amount <= 0:
             return False
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             try:
                 await db.execute(
                     """
@@ -1291,8 +1503,8 @@ class Database:
     ) -> dict:
         if amount == 0:
             return {"ok": False, "status": "zero"}
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute("BEGIN IMMEDIATE")
             async with db.execute(
                 "SELECT balance FROM gold_balances WHERE telegram_id = ?",
@@ -1343,8 +1555,8 @@ class Database:
         nickname = (nickname or "").strip().lower()
         if not channel or not nickname:
             return
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             async with db.execute(
                 "SELECT seconds, last_seen_at FROM watch_time WHERE channel = ? AND nickname = ?",
                 (channel, nickname),
@@ -1381,7 +1593,7 @@ class Database:
         nickname = (nickname or "").strip().lower()
         if not channel or not nickname:
             return 0
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT seconds FROM watch_time WHERE channel = ? AND nickname = ?",
                 (channel, nickname),
@@ -1391,8 +1603,8 @@ class Database:
 
     async def start_stream_session(self, channel: str) -> int:
         channel = (channel or "").strip().lower()
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 "INSERT INTO stream_sessions (channel, started_at) VALUES (?, ?)",
                 (channel, now),
@@ -1401,8 +1613,8 @@ class Database:
             return int(cur.lastrowid)
 
     async def end_stream_session(self, session_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute(
                 "UPDATE stream_sessions SET ended_at = ? WHERE id = ? AND ended_at IS NULL",
                 (now, int(session_id)),
@@ -1413,8 +1625,8 @@ class Database:
         nickname = (nickname or "").strip().lower()
         if not session_id or not nickname:
             return
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             async with db.execute(
                 "SELECT seconds, last_seen_at FROM stream_watch_time WHERE session_id = ? AND nickname = ?",
                 (int(session_id), nickname),
@@ -1448,7 +1660,7 @@ class Database:
         nickname = (nickname or "").strip().lower()
         if not session_id or not nickname:
             return 0
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT seconds FROM stream_watch_time WHERE session_id = ? AND nickname = ?",
                 (int(session_id), nickname),
@@ -1459,7 +1671,7 @@ class Database:
     async def get_stream_eligible_users(self, session_id: int, min_seconds: int) -> list[str]:
         if not session_id:
             return []
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT nickname
@@ -1472,8 +1684,8 @@ class Database:
                 return [str(r[0]) for r in rows]
 
     async def add_check_channel(self, chat_id: int, title: str | None = None) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             await db.execute(
                 """
                 INSERT INTO check_channels (chat_id, title, created_at)
@@ -1485,12 +1697,12 @@ class Database:
             await db.commit()
 
     async def remove_check_channel(self, chat_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("DELETE FROM check_channels WHERE chat_id = ?", (chat_id,))
             await db.commit()
 
     async def list_check_channels(self) -> list[dict]:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 "SELECT chat_id, title FROM check_channels ORDER BY id DESC"
             ) as cursor:
@@ -1500,8 +1712,8 @@ class Database:
     async def create_gold_check(
         self, amount: int, max_activations: int, created_by: int, channel_id: int, code: str
     ) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO gold_checks
@@ -1515,7 +1727,7 @@ class Database:
             return int(cur.lastrowid)
 
     async def set_gold_check_message(self, check_id: int, message_id: int) -> None:
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute(
                 "UPDATE gold_checks SET message_id = ? WHERE id = ?",
                 (message_id, check_id),
@@ -1523,7 +1735,7 @@ class Database:
             await db.commit()
 
     async def get_gold_check_by_code(self, code: str):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             async with db.execute(
                 """
                 SELECT id, code, amount, max_activations, activated_count, status, channel_id, message_id
@@ -1547,117 +1759,174 @@ class Database:
                 }
 
     async def activate_gold_check(self, code: str, telegram_id: int) -> dict:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
-
-            async with db.execute(
-                """
-                SELECT id, amount, max_activations, activated_count, status, channel_id, message_id
-                FROM gold_checks
-                WHERE code = ?
-                """,
-                (code,),
-            ) as cursor:
-                row = await cursor.fetchone()
-                if not row:
-                    return {"status": "not_found"}
-
-            check_id = int(row[0])
-            amount = int(row[1])
-            max_activations = int(row[2])
-            activated_count = int(row[3])
-            status = row[4]
-            channel_id = int(row[5]) if row[5] is not None else None
-            message_id = int(row[6]) if row[6] is not None else None
-
-            if status != "active":
-                return {"status": "inactive"}
-            if activated_count >= max_activations:
-                return {
-                    "status": "finished",
-                    "check_id": check_id,
-                    "amount": amount,
-                    "max_activations": max_activations,
-                    "activated_count": activated_count,
-                    "channel_id": channel_id,
-                    "message_id": message_id,
-                }
-
+        reservations = self.check_reservations
+        if not reservations.known(code):
+            check = await self.get_gold_check_by_code(code)
+            if not check:
+                return {"status": "not_found"}
+            reservations.load(code, check)
+        while True:
+            rejected = reservations.rejection(code)
+            if rejected:
+                return rejected
+            if reservations.reserve(code):
+                break
+            # All free activations are taken by claims still in flight: wait for them to settle
+            await reservations.wait(code)
+
+        try:
+            result = await self._claim_gold_check(code, int(telegram_id))
+        finally:
+            reservations.release(code)
+        reservations.update(code, result)
+        return result
+
+    async def _claim_gold_check(self, code: str, telegram_id: int) -> dict:
+        # Claims are group-committed: everything queued while the previous batch was
+        # being written goes into the next BEGIN IMMEDIATE ... COMMIT.
+        fut = asyncio.get_running_loop().create_future()
+        self._check_claim_queue.append((code, telegram_id, fut))
+        if self._check_claim_task is None or self._check_claim_task.done():
+            self._check_claim_task = asyncio.create_task(self._drain_check_claims())
+        return await fut
+
+    async def _drain_check_claims(self):
+        while self._check_claim_queue:
+            batch = self._check_claim_queue[:CHECK_CLAIM_BATCH]
+            del self._check_claim_queue[:CHECK_CLAIM_BATCH]
             try:
-                cur = await db.execute(
-                    """
-                    INSERT INTO gold_check_activations (check_id, telegram_id, activated_at)
-                    VALUES (?, ?, ?)
-                    """,
-                    (check_id, telegram_id, now),
+                async with self._connect() as db:
+                    now = clock.now()
+                    await db.execute("BEGIN IMMEDIATE")
+                    try:
+                        results = [await self._claim_in_savepoint(db, code, tid, now) for code, tid, _ in batch]
+                    except BaseException:
+                        await db.execute("ROLLBACK")
+                        raise
+                    await db.execute("COMMIT")
+            except Exception as e:
+                logger.error(f"Ошибка активации чеков (batch={len(batch)}): {e}")
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, _, fut), (result, error) in zip(batch, results):
+                if fut.done():
+                    continue
+                if error is not None:
+                    fut.set_exception(error)
+                else:
+                    fut.set_result(result)
+
+    async def _claim_in_savepoint(self, db, code: str, telegram_id: int, now) -> tuple[dict | None, Exception | None]:
+        # A failing claim is undone on its own; the rest of the batch still commits
+        await db.execute("SAVEPOINT check_claim")
+        try:
+            result = await self._claim_gold_check_tx(db, code, telegram_id, now)
+        except Exception as e:
+            await db.execute("ROLLBACK TO check_claim")
+            await db.execute("RELEASE check_claim")
+            logger.error(f"Ошибка активации чека {code} для {telegram_id}: {e}")
+            return None, e
+        await db.execute("RELEASE check_claim")
+        return result, None
+
+    async def _claim_gold_check_tx(self, db, code: str, telegram_id: int, now) -> dict:
+        async with db.execute(
+            """
+            UPDATE gold_checks
+            SET activated_count = activated_count + 1,
+                status = CASE WHEN activated_count + 1 >= max_activations THEN 'finished' ELSE status END
+            WHERE code = ?
+                AND status = 'active'
+                AND activated_count < max_activations
+                AND NOT EXISTS (
+                    SELECT 1 FROM gold_check_activations a
+                    WHERE a.check_id = gold_checks.id AND a.telegram_id = ?
                 )
-            except aiosqlite.IntegrityError:
-                return {
-                    "status": "already",
-                    "check_id": check_id,
-                    "amount": amount,
-                    "max_activations": max_activations,
-                    "activated_count": activated_count,
-                    "channel_id": channel_id,
-                    "message_id": message_id,
-                }
+            RETURNING id, amount, max_activations, activated_count, channel_id, message_id
+            """,
+            (code, telegram_id),
+        ) as cursor:
+            row = await cursor.fetchone()
 
-            activation_id = int(cur.lastrowid)
-
-            await db.execute(
-                """
-                UPDATE gold_checks
-                SET activated_count = activated_count + 1
-                WHERE id = ? AND activated_count < max_activations AND status = 'active'
-                """,
-                (check_id,),
-            )
-            await db.execute(
-                """
-                INSERT INTO gold_transactions (telegram_id, amount, source_type, source_id, created_at)
-                VALUES (?, ?, 'check_activation', ?, ?)
-                """,
-                (telegram_id, amount, activation_id, now),
-            )
-            await db.execute(
+        if not row:
+            async with db.execute(
                 """
-                INSERT INTO gold_balances (telegram_id, balance, updated_at)
-                VALUES (?, ?, ?)
-                ON CONFLICT(telegram_id) DO UPDATE SET
-                    balance = balance + excluded.balance,
-                    updated_at = excluded.updated_at
+                SELECT
+                    c.id, c.amount, c.max_activations, c.activated_count, c.status, c.channel_id, c.message_id,
+                    EXISTS(
+                        SELECT 1 FROM gold_check_activations a
+                        WHERE a.check_id = c.id AND a.telegram_id = ?
+                    )
+                FROM gold_checks c
+                WHERE c.code = ?
                 """,
-                (telegram_id, amount, now),
-            )
-            await db.commit()
-
-            async with db.execute(
-                "SELECT activated_count FROM gold_checks WHERE id = ?",
-                (check_id,),
+                (telegram_id, code),
             ) as cursor:
-                new_count_row = await cursor.fetchone()
-                new_count = int(new_count_row[0]) if new_count_row else activated_count + 1
-
-            if new_count >= max_activations:
-                await db.execute(
-                    "UPDATE gold_checks SET status = 'finished' WHERE id = ?",
-                    (check_id,),
-                )
-                await db.commit()
-
-            return {
-                "status": "activated",
-                "check_id": check_id,
-                "amount": amount,
-                "max_activations": max_activations,
-                "activated_count": new_count,
-                "channel_id": channel_id,
-                "message_id": message_id,
+                row = await cursor.fetchone()
+            if not row:
+                return {"status": "not_found"}
+            result = {
+                "check_id": int(row[0]),
+                "amount": int(row[1]),
+                "max_activations": int(row[2]),
+                "activated_count": int(row[3]),
+                "channel_id": int(row[5]) if row[5] is not None else None,
+                "message_id": int(row[6]) if row[6] is not None else None,
             }
+            if row[4] == "finished" or result["activated_count"] >= result["max_activations"]:
+                result["status"] = "finished"
+            elif row[4] != "active":
+                result["status"] = "inactive"
+            else:
+                result["status"] = "already"
+            return result
+
+        check_id = int(row[0])
+        amount = int(row[1])
+        cur = await db.execute(
+            """
+            INSERT INTO gold_check_activations (check_id, telegram_id, activated_at)
+            VALUES (?, ?, ?)
+            """,
+            (check_id, telegram_id, now),
+        )
+        activation_id = int(cur.lastrowid)
+        await db.execute(
+            """
+            INSERT INTO gold_transactions (telegram_id, amount, source_type, source_id, created_at)
+            VALUES (?, ?, 'check_activation', ?, ?)
+            """,
+            (telegram_id, amount, activation_id, now),
+        )
+        async with db.execute(
+            """
+            INSERT INTO gold_balances (telegram_id, balance, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT(telegram_id) DO UPDATE SET
+                balance = balance + excluded.balance,
+                updated_at = excluded.updated_at
+            RETURNING balance
+            """,
+            (telegram_id, amount, now),
+        ) as cursor:
+            balance_row = await cursor.fetchone()
+
+        return {
+            "status": "activated",
+            "check_id": check_id,
+            "amount": amount,
+            "max_activations": int(row[2]),
+            "activated_count": int(row[3]),
+            "channel_id": int(row[4]) if row[4] is not None else None,
+            "message_id": int(row[5]) if row[5] is not None else None,
+            "balance": int(balance_row[0]) if balance_row else None,
+        }
 
     async def create_giveaway_trigger(self, channel_id: int, requested_by: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO giveaway_triggers (requested_by, created_at, trigger_type, channel_id)
@@ -1669,8 +1938,8 @@ class Database:
             return int(cur.lastrowid)
 
     async def create_clip_trigger(self, channel_id: int, requested_by: int) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO giveaway_triggers (requested_by, created_at, trigger_type, channel_id)
@@ -1690,8 +1959,8 @@ class Database:
         guess_min: int,
         guess_max: int,
     ) -> int:
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO giveaway_triggers
@@ -1713,8 +1982,8 @@ class Database:
     ) -> int:
         channel = (channel or "").strip().lower()
         nickname = (nickname or "").strip().lower()
-        async with aiosqlite.connect(self.db_path) as db:
-            now = datetime.datetime.now()
+        async with self._connect() as db:
+            now = clock.now()
             cur = await db.execute(
                 """
                 INSERT INTO draws (channel, nickname, reward_id, created_at, status, expires_at, notified_in_tg)
@@ -1726,7 +1995,7 @@ class Database:
             return int(cur.lastrowid)
 
     async def claim_giveaway_trigger(self, channel_id: int):
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self._connect() as db:
             await db.execute("BEGIN IMMEDIATE")
             async with db.execute(
                 """
@@ -1762,7 +2031,7 @@ class Database:
             guess_number = int(row[7]) if row[7] is not None else None
             guess_min = int(row[8]) if row[8] is not None else None
             guess_max = int(row[9]) if row[9] is not None else None
-            now = datetime.datetime.now()
+            now = clock.now()
             await db.execute(
                 "UPDATE giveaway_triggers SET processed_at = ? WHERE id = ? AND processed_at IS NULL",
                 (now, trigger_id),
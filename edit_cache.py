@@ -0,0 +1,89 @@
+from collections import OrderedDict
+
+from aiogram.client.default import Default
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import DeleteMessage, EditMessageCaption, EditMessageReplyMarkup, EditMessageText, SendMessage
+
+from metrics import TELEGRAM_EDITS_SKIPPED
+
+
+def _fingerprint(bot, method) -> int:
+    # Bot defaults resolved, so a sent message and an edit with the same effective content match
+    def value(field):
+        v = getattr(method, field)
+        return repr(bot.default[v.name] if isinstance(v, Default) else v)
+
+    markup = method.reply_markup.model_dump_json(exclude_none=True) if method.reply_markup is not None else ""
+    fields = ("parse_mode", "entities", "link_preview_options", "disable_web_page_preview")
+    return hash((method.text, markup) + tuple(value(f) for f in fields))
+
+
+def _key(chat_id, message_id) -> tuple[int, int] | None:
+    try:
+        return int(chat_id), int(message_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class EditCache:
+    # aiogram request middleware remembering what each (chat, message) shows: a hash of the
+    # text, formatting and keyboard of the last sendMessage/editMessageText that went
+    # through. An edit that would change nothing is answered here with True instead of a
+    # round trip ending in "message is not modified", so the handler goes straight on to
+    # answer the callback query. Register it before other request middlewares, so skipped
+    # edits are not counted as Bot API calls.
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = int(max_entries)
+        self._shown: OrderedDict[tuple[int, int], int] = OrderedDict()
+        # Edits in flight per message, and messages that had two at once: with overlapping
+        # edits the order Telegram applied them in is unknown, so none records a fingerprint
+        self._inflight: dict[tuple[int, int], int] = {}
+        self._overlapped: set[tuple[int, int]] = set()
+
+    def _remember(self, key: tuple[int, int], fingerprint: int) -> None:
+        self._shown[key] = fingerprint
+        self._shown.move_to_end(key)
+        while len(self._shown) > self.max_entries:
+            self._shown.popitem(last=False)
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, EditMessageText):
+            key = _key(method.chat_id, method.message_id)
+            if key is not None:
+                return await self._edit(make_request, bot, method, key)
+        elif isinstance(method, SendMessage):
+            result = await make_request(bot, method)
+            self._remember((result.chat.id, result.message_id), _fingerprint(bot, method))
+            return result
+        elif isinstance(method, (EditMessageReplyMarkup, EditMessageCaption, DeleteMessage)):
+            key = _key(method.chat_id, method.message_id)
+            if key is not None:
+                self._shown.pop(key, None)
+        return await make_request(bot, method)
+
+    async def _edit(self, make_request, bot, method: EditMessageText, key: tuple[int, int]):
+        fingerprint = _fingerprint(bot, method)
+        if self._shown.get(key) == fingerprint and key not in self._inflight:
+            self._shown.move_to_end(key)
+            TELEGRAM_EDITS_SKIPPED.labels("cached").inc()
+            return True
+        self._shown.pop(key, None)
+        if key in self._inflight:
+            self._overlapped.add(key)
+        self._inflight[key] = self._inflight.get(key, 0) + 1
+        try:
+            result = await make_request(bot, method)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                raise
+            TELEGRAM_EDITS_SKIPPED.labels("not_modified").inc()
+            result = True
+        finally:
+            alone = key not in self._overlapped
+            self._inflight[key] -= 1
+            if not self._inflight[key]:
+                del self._inflight[key]
+                self._overlapped.discard(key)
+        if alone:
+            self._remember(key, fingerprint)
+        return result
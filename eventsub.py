@@ -0,0 +1,308 @@
+import asyncio
+import collections
+import json
+import logging
+
+import aiohttp
+
+from metrics import EVENTSUB_CHANNELS, EVENTSUB_MESSAGES, EVENTSUB_RECONNECTS
+from twitch_helix import HelixClient
+
+
+logger = logging.getLogger("EventSub")
+
+EVENTSUB_WS_URL = "wss://eventsub.wss.twitch.tv/ws"
+STREAM_TYPES = ("stream.online", "stream.offline")
+
+# Twitch closes a connection that has no subscription 10 s after the welcome message
+WELCOME_TIMEOUT = 10
+# Keepalives are sent only when the connection was idle that long; allow for latency
+KEEPALIVE_MARGIN = 5
+# Twitch allows this many WebSocket connections per user token; more are refused
+MAX_SESSIONS = 3
+# Channels subscribed at a time: both types of one channel go in order, so a cost limit
+# leaves whole channels on EventSub rather than many with only stream.online
+SUBSCRIBE_CONCURRENCY = 4
+
+
+def eventsub_settings(config: dict) -> dict:
+    raw = config.get("eventsub") or {}
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "url": raw.get("url") or EVENTSUB_WS_URL,
+        "keepalive_seconds": min(600, max(10, int(raw.get("keepalive_seconds", 30)))),
+        "verify_minutes": float(raw.get("verify_minutes", 10)),
+        "reconnect_max_seconds": float(raw.get("reconnect_max_seconds", 60)),
+        "max_sessions": max(1, int(raw.get("max_sessions", MAX_SESSIONS))),
+    }
+
+
+class EventSubClient:
+    # One WebSocket session for the whole process. Bots register their broadcaster id with
+    # watch(); the client subscribes it to stream.online/offline on the current session and
+    # calls the bot back on every notification. A channel is "covered" while both
+    # subscriptions are enabled on a live session; everything else (not yet subscribed,
+    # refused, revoked, connection lost) stays on polling /streams.
+    def __init__(
+        self,
+        helix: HelixClient,
+        url: str = EVENTSUB_WS_URL,
+        keepalive_seconds: int = 30,
+        reconnect_max_seconds: float = 60,
+    ):
+        self.helix = helix
+        self.url = url
+        self.keepalive_seconds = int(keepalive_seconds)
+        self.reconnect_max_seconds = float(reconnect_max_seconds)
+        self.session_id: str | None = None
+        self.keepalive_timeout = float(self.keepalive_seconds)
+        # Online state per broadcaster id, from notifications or a bot's seeding poll
+        self.states: dict[str, bool] = {}
+        self._watchers: dict[str, object] = {}
+        self._subscribed: dict[str, set[str]] = {}
+        # Refused or revoked on this session: polled until the next session
+        self._refused: set[str] = set()
+        self._cost_exceeded = False
+        self._seen: collections.OrderedDict[str, None] = collections.OrderedDict()
+        self._wake = asyncio.Event()
+        EVENTSUB_CHANNELS.set_function(self.covered_count)
+
+    @classmethod
+    def from_config(cls, config: dict, session_index: int = 0) -> "EventSubClient | None":
+        # session_index: the worker's number under the supervisor. Every process opens its
+        # own session with the same clip_token, so only the first max_sessions get one
+        settings = eventsub_settings(config)
+        if not settings["enabled"]:
+            return None
+        user_token = config["twitch"].get("clip_token")
+        if not user_token:
+            logger.warning("EventSub: нужен twitch.clip_token (WebSocket-подписки принимают только user token), остаёмся на опросе")
+            return None
+        if session_index >= settings["max_sessions"]:
+            logger.warning(
+                f"EventSub: на один user token Twitch даёт не больше {settings['max_sessions']} WebSocket-сессий, "
+                f"воркер {session_index} без EventSub, его каналы на опросе /streams"
+            )
+            return None
+        return cls(
+            HelixClient.from_config(config, user_token=user_token),
+            settings["url"],
+            settings["keepalive_seconds"],
+            settings["reconnect_max_seconds"],
+        )
+
+    def watch(self, broadcaster_id: str, callback) -> None:
+        # callback(online: bool) runs on the event loop; it must not block
+        self._watchers[str(broadcaster_id)] = callback
+        self._wake.set()
+
+    def unwatch(self, broadcaster_id: str) -> None:
+        # The subscriptions stay on the session until it ends; their events are dropped
+        self._watchers.pop(str(broadcaster_id), None)
+
+    def covers(self, broadcaster_id: str) -> bool:
+        return self.session_id is not None and self._subscribed.get(str(broadcaster_id), set()) >= set(STREAM_TYPES)
+
+    def covered_count(self) -> int:
+        return sum(1 for bid in self._watchers if self.covers(bid))
+
+    def settled(self) -> bool:
+        # Every watched channel is either on EventSub or refused for this session
+        return self.session_id is not None and all(self.covers(bid) or bid in self._refused for bid in self._watchers)
+
+    def set_state(self, broadcaster_id: str, online: bool) -> None:
+        self.states[str(broadcaster_id)] = bool(online)
+
+    def _url(self) -> str:
+        sep = "&" if "?" in self.url else "?"
+        return f"{self.url}{sep}keepalive_timeout_seconds={self.keepalive_seconds}"
+
+    async def run(self) -> None:
+        delay = 1
+        while True:
+            try:
+                reason, welcomed = await self._session()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                reason, welcomed = "error", False
+                logger.error(f"EventSub: ошибка сессии: {e}")
+            EVENTSUB_RECONNECTS.labels(reason.split(":")[0]).inc()
+            if welcomed:
+                delay = 1
+            logger.warning(f"EventSub: сессия завершена ({reason}), каналы на опросе /streams; переподключение через {delay} с")
+            await asyncio.sleep(delay)
+            delay = min(self.reconnect_max_seconds, delay * 2)
+
+    async def _read(self, http: aiohttp.ClientSession, url: str, queue: asyncio.Queue) -> None:
+        # One per connection; a session_reconnect briefly has two, both feed the same queue
+        ws = None
+        try:
+            ws = await http.ws_connect(url, autoping=True, timeout=WELCOME_TIMEOUT)
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                try:
+                    message = json.loads(msg.data)
+                except ValueError:
+                    logger.warning(f"EventSub: не JSON: {msg.data[:200]}")
+                    continue
+                await queue.put((ws, message))
+        except asyncio.CancelledError:
+            raise
+        except aiohttp.WSServerHandshakeError as e:
+            if e.status == 429:
+                logger.error(
+                    f"EventSub: Twitch отклонил соединение (429): на twitch.clip_token уже открыто "
+                    f"максимум WebSocket-сессий, каналы на опросе /streams"
+                )
+            else:
+                logger.warning(f"EventSub: соединение {url}: {e}")
+        except Exception as e:
+            logger.warning(f"EventSub: соединение {url}: {e}")
+        finally:
+            if ws is not None:
+                await ws.close()
+            queue.put_nowait((ws, None))
+
+    async def _session(self) -> tuple[str, bool]:
+        queue: asyncio.Queue = asyncio.Queue()
+        readers: list[asyncio.Task] = []
+        subscriber: asyncio.Task | None = None
+        current = None
+        async with aiohttp.ClientSession() as http:
+
+            def open_ws(url: str) -> None:
+                readers.append(asyncio.create_task(self._read(http, url, queue), name="eventsub:reader"))
+
+            open_ws(self._url())
+            try:
+                while True:
+                    timeout = self.keepalive_timeout + KEEPALIVE_MARGIN if current is not None else WELCOME_TIMEOUT
+                    try:
+                        ws, message = await asyncio.wait_for(queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        return ("keepalive" if current is not None else "welcome_timeout"), current is not None
+
+                    if message is None:
+                        # A connection ended: the live one means the session is gone; an old
+                        # one after migration, or a failed migration attempt, does not matter
+                        if current is None or ws is current:
+                            code = ws.close_code if ws is not None else None
+                            return f"closed:{code}", current is not None
+                        continue
+
+                    metadata = message.get("metadata") or {}
+                    message_type = metadata.get("message_type") or "unknown"
+                    EVENTSUB_MESSAGES.labels(message_type).inc()
+                    message_id = metadata.get("message_id")
+                    if message_id:
+                        # Twitch may deliver a message twice, e.g. on both connections while migrating
+                        if message_id in self._seen:
+                            continue
+                        self._seen[message_id] = None
+                        if len(self._seen) > 1000:
+                            self._seen.popitem(last=False)
+
+                    payload = message.get("payload") or {}
+                    if message_type == "session_welcome":
+                        session = payload.get("session") or {}
+                        old, current = current, ws
+                        self.session_id = session.get("id")
+                        self.keepalive_timeout = float(session.get("keepalive_timeout_seconds") or self.keepalive_seconds)
+                        if old is None:
+                            logger.info(f"EventSub: подключены, сессия {self.session_id}")
+                            subscriber = asyncio.create_task(self._subscribe_loop(), name="eventsub:subscriber")
+                        else:
+                            # Subscriptions moved with the session: nothing to redo
+                            EVENTSUB_RECONNECTS.labels("migrate").inc()
+                            logger.info(f"EventSub: сессия перенесена, {self.session_id}")
+                            await old.close()
+                    elif message_type == "session_reconnect":
+                        # Keep reading the old connection until the new one is welcomed
+                        open_ws((payload.get("session") or {}).get("reconnect_url") or self._url())
+                    elif message_type == "notification":
+                        self._notify(payload)
+                    elif message_type == "revocation":
+                        self._revoke(payload.get("subscription") or {})
+            finally:
+                if subscriber is not None:
+                    subscriber.cancel()
+                for task in readers:
+                    task.cancel()
+                await asyncio.gather(*readers, *([subscriber] if subscriber else []), return_exceptions=True)
+                self.session_id = None
+                self._subscribed.clear()
+                self._refused.clear()
+                self._cost_exceeded = False
+                self.states.clear()
+
+    def _notify(self, payload: dict) -> None:
+        sub_type = (payload.get("subscription") or {}).get("type")
+        event = payload.get("event") or {}
+        broadcaster_id = str(event.get("broadcaster_user_id") or "")
+        if sub_type not in STREAM_TYPES or not broadcaster_id:
+            return
+        online = sub_type == "stream.online"
+        self.states[broadcaster_id] = online
+        callback = self._watchers.get(broadcaster_id)
+        if callback is None:
+            return
+        try:
+            callback(online)
+        except Exception as e:
+            logger.error(f"EventSub: ошибка обработчика {sub_type} для {event.get('broadcaster_user_login')}: {e}")
+
+    def _revoke(self, subscription: dict) -> None:
+        broadcaster_id = str((subscription.get("condition") or {}).get("broadcaster_user_id") or "")
+        self._subscribed.get(broadcaster_id, set()).discard(subscription.get("type"))
+        self._refused.add(broadcaster_id)
+        logger.warning(
+            f"EventSub: подписка {subscription.get('type')} для {broadcaster_id} отозвана "
+            f"({subscription.get('status')}), канал на опросе"
+        )
+
+    async def _subscribe(self, broadcaster_id: str, session_id: str, limit: asyncio.Semaphore) -> None:
+        async with limit:
+            if self._cost_exceeded:
+                self._refused.add(broadcaster_id)
+                return
+            await self._subscribe_types(broadcaster_id, session_id)
+
+    async def _subscribe_types(self, broadcaster_id: str, session_id: str) -> None:
+        for sub_type in STREAM_TYPES:
+            if sub_type in self._subscribed.get(broadcaster_id, set()):
+                continue
+            status = await self.helix.create_eventsub_subscription(sub_type, broadcaster_id, session_id)
+            if self.session_id != session_id:
+                # Session ended while the request was out
+                return
+            if status == "cost_exceeded":
+                # Further subscriptions would be refused too until this session ends
+                self._cost_exceeded = True
+            if status != "enabled":
+                self._refused.add(broadcaster_id)
+                logger.warning(f"EventSub: {sub_type} для {broadcaster_id} не подписан ({status}), канал на опросе")
+                return
+            self._subscribed.setdefault(broadcaster_id, set()).add(sub_type)
+
+    async def _subscribe_loop(self) -> None:
+        while True:
+            self._wake.clear()
+            session_id = self.session_id
+            pending = [
+                bid
+                for bid in self._watchers
+                if bid not in self._refused and not self._subscribed.get(bid, set()) >= set(STREAM_TYPES)
+            ]
+            if pending and session_id:
+                # The Helix scheduler paces these against the user-token bucket
+                limit = asyncio.Semaphore(SUBSCRIBE_CONCURRENCY)
+                await asyncio.gather(*(self._subscribe(bid, session_id, limit) for bid in pending))
+                refused = sum(1 for bid in pending if bid in self._refused)
+                logger.info(
+                    f"EventSub: каналов на уведомлениях: {self.covered_count()} из {len(self._watchers)}"
+                    + (f", не подписано: {refused} (остаются на опросе)" if refused else "")
+                )
+                continue
+            await self._wake.wait()
@@ -0,0 +1,232 @@
+import asyncio
+import datetime
+import logging
+import secrets
+import time
+import uuid
+
+from aiohttp import web
+
+from fake_helix import FakeHelixServer
+
+
+logger = logging.getLogger("FakeEventSub")
+
+STREAM_TYPES = ("stream.online", "stream.offline")
+
+
+def _timestamp() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+class FakeEventSubServer(FakeHelixServer):
+    # FakeHelixServer plus the EventSub WebSocket server and POST /helix/eventsub/subscriptions,
+    # speaking Twitch's message format: session_welcome, session_keepalive, notification,
+    # session_reconnect (with subscriptions moving to the new connection) and revocation.
+    # Subscriptions die with their connection, as on Twitch; each costs 1 against
+    # max_total_cost, the limit Twitch puts on WebSocket subscriptions.
+    USER_TOKEN_ENDPOINTS = ("clips", "eventsub")
+
+    def __init__(self, *args, max_total_cost: int = 10, unused_timeout: float = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_total_cost = int(max_total_cost)
+        self.unused_timeout = float(unused_timeout)
+        self.sessions: dict[str, dict] = {}
+
+    @property
+    def ws_url(self) -> str:
+        return self.base_url.replace("http://", "ws://", 1) + "/ws"
+
+    def make_app(self) -> web.Application:
+        app = super().make_app()
+        app.router.add_get("/ws", self.handle_ws)
+        app.router.add_post("/helix/eventsub/subscriptions", self.handle_subscriptions)
+        return app
+
+    def total_cost(self) -> int:
+        return sum(len(session["subs"]) for session in self.sessions.values())
+
+    async def _send(self, session: dict, message_type: str, payload: dict, **metadata) -> None:
+        if session["silent"]:
+            # A black-holed connection: nothing arrives, nothing closes
+            return
+        message = {
+            "metadata": {
+                "message_id": str(uuid.uuid4()),
+                "message_type": message_type,
+                "message_timestamp": _timestamp(),
+                **metadata,
+            },
+            "payload": payload,
+        }
+        session["last_sent"] = time.monotonic()
+        try:
+            await session["ws"].send_json(message)
+        except (ConnectionError, RuntimeError):
+            pass
+
+    async def _keepalive(self, session: dict) -> None:
+        # Keepalives go out only when nothing else was sent for keepalive_timeout_seconds
+        while True:
+            wait = session["last_sent"] + session["keepalive"] - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            await self._send(session, "session_keepalive", {})
+            if session["silent"]:
+                await asyncio.sleep(session["keepalive"])
+            if not session["subs"] and time.monotonic() - session["connected_at"] > self.unused_timeout:
+                await session["ws"].close(code=4003, message=b"connection unused")
+                return
+
+    async def handle_ws(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(autoping=True)
+        await ws.prepare(request)
+        self._count("ws_connect")
+        old = self.sessions.get(request.query.get("reconnect", ""))
+        session = {
+            "id": secrets.token_urlsafe(18),
+            "ws": ws,
+            "keepalive": old["keepalive"] if old else int(request.query.get("keepalive_timeout_seconds", 10)),
+            "last_sent": time.monotonic(),
+            "connected_at": time.monotonic(),
+            "subs": old["subs"] if old else {},
+            "silent": False,
+        }
+        self.sessions[session["id"]] = session
+        for sub in session["subs"].values():
+            sub["transport"]["session_id"] = session["id"]
+        await self._send(
+            session,
+            "session_welcome",
+            {
+                "session": {
+                    "id": session["id"],
+                    "status": "connected",
+                    "connected_at": _timestamp(),
+                    "keepalive_timeout_seconds": session["keepalive"],
+                    "reconnect_url": None,
+                }
+            },
+        )
+        if old:
+            # Twitch closes the old connection once the new one is welcomed
+            self.sessions.pop(old["id"], None)
+            await old["ws"].close()
+        keeper = asyncio.create_task(self._keepalive(session))
+        try:
+            async for msg in ws:
+                # Clients may not send anything but pongs
+                await ws.close(code=4001, message=b"client sent inbound traffic")
+                break
+        finally:
+            keeper.cancel()
+            if self.sessions.get(session["id"]) is session:
+                del self.sessions[session["id"]]
+        return ws
+
+    async def handle_subscriptions(self, request: web.Request) -> web.Response:
+        guard = await self._guard(request, "eventsub")
+        if isinstance(guard, web.Response):
+            return guard
+        body = await request.json()
+        transport = body.get("transport") or {}
+        session = self.sessions.get(transport.get("session_id") or "")
+        if transport.get("method") != "websocket" or session is None:
+            self._count("status_400")
+            return web.json_response(
+                {"error": "Bad Request", "status": 400, "message": "websocket transport session does not exist or has already disconnected"},
+                status=400,
+                headers=guard,
+            )
+        sub_type = body.get("type")
+        broadcaster_id = str((body.get("condition") or {}).get("broadcaster_user_id") or "")
+        if sub_type not in STREAM_TYPES or not broadcaster_id:
+            self._count("status_400")
+            return web.json_response({"error": "Bad Request", "status": 400, "message": "invalid subscription"}, status=400, headers=guard)
+        if (sub_type, broadcaster_id) in session["subs"]:
+            self._count("status_409")
+            return web.json_response(
+                {"error": "Conflict", "status": 409, "message": "subscription already exists"}, status=409, headers=guard
+            )
+        if self.total_cost() + 1 > self.max_total_cost:
+            return self._error(429, "max total cost exceeded", guard)
+        sub = {
+            "id": str(uuid.uuid4()),
+            "status": "enabled",
+            "type": sub_type,
+            "version": "1",
+            "condition": {"broadcaster_user_id": broadcaster_id},
+            "created_at": _timestamp(),
+            "transport": {"method": "websocket", "session_id": session["id"], "connected_at": _timestamp()},
+            "cost": 1,
+        }
+        session["subs"][(sub_type, broadcaster_id)] = sub
+        self._count("status_202")
+        return web.json_response(
+            {"data": [sub], "total": len(session["subs"]), "total_cost": self.total_cost(), "max_total_cost": self.max_total_cost},
+            status=202,
+            headers=guard,
+        )
+
+    async def set_stream(self, login: str, online: bool) -> int:
+        # Starts or ends the stream for /streams and notifies subscribed sessions; returns
+        # how many notifications were sent
+        login = login.lower()
+        self.online_overrides[login] = bool(online)
+        broadcaster_id = self.user_id(login)
+        sub_type = "stream.online" if online else "stream.offline"
+        event = {"broadcaster_user_id": broadcaster_id, "broadcaster_user_login": login, "broadcaster_user_name": login}
+        if online:
+            event.update(id=self.user_id(login + "#stream"), type="live", started_at=_timestamp())
+        sent = 0
+        for session in list(self.sessions.values()):
+            sub = session["subs"].get((sub_type, broadcaster_id))
+            if sub is None:
+                continue
+            await self._send(
+                session,
+                "notification",
+                {"subscription": sub, "event": event},
+                subscription_type=sub_type,
+                subscription_version="1",
+            )
+            sent += 1
+        return sent
+
+    async def request_reconnect(self) -> None:
+        # Edge maintenance: every session is asked to move to a new connection
+        for session in list(self.sessions.values()):
+            await self._send(
+                session,
+                "session_reconnect",
+                {
+                    "session": {
+                        "id": session["id"],
+                        "status": "reconnecting",
+                        "keepalive_timeout_seconds": None,
+                        "reconnect_url": f"{self.ws_url}?reconnect={session['id']}",
+                        "connected_at": _timestamp(),
+                    }
+                },
+            )
+
+    async def drop_connections(self, code: int = 4005) -> None:
+        # 4005 network timeout: the sessions and their subscriptions are gone
+        for session in list(self.sessions.values()):
+            await session["ws"].close(code=code, message=b"network timeout")
+
+    def silence(self) -> None:
+        # Current connections stay open but nothing reaches the client any more
+        for session in self.sessions.values():
+            session["silent"] = True
+
+    async def revoke(self, login: str, status: str = "authorization_revoked") -> None:
+        broadcaster_id = self.user_id(login)
+        for session in list(self.sessions.values()):
+            for sub_type in STREAM_TYPES:
+                sub = session["subs"].pop((sub_type, broadcaster_id), None)
+                if sub is None:
+                    continue
+                sub["status"] = status
+                await self._send(session, "revocation", {"subscription": sub}, subscription_type=sub_type, subscription_version="1")
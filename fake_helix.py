@@ -0,0 +1,253 @@
+import argparse
+import asyncio
+import hashlib
+import logging
+import random
+import secrets
+import time
+
+from aiohttp import web
+
+
+logger = logging.getLogger("FakeHelix")
+
+
+class FakeHelixServer:
+    # Local stand-in for id.twitch.tv/oauth2/token and the Helix endpoints HelixClient uses.
+    # Latency, error injection and the rate-limit bucket are configurable so client
+    # behaviour can be measured without network access.
+    # Called with a user token, which the stand-in does not check
+    USER_TOKEN_ENDPOINTS = ("clips",)
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        error_401: float = 0.0,
+        error_429: float = 0.0,
+        error_5xx: float = 0.0,
+        bucket_size: int = 800,
+        refill_per_minute: int = 800,
+        token_ttl: int = 3600,
+        online_percent: int = 30,
+        seed: int | None = None,
+    ):
+        self.latency_ms = float(latency_ms)
+        self.jitter_ms = float(jitter_ms)
+        self.error_401 = float(error_401)
+        self.error_429 = float(error_429)
+        self.error_5xx = float(error_5xx)
+        self.bucket_size = int(bucket_size)
+        self.refill_per_minute = int(refill_per_minute)
+        self.token_ttl = int(token_ttl)
+        self.online_percent = int(online_percent)
+        self.rnd = random.Random(seed)
+
+        self.tokens: dict[str, float] = {}
+        # Streams started or ended by the caller; other channels are online by a hash of the login
+        self.online_overrides: dict[str, bool] = {}
+        self.buckets: dict[str, list[float]] = {}
+        self.stats: dict[str, int] = {}
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.base_url}/helix"
+
+    @property
+    def auth_base(self) -> str:
+        return self.base_url
+
+    def is_online(self, login: str) -> bool:
+        if login.lower() in self.online_overrides:
+            return self.online_overrides[login.lower()]
+        digest = hashlib.sha1(login.lower().encode()).digest()
+        return digest[0] * 100 // 256 < self.online_percent
+
+    def user_id(self, login: str) -> str:
+        return str(int.from_bytes(hashlib.sha1(login.lower().encode()).digest()[:4], "big"))
+
+    def reset_stats(self) -> None:
+        self.stats = {}
+
+    def _count(self, key: str) -> None:
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/oauth2/token", self.handle_token)
+        app.router.add_get("/helix/streams", self.handle_streams)
+        app.router.add_get("/helix/users", self.handle_users)
+        app.router.add_post("/helix/clips", self.handle_clips)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sock = site._server.sockets[0]
+        self.base_url = f"http://{host}:{sock.getsockname()[1]}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _delay(self):
+        delay = self.latency_ms + (self.rnd.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+    def _ratelimit(self, client_id: str) -> tuple[bool, dict]:
+        now = time.time()
+        tokens, updated = self.buckets.get(client_id, [float(self.bucket_size), now])
+        tokens = min(float(self.bucket_size), tokens + (now - updated) * self.refill_per_minute / 60)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self.buckets[client_id] = [tokens, now]
+        missing = max(0.0, 1 - tokens) if not allowed else max(0.0, self.bucket_size - tokens)
+        reset = now + (missing * 60 / self.refill_per_minute if self.refill_per_minute else 60)
+        headers = {
+            "Ratelimit-Limit": str(self.bucket_size),
+            "Ratelimit-Remaining": str(int(tokens)),
+            "Ratelimit-Reset": str(int(reset) + 1),
+        }
+        return allowed, headers
+
+    def _error(self, status: int, message: str, headers: dict | None = None) -> web.Response:
+        self._count(f"status_{status}")
+        error = {401: "Unauthorized", 429: "Too Many Requests"}.get(status, "Internal Server Error")
+        return web.json_response({"error": error, "status": status, "message": message}, status=status, headers=headers)
+
+    async def _guard(self, request: web.Request, endpoint: str) -> web.Response | dict:
+        # Common path for Helix endpoints: latency, auth, rate limit and injected failures
+        self._count(endpoint)
+        await self._delay()
+        client_id = request.headers.get("Client-ID") or request.headers.get("Client-Id") or ""
+        auth = request.headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else ""
+        if not client_id:
+            return self._error(401, "Client-ID header required")
+
+        allowed, headers = self._ratelimit(client_id)
+        if not allowed or self.rnd.random() < self.error_429:
+            headers["Ratelimit-Remaining"] = "0"
+            return self._error(429, "Too Many Requests", headers)
+        if self.rnd.random() < self.error_5xx:
+            return self._error(self.rnd.choice((500, 502, 503)), "injected failure", headers)
+
+        expires_at = self.tokens.get(token)
+        if endpoint not in self.USER_TOKEN_ENDPOINTS and (expires_at is None or expires_at < time.time() or self.rnd.random() < self.error_401):
+            if expires_at is not None:
+                # Injected 401 behaves like a revoked token
+                self.tokens.pop(token, None)
+            return self._error(401, "Invalid OAuth token", headers)
+        return headers
+
+    async def handle_token(self, request: web.Request) -> web.Response:
+        self._count("token")
+        await self._delay()
+        form = await request.post()
+        if not form.get("client_id") or not form.get("client_secret"):
+            return web.json_response({"status": 400, "message": "missing client id"}, status=400)
+        if self.rnd.random() < self.error_5xx:
+            return self._error(503, "injected failure")
+        token = secrets.token_hex(15)
+        self.tokens[token] = time.time() + self.token_ttl
+        return web.json_response({"access_token": token, "expires_in": self.token_ttl, "token_type": "bearer"})
+
+    async def handle_streams(self, request: web.Request) -> web.Response:
+        guard = await self._guard(request, "streams")
+        if isinstance(guard, web.Response):
+            return guard
+        data = []
+        for login in request.query.getall("user_login", []):
+            if self.is_online(login):
+                data.append(
+                    {
+                        "id": self.user_id(login + "#stream"),
+                        "user_id": self.user_id(login),
+                        "user_login": login.lower(),
+                        "type": "live",
+                        "viewer_count": 100,
+                    }
+                )
+        self._count("status_200")
+        return web.json_response({"data": data, "pagination": {}}, headers=guard)
+
+    async def handle_users(self, request: web.Request) -> web.Response:
+        guard = await self._guard(request, "users")
+        if isinstance(guard, web.Response):
+            return guard
+        data = [
+            {"id": self.user_id(login), "login": login.lower(), "display_name": login}
+            for login in request.query.getall("login", [])
+        ]
+        self._count("status_200")
+        return web.json_response({"data": data}, headers=guard)
+
+    async def handle_clips(self, request: web.Request) -> web.Response:
+        guard = await self._guard(request, "clips")
+        if isinstance(guard, web.Response):
+            return guard
+        clip_id = secrets.token_hex(8)
+        self._count("status_202")
+        return web.json_response(
+            {"data": [{"id": clip_id, "edit_url": f"https://clips.twitch.tv/{clip_id}/edit"}]},
+            status=202,
+            headers=guard,
+        )
+
+
+async def serve(args):
+    server = FakeHelixServer(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_401=args.error_401,
+        error_429=args.error_429,
+        error_5xx=args.error_5xx,
+        bucket_size=args.bucket,
+        refill_per_minute=args.refill,
+        token_ttl=args.token_ttl,
+    )
+    await server.start(args.host, args.port)
+    print(f"helix_api_base: {server.api_base}")
+    print(f"auth_base: {server.auth_base}")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"Запросы: {server.stats}")
+    finally:
+        await server.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=20, help="Response latency")
+    parser.add_argument("--jitter-ms", type=float, default=5, help="Random +/- latency jitter")
+    parser.add_argument("--error-401", type=float, default=0.0, help="Share of requests answered 401 (token revoked)")
+    parser.add_argument("--error-429", type=float, default=0.0, help="Share of requests answered 429 on top of the bucket")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="Share of requests answered 5xx")
+    parser.add_argument("--bucket", type=int, default=800, help="Rate-limit bucket size (points)")
+    parser.add_argument("--refill", type=int, default=800, help="Bucket refill per minute")
+    parser.add_argument("--token-ttl", type=int, default=3600, help="App token lifetime, seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Twitch Helix stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import collections
+import json
+import logging
+import math
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+
+
+logger = logging.getLogger("FakeTelegram")
+
+BOT_USER = {"id": 100000001, "is_bot": True, "first_name": "Drops Bench", "username": "drops_bench_bot"}
+RATE_LIMITED = {"sendMessage", "sendDocument", "editMessageText"}
+
+
+class FakeTelegramServer:
+    # Local stand-in for the Bot API methods the bot uses. Outgoing calls are counted and
+    # checked against Telegram-like flood limits (global msgs/s and per-chat msgs/s);
+    # incoming traffic is whatever the simulator pushes: queued for getUpdates, or POSTed
+    # to the webhook once the bot has called setWebhook, at most max_connections at a time.
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        global_rate: int = 30,
+        chat_rate: float = 1.0,
+        group_rate_per_minute: int = 20,
+        seed: int | None = None,
+    ):
+        self.latency_ms = float(latency_ms)
+        self.global_rate = int(global_rate)
+        self.chat_rate = float(chat_rate)
+        self.group_rate_per_minute = int(group_rate_per_minute)
+        self.rnd = random.Random(seed)
+
+        self.stats: dict[str, int] = {}
+        self.sent_by_chat: collections.Counter[int] = collections.Counter()
+        self._updates: collections.deque[dict] = collections.deque()
+        self._update_event = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._global_window: collections.deque[float] = collections.deque()
+        self._chat_windows: dict[int, collections.deque[float]] = {}
+        self._waiters: list[tuple[callable, asyncio.Future]] = []
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+        # perf_counter() at push, for measuring how long an update takes to reach the bot
+        self.pushed_at: dict[int, float] = {}
+        self.webhook: dict | None = None
+        self._webhook_limit: asyncio.Semaphore | None = None
+        self._webhook_http: aiohttp.ClientSession | None = None
+        self._deliveries: set[asyncio.Task] = set()
+        # (chat_id, message_id) -> what the message shows, for "message is not modified"
+        self._contents: dict[tuple[int, int], tuple] = {}
+
+    def reset_stats(self) -> None:
+        self.stats = {}
+        self.sent_by_chat.clear()
+
+    def _count(self, key: str, n: int = 1) -> None:
+        self.stats[key] = self.stats.get(key, 0) + n
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/bot{token}/{method}", self.handle_method)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sock = site._server.sockets[0]
+        self.base_url = f"http://{host}:{sock.getsockname()[1]}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        for task in list(self._deliveries):
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        if self._webhook_http:
+            await self._webhook_http.close()
+            self._webhook_http = None
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # --- incoming traffic -------------------------------------------------
+
+    def push_update(self, update: dict) -> int:
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        self.pushed_at[update["update_id"]] = time.perf_counter()
+        if self.webhook:
+            task = asyncio.create_task(self._deliver(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        else:
+            self._updates.append(update)
+            self._update_event.set()
+        return update["update_id"]
+
+    async def _deliver(self, update: dict) -> None:
+        # Telegram retries a delivery that did not get a 2xx; so does this, a few times
+        webhook = self.webhook
+        headers = {"X-Telegram-Bot-Api-Secret-Token": webhook["secret_token"]} if webhook.get("secret_token") else {}
+        if self._webhook_http is None:
+            self._webhook_http = aiohttp.ClientSession()
+        async with self._webhook_limit:
+            for attempt in range(3):
+                try:
+                    async with self._webhook_http.post(webhook["url"], json=update, headers=headers) as resp:
+                        await resp.read()
+                        self._count(f"webhook_{resp.status}")
+                        if resp.status < 300:
+                            return
+                except aiohttp.ClientError:
+                    self._count("webhook_error")
+                await asyncio.sleep(0.1 * (attempt + 1))
+        self._count("webhook_failed")
+
+    def push_message(self, user_id: int, text: str, chat_id: int | None = None, username: str | None = None) -> int:
+        chat_id = user_id if chat_id is None else chat_id
+        user = {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": username or f"user{user_id}"}
+        message = {
+            "message_id": self._new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id, user),
+            "from": user,
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split(" ", 1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self.push_update({"message": message})
+
+    def push_callback(self, user_id: int, data: str, message_id: int | None = None) -> int:
+        user = {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"user{user_id}"}
+        message = {
+            "message_id": message_id or self._new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(user_id, user),
+            "from": BOT_USER,
+            "text": "menu",
+        }
+        return self.push_update(
+            {
+                "callback_query": {
+                    "id": str(self.rnd.getrandbits(48)),
+                    "from": user,
+                    "chat_instance": str(user_id),
+                    "message": message,
+                    "data": data,
+                }
+            }
+        )
+
+    def wait_for(self, predicate) -> asyncio.Future:
+        # Resolves with the first outgoing call for which predicate(method, params) is true
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((predicate, fut))
+        return fut
+
+    # --- Bot API ----------------------------------------------------------
+
+    def _new_message_id(self) -> int:
+        self._next_message_id += 1
+        return self._next_message_id
+
+    def _chat(self, chat_id: int, user: dict | None = None) -> dict:
+        if chat_id < 0:
+            return {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"}
+        chat = {"id": chat_id, "type": "private"}
+        if user:
+            chat["first_name"] = user.get("first_name")
+            chat["username"] = user.get("username")
+        return chat
+
+    def _flood_check(self, chat_id: int) -> int:
+        # Returns retry_after seconds, 0 when the call is allowed
+        now = time.monotonic()
+        window = self._global_window
+        while window and now - window[0] >= 1:
+            window.popleft()
+        if self.global_rate and len(window) >= self.global_rate:
+            return max(1, math.ceil(1 - (now - window[0])))
+
+        span, limit = (60.0, self.group_rate_per_minute) if chat_id < 0 else (1.0, self.chat_rate)
+        if 0 < limit < 1:
+            span, limit = 1.0 / limit, 1
+        if limit:
+            chat_window = self._chat_windows.setdefault(chat_id, collections.deque())
+            while chat_window and now - chat_window[0] >= span:
+                chat_window.popleft()
+            if len(chat_window) >= limit:
+                return max(1, math.ceil(span - (now - chat_window[0])))
+            chat_window.append(now)
+
+        window.append(now)
+        return 0
+
+    def _notify(self, method: str, params: dict) -> None:
+        if not self._waiters:
+            return
+        still = []
+        for predicate, fut in self._waiters:
+            if fut.done():
+                continue
+            if predicate(method, params):
+                fut.set_result((method, params, time.perf_counter()))
+            else:
+                still.append((predicate, fut))
+        self._waiters = still
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _fail(code: int, description: str, parameters: dict | None = None) -> web.Response:
+        payload = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            payload["parameters"] = parameters
+        return web.json_response(payload, status=code)
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {}
+            for key, value in (await request.post()).items():
+                params[key] = value if isinstance(value, (str, int, float)) else getattr(value, "filename", "file")
+        self._count(method)
+
+        if method == "getUpdates":
+            if self.webhook:
+                return self._fail(409, "Conflict: can't use getUpdates method while webhook is active; use deleteWebhook to delete the webhook first")
+            return await self.get_updates(params)
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+
+        if method == "getMe":
+            return self._ok(BOT_USER)
+        if method == "setWebhook":
+            self.webhook = {
+                "url": params.get("url"),
+                "secret_token": params.get("secret_token"),
+                "max_connections": int(params.get("max_connections") or 40),
+            }
+            self._webhook_limit = asyncio.Semaphore(self.webhook["max_connections"])
+            return self._ok(True)
+        if method == "deleteWebhook":
+            self.webhook = None
+            return self._ok(True)
+        if method in ("close", "logOut", "setMyCommands"):
+            return self._ok(True)
+        if method == "answerCallbackQuery":
+            self._notify(method, params)
+            return self._ok(True)
+
+        try:
+            chat_id = int(params.get("chat_id"))
+        except (TypeError, ValueError):
+            return self._fail(400, "Bad Request: chat_id is empty")
+
+        content = (params.get("text", ""), params.get("parse_mode"), params.get("reply_markup"))
+        if method == "editMessageText" and self._contents.get((chat_id, int(params.get("message_id") or 0))) == content:
+            self._count("not_modified")
+            return self._fail(
+                400,
+                "Bad Request: message is not modified: specified new message content and reply markup are "
+                "exactly the same as a current content and reply markup of the message",
+            )
+
+        if method in RATE_LIMITED:
+            retry_after = self._flood_check(chat_id)
+            if retry_after:
+                self._count("flood_429")
+                return self._fail(429, f"Too Many Requests: retry after {retry_after}", {"retry_after": retry_after})
+
+        self.sent_by_chat[chat_id] += 1
+        self._notify(method, params)
+        message = {
+            "message_id": self._new_message_id(),
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": BOT_USER,
+        }
+        if method == "sendMessage":
+            message["text"] = params.get("text", "")
+            self._contents[(chat_id, message["message_id"])] = content
+            return self._ok(message)
+        if method == "editMessageText":
+            message["message_id"] = int(params.get("message_id") or message["message_id"])
+            message["text"] = params.get("text", "")
+            message["edit_date"] = int(time.time())
+            self._contents[(chat_id, message["message_id"])] = content
+            return self._ok(message)
+        if method == "sendDocument":
+            message["document"] = {"file_id": f"doc{message['message_id']}", "file_unique_id": f"u{message['message_id']}"}
+            message["caption"] = params.get("caption")
+            return self._ok(message)
+        return self._ok(message)
+
+    async def get_updates(self, params: dict) -> web.Response:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout > 0:
+            self._update_event.clear()
+            try:
+                await asyncio.wait_for(self._update_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = [u for _, u in zip(range(limit), self._updates)]
+        self._count("updates_delivered", len(batch))
+        return self._ok(batch)
+
+
+async def serve(args):
+    server = FakeTelegramServer(latency_ms=args.latency_ms, global_rate=args.global_rate, chat_rate=args.chat_rate)
+    await server.start(args.host, args.port)
+    print(f"api_server: {server.base_url}")
+    try:
+        while True:
+            await asyncio.sleep(60)
+            logger.info(f"Вызовы: {json.dumps(server.stats, ensure_ascii=False)}")
+    finally:
+        await server.stop()
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--latency-ms", type=float, default=5, help="Bot API response latency")
+    parser.add_argument("--global-rate", type=int, default=30, help="Outgoing messages per second before 429")
+    parser.add_argument("--chat-rate", type=float, default=1.0, help="Messages per second per private chat before 429")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Telegram Bot API stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import struct
+import time
+
+from metrics import IPC_DROPPED, IPC_FRAMES, IPC_PEERS, IPC_REQUEST_SECONDS
+
+
+logger = logging.getLogger("IPC")
+
+# Frame: 4-byte big-endian length, then one JSON object
+HEADER = struct.Struct(">I")
+MAX_FRAME = 1 << 20
+
+
+def ipc_settings(config: dict) -> dict:
+    raw = config.get("ipc") or {}
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "path": raw.get("path") or "bot.sock",
+        "queue_size": max(1, int(raw.get("queue_size", 1000))),
+        "max_inflight": max(1, int(raw.get("max_inflight", 64))),
+        "send_timeout_seconds": float(raw.get("send_timeout_seconds", 1)),
+        "request_timeout_seconds": float(raw.get("request_timeout_seconds", 5)),
+        "reconnect_max_seconds": float(raw.get("reconnect_max_seconds", 5)),
+        "poll_seconds": float(raw.get("poll_seconds", 30)),
+    }
+
+
+class BusError(Exception):
+    pass
+
+
+def encode(message: dict) -> bytes:
+    body = json.dumps(message, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+    if len(body) > MAX_FRAME:
+        raise BusError(f"сообщение {message.get('topic')} больше {MAX_FRAME} байт")
+    return HEADER.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    try:
+        (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+        if size > MAX_FRAME:
+            raise BusError(f"кадр {size} байт больше {MAX_FRAME}")
+        return json.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def _prefix(topic: str) -> str:
+    # "trigger:42" -> "trigger", so metrics do not get a label per channel
+    return (topic or "").split(":", 1)[0]
+
+
+class Bus:
+    # In-process bus. Handlers registered with on() receive publish()ed events
+    # (fire-and-forget) and answer request()s (request/response). One handler per topic
+    # per process; per-channel topics look like "trigger:<channel_id>". BusServer and
+    # BusClient carry the same calls between processes over a Unix socket.
+    def __init__(self, name: str = "local", request_timeout: float = 5, send_timeout: float = 1):
+        self.name = name
+        self.request_timeout = float(request_timeout)
+        self.send_timeout = float(send_timeout)
+        self.handlers: dict[str, object] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def connected(self) -> bool:
+        return True
+
+    def on(self, topic: str, handler) -> None:
+        # handler(data) may be a plain function or a coroutine function; for requests its
+        # return value (JSON-serializable) is the response
+        self.handlers[topic] = handler
+        self._topics_changed("sub", topic)
+
+    def off(self, topic: str) -> None:
+        if self.handlers.pop(topic, None) is not None:
+            self._topics_changed("unsub", topic)
+
+    def _topics_changed(self, op: str, topic: str) -> None:
+        pass
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _call(self, topic: str, data):
+        result = self.handlers[topic](data)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def _run_event(self, topic: str, data) -> None:
+        try:
+            await self._call(topic, data)
+        except Exception as e:
+            logger.error(f"IPC: ошибка обработчика {topic}: {e}")
+
+    async def _call_local(self, topic: str, data, timeout: float):
+        try:
+            return await asyncio.wait_for(self._call(topic, data), timeout)
+        except asyncio.TimeoutError:
+            raise BusError(f"{topic}: нет ответа за {timeout:g} с") from None
+
+    async def _deliver(self, topic: str, data, source) -> bool:
+        if topic not in self.handlers:
+            return False
+        if source is None:
+            # Published here: the publisher does not wait for the handler
+            self._spawn(self._run_event(topic, data))
+        else:
+            # From a peer: awaited, so max_inflight bounds the work taken off the socket
+            await self._run_event(topic, data)
+        return True
+
+    async def _answer(self, topic: str, data, timeout: float, source):
+        if topic in self.handlers:
+            return await self._call_local(topic, data, timeout)
+        raise BusError(f"нет обработчика {topic}")
+
+    async def publish(self, topic: str, data=None) -> bool:
+        # True if a handler here took the event or it was queued to the hub or a peer
+        return await self._deliver(topic, data, None)
+
+    async def request(self, topic: str, data=None, timeout: float | None = None):
+        timeout = float(timeout or self.request_timeout)
+        started = time.perf_counter()
+        try:
+            return await self._answer(topic, data, timeout, None)
+        finally:
+            IPC_REQUEST_SECONDS.labels(_prefix(topic)).observe(time.perf_counter() - started)
+
+    async def run(self) -> None:
+        return
+
+
+class _Connection:
+    def __init__(self, name: str, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, queue_size: int):
+        self.name = name
+        self.reader = reader
+        self.writer = writer
+        # Outgoing frames; bounded so a stuck peer makes senders wait instead of growing memory
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(queue_size)
+        self.topics: set[str] = set()
+
+
+class _SocketBus(Bus):
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        queue_size: int = 1000,
+        max_inflight: int = 64,
+        reconnect_max_seconds: float = 5,
+        **kwargs,
+    ):
+        super().__init__(name, **kwargs)
+        self.path = path
+        self.queue_size = int(queue_size)
+        self.max_inflight = int(max_inflight)
+        self.reconnect_max_seconds = float(reconnect_max_seconds)
+        self._ids = itertools.count(1)
+        self._pending: dict[int, tuple[asyncio.Future, _Connection]] = {}
+
+    async def _put(self, conn: _Connection, message: dict) -> bool:
+        frame = encode(message)
+        try:
+            conn.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(conn.queue.put(frame), self.send_timeout)
+            except asyncio.TimeoutError:
+                IPC_DROPPED.labels("queue_full").inc()
+                logger.warning(f"IPC: очередь к {conn.name} заполнена дольше {self.send_timeout:g} с, {message.get('topic')} не отправлено")
+                return False
+        IPC_FRAMES.labels(message["op"], "out").inc()
+        return True
+
+    async def _write_loop(self, conn: _Connection) -> None:
+        while True:
+            frame = await conn.queue.get()
+            conn.writer.write(frame)
+            # Returns at once below the transport's high-water mark
+            await conn.writer.drain()
+
+    async def _read_loop(self, conn: _Connection) -> None:
+        # At most max_inflight events and requests run at a time per connection; past that
+        # reading stops, the socket buffer fills and the sender's queue pushes back
+        limit = asyncio.Semaphore(self.max_inflight)
+        while True:
+            message = await read_frame(conn.reader)
+            if message is None:
+                return
+            op = message.get("op")
+            IPC_FRAMES.labels(op, "in").inc()
+            if op in ("res", "err"):
+                self._resolve(message)
+            elif op == "sub":
+                conn.topics.update(message.get("topics") or [])
+            elif op == "unsub":
+                conn.topics.difference_update(message.get("topics") or [])
+            elif op in ("pub", "req"):
+                await limit.acquire()
+                task = self._spawn(self._dispatch(conn, message))
+                task.add_done_callback(lambda _: limit.release())
+
+    async def _dispatch(self, conn: _Connection, message: dict) -> None:
+        topic, data = message.get("topic"), message.get("data")
+        if message["op"] == "pub":
+            await self._deliver(topic, data, conn)
+            return
+        try:
+            reply = {"op": "res", "id": message["id"], "data": await self._answer(topic, data, float(message.get("timeout") or self.request_timeout), conn)}
+        except Exception as e:
+            reply = {"op": "err", "id": message["id"], "error": str(e) or type(e).__name__}
+        try:
+            await self._put(conn, reply)
+        except BusError as e:
+            await self._put(conn, {"op": "err", "id": message["id"], "error": str(e)})
+
+    def _resolve(self, message: dict) -> None:
+        entry = self._pending.pop(message.get("id"), None)
+        if entry is None or entry[0].done():
+            # Answered after the requester gave up
+            return
+        if message["op"] == "res":
+            entry[0].set_result(message.get("data"))
+        else:
+            entry[0].set_exception(BusError(message.get("error") or "ошибка"))
+
+    async def _send_request(self, conn: _Connection, topic: str, data, timeout: float):
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, conn)
+        try:
+            if not await self._put(conn, {"op": "req", "id": request_id, "topic": topic, "data": data, "timeout": timeout}):
+                raise BusError(f"{topic}: очередь к {conn.name} заполнена")
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise BusError(f"{topic}: нет ответа за {timeout:g} с") from None
+        finally:
+            self._pending.pop(request_id, None)
+
+    def _fail_pending(self, conn: _Connection) -> None:
+        for request_id, (future, target) in list(self._pending.items()):
+            if target is conn and not future.done():
+                future.set_exception(BusError(f"соединение с {conn.name} потеряно"))
+
+    def _close(self, conn: _Connection, writer_task: asyncio.Task) -> None:
+        writer_task.cancel()
+        self._fail_pending(conn)
+        conn.writer.close()
+
+
+class BusServer(_SocketBus):
+    # The hub, in the Telegram process. Clients announce their topics on connect and on
+    # every on()/off(); events go to every process with a handler (this one included),
+    # requests to the first one that has it.
+    def __init__(self, path: str, name: str = "hub", **kwargs):
+        super().__init__(path, name, **kwargs)
+        self.peers: set[_Connection] = set()
+        IPC_PEERS.set_function(lambda: len(self.peers))
+
+    async def run(self) -> None:
+        if os.path.exists(self.path):
+            # Left over from a process that did not exit cleanly
+            os.unlink(self.path)
+        server = await asyncio.start_unix_server(self._serve, path=self.path)
+        logger.info(f"IPC: слушаем {self.path}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            # Closing the listener leaves accepted connections open; the clients must see
+            # the hub go away to fall back and reconnect
+            for peer in list(self.peers):
+                peer.writer.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        conn = _Connection("?", reader, writer, self.queue_size)
+        writer_task = asyncio.create_task(self._write_loop(conn))
+        try:
+            hello = await read_frame(reader)
+            if not hello or hello.get("op") != "hello":
+                return
+            conn.name = str(hello.get("name") or "?")
+            conn.topics = set(hello.get("topics") or [])
+            self.peers.add(conn)
+            logger.info(f"IPC: подключился {conn.name}, обработчиков: {len(conn.topics)}")
+            await self._read_loop(conn)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"IPC: соединение с {conn.name}: {e}")
+        finally:
+            if conn in self.peers:
+                self.peers.discard(conn)
+                logger.warning(f"IPC: {conn.name} отключился")
+            self._close(conn, writer_task)
+
+    async def _deliver(self, topic: str, data, source) -> bool:
+        delivered = False
+        for peer in list(self.peers):
+            if peer is not source and topic in peer.topics:
+                delivered = await self._put(peer, {"op": "pub", "topic": topic, "data": data}) or delivered
+        return await super()._deliver(topic, data, source) or delivered
+
+    async def _answer(self, topic: str, data, timeout: float, source):
+        if topic in self.handlers:
+            return await self._call_local(topic, data, timeout)
+        for peer in list(self.peers):
+            if peer is not source and topic in peer.topics:
+                return await self._send_request(peer, topic, data, timeout)
+        raise BusError(f"нет обработчика {topic}")
+
+
+class BusClient(_SocketBus):
+    # A Twitch worker. Connects to the hub and reconnects with a growing pause; while
+    # disconnected publish() returns False and request() raises BusError, so callers fall
+    # back to what they did before the bus (direct Bot API call, DB polling).
+    def __init__(self, path: str, name: str, **kwargs):
+        super().__init__(path, name, **kwargs)
+        self._conn: _Connection | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None
+
+    def _topics_changed(self, op: str, topic: str) -> None:
+        conn = self._conn
+        if conn is None:
+            # Sent with hello on the next connect
+            return
+        try:
+            conn.queue.put_nowait(encode({"op": op, "topics": [topic]}))
+        except asyncio.QueueFull:
+            self._spawn(self._put(conn, {"op": op, "topics": [topic]}))
+
+    async def run(self) -> None:
+        delay = 0.1
+        failures = 0
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                failures += 1
+                if failures == 1:
+                    logger.warning(f"IPC: нет соединения с {self.path} ({e}), повторяем")
+                await asyncio.sleep(delay)
+                delay = min(self.reconnect_max_seconds, delay * 2)
+                continue
+            delay, failures = 0.1, 0
+            conn = _Connection("hub", reader, writer, self.queue_size)
+            writer.write(encode({"op": "hello", "name": self.name, "topics": sorted(self.handlers)}))
+            writer_task = asyncio.create_task(self._write_loop(conn))
+            self._conn = conn
+            logger.info(f"IPC: подключены к {self.path} как {self.name}")
+            try:
+                await self._read_loop(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"IPC: ошибка соединения: {e}")
+            finally:
+                self._conn = None
+                self._close(conn, writer_task)
+            logger.warning(f"IPC: соединение с {self.path} потеряно, переподключение")
+
+    async def _deliver(self, topic: str, data, source) -> bool:
+        delivered = await super()._deliver(topic, data, source)
+        if source is None:
+            conn = self._conn
+            if conn is None:
+                IPC_DROPPED.labels("disconnected").inc()
+                return delivered
+            delivered = await self._put(conn, {"op": "pub", "topic": topic, "data": data}) or delivered
+        return delivered
+
+    async def _answer(self, topic: str, data, timeout: float, source):
+        if topic in self.handlers:
+            return await self._call_local(topic, data, timeout)
+        if source is not None:
+            raise BusError(f"нет обработчика {topic}")
+        conn = self._conn
+        if conn is None:
+            raise BusError(f"{topic}: нет соединения с {self.path}")
+        return await self._send_request(conn, topic, data, timeout)
+
+
+def make_bus(config: dict, name: str, hub: bool) -> Bus | None:
+    # hub: this process runs Telegram. With ipc disabled the bus stays inside the process,
+    # so a single-process run still wakes its bots at once; a worker gets none and polls
+    settings = ipc_settings(config)
+    common = {"request_timeout": settings["request_timeout_seconds"], "send_timeout": settings["send_timeout_seconds"]}
+    if not settings["enabled"]:
+        return Bus(name, **common) if hub else None
+    cls = BusServer if hub else BusClient
+    return cls(
+        settings["path"],
+        name,
+        queue_size=settings["queue_size"],
+        max_inflight=settings["max_inflight"],
+        reconnect_max_seconds=settings["reconnect_max_seconds"],
+        **common,
+    )
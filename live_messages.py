@@ -0,0 +1,102 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+
+logger = logging.getLogger("LiveMessages")
+
+
+class LiveMessageUpdater:
+    # Coalesces edits of live-updating messages (GOLD check counters etc.).
+    # Per (chat_id, message_id) at most one edit per `interval` seconds is sent with the
+    # latest published content; a publish with final=True is always delivered and
+    # anything published for that message afterwards is ignored.
+    def __init__(self, bot: Bot, interval: float = 3.0, max_finalized: int = 1000):
+        self.bot = bot
+        self.interval = float(interval)
+        self.max_finalized = int(max_finalized)
+        self._pending: dict[tuple[int, int], dict] = {}
+        self._tasks: dict[tuple[int, int], asyncio.Task] = {}
+        # Highest seq seen per message, kept after its edits are sent so a late publish
+        # with a lower seq is still dropped; bounded like _finalized
+        self._seq: OrderedDict[tuple[int, int], int] = OrderedDict()
+        self._finalized: OrderedDict[tuple[int, int], None] = OrderedDict()
+
+    def publish(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        reply_markup=None,
+        parse_mode: str | None = None,
+        final: bool = False,
+        seq: int | None = None,
+    ) -> None:
+        key = (int(chat_id), int(message_id))
+        if key in self._finalized:
+            return
+        if seq is not None:
+            if seq < self._seq.get(key, seq):
+                return
+            self._seq[key] = seq
+            self._seq.move_to_end(key)
+            while len(self._seq) > self.max_finalized:
+                self._seq.popitem(last=False)
+        pending = self._pending.get(key)
+        if pending and pending["final"] and not final:
+            return
+        self._pending[key] = {
+            "text": text,
+            "reply_markup": reply_markup,
+            "parse_mode": parse_mode,
+            "final": bool(final),
+        }
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            self._tasks[key] = asyncio.create_task(self._run(key))
+
+    async def flush(self) -> None:
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run(self, key: tuple[int, int]):
+        try:
+            while True:
+                payload = self._pending.pop(key, None)
+                if payload is None:
+                    return
+                await self._send(key, payload)
+                if payload["final"] and key not in self._pending:
+                    self._finalized[key] = None
+                    while len(self._finalized) > self.max_finalized:
+                        self._finalized.popitem(last=False)
+                    return
+                await asyncio.sleep(self.interval)
+        finally:
+            if self._tasks.get(key) is asyncio.current_task():
+                self._tasks.pop(key, None)
+
+    async def _send(self, key: tuple[int, int], payload: dict):
+        chat_id, message_id = key
+        try:
+            await self.bot.edit_message_text(
+                text=payload["text"],
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=payload["reply_markup"],
+                parse_mode=payload["parse_mode"],
+            )
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood limit при обновлении {chat_id}/{message_id}, ждём {e.retry_after}с")
+            await asyncio.sleep(e.retry_after)
+            # Retry unless something newer was published meanwhile
+            self._pending.setdefault(key, payload)
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.error(f"Не удалось обновить сообщение {chat_id}/{message_id}: {e}")
+        except Exception as e:
+            logger.error(f"Не удалось обновить сообщение {chat_id}/{message_id}: {e}")
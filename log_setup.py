@@ -0,0 +1,194 @@
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+
+from metrics import LOG_RECORDS_DROPPED
+
+
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through `extra=` and goes to JSON as is
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def logging_settings(config: dict) -> dict:
+    raw = config.get("logging") or {}
+    return {
+        "file": raw.get("file") or "bot.log",
+        "level": str(raw.get("level") or "INFO").upper(),
+        "format": str(raw.get("format") or "text").lower(),
+        "console": bool(raw.get("console", True)),
+        "rotate": str(raw.get("rotate") or "size").lower(),
+        "max_mb": float(raw.get("max_mb", 50)),
+        "when": raw.get("when") or "midnight",
+        "backup_count": int(raw.get("backup_count", 10)),
+        "compress": bool(raw.get("compress", True)),
+        "queue_size": int(raw.get("queue_size", 10000)),
+        "sample_rate": float(raw.get("sample_rate", 5)),
+        "sample_burst": int(raw.get("sample_burst", 20)),
+        "sample_max_level": str(raw.get("sample_max_level") or "WARNING").upper(),
+    }
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "site": f"{record.module}:{record.lineno}",
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SiteSampler(logging.Filter):
+    # Token bucket per call site (file + line): a site may log `rate` records per second with
+    # bursts of `burst`. Records over the budget are dropped on the calling thread, before
+    # they are formatted or queued; the next record that passes carries how many were dropped.
+    def __init__(self, rate: float, burst: int, max_level: int = logging.WARNING):
+        super().__init__()
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.max_level = max_level
+        self._sites: dict[tuple[str, int], list] = {}
+        self._dropped = LOG_RECORDS_DROPPED.labels("sampled")
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 0 or record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        site = self._sites.get(key)
+        if site is None:
+            # [tokens, last refill, suppressed]
+            site = self._sites[key] = [float(self.burst), now, 0]
+        tokens = min(float(self.burst), site[0] + (now - site[1]) * self.rate)
+        site[1] = now
+        if tokens < 1:
+            site[0] = tokens
+            site[2] += 1
+            self._dropped.inc()
+            return False
+        site[0] = tokens - 1
+        if site[2]:
+            record.msg = f"{record.getMessage()} (подавлено похожих: {site[2]})"
+            record.args = None
+            record.suppressed = site[2]
+            site[2] = 0
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    # A full queue means the writer cannot keep up with the disk; dropping the record is
+    # better than blocking the event loop or printing a traceback for each one
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self._dropped = LOG_RECORDS_DROPPED.labels("queue_full")
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same process, so the record can travel as is: only the args are merged here (they
+        # may change later); tracebacks are formatted by the writer thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self._dropped.inc()
+
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    # Runs on the writer thread, so compressing a large file never touches the event loop
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def file_handler(settings: dict) -> logging.Handler:
+    path = settings["file"]
+    if settings["rotate"] == "size":
+        handler = logging.handlers.RotatingFileHandler(
+            path,
+            maxBytes=int(settings["max_mb"] * 1024 * 1024),
+            backupCount=settings["backup_count"],
+            encoding="utf-8",
+        )
+    elif settings["rotate"] == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=settings["when"], backupCount=settings["backup_count"], encoding="utf-8"
+        )
+    else:
+        return logging.FileHandler(path, encoding="utf-8")
+    if settings["compress"]:
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    return handler
+
+
+class LogPipeline:
+    def __init__(self, listener: logging.handlers.QueueListener, handlers: list[logging.Handler]):
+        self.listener = listener
+        self.handlers = handlers
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def stop(self) -> None:
+        # Drains whatever is still queued, then closes the files
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+def setup_logging(config: dict) -> LogPipeline:
+    # The root logger only puts records on a queue; a QueueListener thread formats them and
+    # does all file and console I/O, including rotation
+    settings = logging_settings(config)
+    formatter = JsonFormatter() if settings["format"] == "json" else logging.Formatter(FORMAT)
+    handlers = [file_handler(settings)]
+    if settings["console"]:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=max(0, settings["queue_size"]))
+    queue_handler = DroppingQueueHandler(log_queue)
+    max_level = logging.getLevelName(settings["sample_max_level"])
+    queue_handler.addFilter(
+        SiteSampler(settings["sample_rate"], settings["sample_burst"], max_level if isinstance(max_level, int) else logging.WARNING)
+    )
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(settings["level"])
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return LogPipeline(listener, handlers)
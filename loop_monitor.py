@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from metrics import LOOP_LAG_SECONDS, LOOP_STALL_SECONDS, LOOP_STALLS
+
+
+logger = logging.getLogger("LoopMonitor")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def monitor_settings(config: dict) -> dict:
+    raw = config.get("loop_monitor") or {}
+    return {
+        "enabled": bool(raw.get("enabled", True)),
+        "interval_ms": float(raw.get("interval_ms", 100)),
+        "threshold_ms": float(raw.get("threshold_ms", 200)),
+        "stack_depth": int(raw.get("stack_depth", 12)),
+    }
+
+
+def _is_project_frame(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    return path.startswith(PROJECT_DIR + os.sep) and not path.endswith("loop_monitor.py")
+
+
+def callback_frames(frames: traceback.StackSummary) -> list[traceback.FrameSummary]:
+    # Drops asyncio.run / run_forever / Handle._run so the stack starts at the callback or task step
+    start = 0
+    for i, f in enumerate(frames):
+        if f.name == "_run" and f.filename.endswith(os.path.join("asyncio", "events.py")):
+            start = i + 1
+    return list(frames[start:])
+
+
+def describe_stack(frames: list[traceback.FrameSummary]) -> tuple[str, str]:
+    # (where, at): the outermost project function of the running callback is the handler or
+    # loop that owns the stall (private_text_router, giveaway_loop, ...); the innermost one is
+    # the line that was running when the stack was taken
+    own = [f for f in frames if _is_project_frame(f.filename)]
+    if not own:
+        last = frames[-1] if frames else None
+        return "unknown", f"{os.path.basename(last.filename)}:{last.lineno} {last.name}" if last else "?"
+    outer, inner = own[0], own[-1]
+    return outer.name, f"{os.path.basename(inner.filename)}:{inner.lineno} {inner.name}"
+
+
+class LoopMonitor:
+    # A coroutine wakes every interval and measures how late it woke (loop lag). A watchdog
+    # thread watches its heartbeat: when the loop has not come back for threshold_ms, the
+    # thread takes the loop thread's stack while the blocking call is still on it.
+    def __init__(self, interval_ms: float = 100, threshold_ms: float = 200, stack_depth: int = 12):
+        self.interval = max(0.01, float(interval_ms) / 1000)
+        self.threshold = max(self.interval, float(threshold_ms) / 1000)
+        self.stack_depth = int(stack_depth)
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._captured: dict | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def from_config(cls, config: dict) -> "LoopMonitor | None":
+        settings = monitor_settings(config)
+        if not settings["enabled"]:
+            return None
+        return cls(settings["interval_ms"], settings["threshold_ms"], settings["stack_depth"])
+
+    def _capture(self, beat: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        frames = callback_frames(traceback.extract_stack(frame))
+        task = asyncio.current_task(self._loop) if self._loop else None
+        where, at = describe_stack(frames)
+        self._captured = {
+            "beat": beat,
+            "where": where,
+            "at": at,
+            "task": task.get_name() if task else "-",
+            "coro": getattr(task.get_coro(), "__qualname__", "?") if task else "-",
+            "stack": "".join(traceback.format_list(frames[-self.stack_depth :])),
+        }
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stop.wait(self.threshold / 4):
+            beat = self._heartbeat
+            if beat != reported and time.monotonic() - beat - self.interval >= self.threshold:
+                reported = beat
+                try:
+                    self._capture(beat)
+                except Exception as e:
+                    logger.debug(f"Не удалось снять стек: {e}")
+
+    def _report(self, beat: float, lag: float) -> None:
+        self.stalls += 1
+        captured = self._captured if self._captured and self._captured["beat"] == beat else None
+        where = captured["where"] if captured else "unknown"
+        LOOP_STALLS.labels(where).inc()
+        LOOP_STALL_SECONDS.inc(lag)
+        if captured:
+            logger.warning(
+                f"Event loop заблокирован на {lag * 1000:.0f} мс: {where} ({captured['at']}), "
+                f"задача {captured['task']} [{captured['coro']}]\n{captured['stack'].rstrip()}"
+            )
+        else:
+            # Stall shorter than the watchdog period or spread over many callbacks
+            logger.warning(f"Event loop отстаёт на {lag * 1000:.0f} мс")
+
+    async def run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+        lag_metric = LOOP_LAG_SECONDS.labels()
+        try:
+            while True:
+                beat = self._heartbeat
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                lag = max(0.0, now - beat - self.interval)
+                self._heartbeat = now
+                lag_metric.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag >= self.threshold:
+                    self._report(beat, lag)
+        finally:
+            self._stop.set()
@@ -1,65 +1,123 @@
 import asyncio
 import logging
 from bot import TwitchBot
+import telegram_bot
 from telegram_bot import start_telegram_bot
 from db import Database
+from eventsub import EventSubClient
+from ipc import Bus, make_bus
+from backup import backup_loop, backup_settings
+from retention import retention_loop, retention_settings
+import query_profiler
+from loop_monitor import LoopMonitor
+from log_setup import setup_logging
+from metrics import ACTIVE_BOTS, instrument_commits, instrument_database, instrument_telegram, metrics_settings, serve_metrics
+from supervisor import Shard, run_supervisor, supervisor_settings
 import yaml
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log"),
-        logging.StreamHandler()
-    ]
-)
+async def prepare_startup(config: dict, db: Database):
+    # The schema and default channel only need the DB, bot_id only needs Helix: run the
+    # two chains side by side instead of paying the Helix round trip after the DB work
+    async def prepare_db():
+        await db.init()
+        default_channel = (config["twitch"]["channel"] or "").replace("#", "").lower()
+        default_channel_id = await db.ensure_channel(default_channel, None)
+        await db.backfill_channel_data(default_channel_id)
 
-async def manage_twitch_bots(config: dict):
-    db = Database(config["database"]["db_path"])
-    await db.init()
+    _, bot_id = await asyncio.gather(prepare_db(), TwitchBot.resolve_bot_id(config))
+    return bot_id
 
-    default_channel = (config["twitch"]["channel"] or "").replace("#", "").lower()
-    default_channel_id = await db.ensure_channel(default_channel, None)
-    await db.backfill_channel_data(default_channel_id)
 
-    bot_id = await TwitchBot.resolve_bot_id(config)
+async def manage_twitch_bots(config: dict, shard: Shard | None = None, bus: Bus | None = None):
+    db = Database(config["database"]["db_path"])
+    bot_id = await prepare_startup(config, db)
     active_bots: dict[int, asyncio.Task] = {}
+    # Telegram announces added or enabled channels, so they start without waiting for the scan
+    channels_changed = asyncio.Event()
+    if bus is not None:
+        bus.on("channels", lambda data=None: channels_changed.set())
+    # One EventSub session for all channels; without it every bot polls /streams
+    eventsub = EventSubClient.from_config(config, shard.index if shard else 0)
+    eventsub_task = asyncio.create_task(eventsub.run(), name="eventsub") if eventsub else None
 
     while True:
         try:
+            channels_changed.clear()
             channels = await db.list_enabled_channels()
             for ch in channels:
                 ch_id = int(ch["id"])
                 if ch_id in active_bots:
                     continue
-                bot = TwitchBot(config, bot_id, ch["login"], ch_id)
+                if shard is not None and not shard.owns(ch_id):
+                    # Another worker's channel; new rows in `channels` land on their owner here
+                    continue
+                bot = TwitchBot(config, bot_id, ch["login"], ch_id, eventsub=eventsub, bus=bus)
                 active_bots[ch_id] = asyncio.create_task(bot.start())
-                logging.info(f"Twitch бот запущен для канала {ch['login']}")
-            await asyncio.sleep(20)
+                logging.info(f"Twitch бот запущен для канала {ch['login']}" + (f" ({shard.name})" if shard else ""))
+            ACTIVE_BOTS.set(sum(1 for t in active_bots.values() if not t.done()))
+            try:
+                await asyncio.wait_for(channels_changed.wait(), 20)
+            except asyncio.TimeoutError:
+                pass
         except asyncio.CancelledError:
+            if eventsub_task:
+                eventsub_task.cancel()
             raise
         except Exception as e:
             logging.error(f"Ошибка менеджера Twitch-ботов: {e}")
             await asyncio.sleep(5)
 
 
-async def main():
-    with open("config.yaml", "r") as f:
-        config = yaml.safe_load(f)
+async def main(config: dict, shard: Shard | None = None, twitch: bool = True, telegram: bool = True):
+    # Single process: everything. Under the supervisor a worker runs the Twitch bots of its
+    # shard, the Telegram process runs Telegram and the once-per-install loops.
+    profiler = query_profiler.install(config)
+    if metrics_settings(config)["enabled"]:
+        instrument_database(Database)
+        instrument_commits()
+        instrument_telegram(telegram_bot.init_bot())
+
+    # The Telegram process is the hub of the IPC bus, workers connect to it
+    bus = make_bus(config, shard.name if shard else "main", hub=telegram)
+    tasks = []
+    if bus is not None:
+        tasks.append(bus.run())
+    if twitch:
+        tasks.append(manage_twitch_bots(config, shard, bus))
+    if telegram:
+        if bus is not None:
+            telegram_bot.attach_bus(bus)
+        tasks.append(start_telegram_bot())
+        if backup_settings(config)["enabled"]:
+            tasks.append(backup_loop(config))
+        if retention_settings(config)["enabled"]:
+            tasks.append(retention_loop(config))
+    if metrics_settings(config)["enabled"]:
+        tasks.append(serve_metrics(config))
+    if profiler:
+        tasks.append(query_profiler.profiler_loop(config))
+    monitor = LoopMonitor.from_config(config)
+    if monitor:
+        tasks.append(monitor.run())
 
     try:
-        await asyncio.gather(
-            manage_twitch_bots(config),
-            start_telegram_bot(),
-        )
+        await asyncio.gather(*tasks)
     except KeyboardInterrupt:
         logging.info("Stopping bots...")
     except Exception as e:
         logging.error(f"Error in main loop: {e}")
 
 if __name__ == "__main__":
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    # Logging goes through a queue to a writer thread, so the event loop never waits on disk
+    logs = setup_logging(config)
     try:
-        asyncio.run(main())
+        if supervisor_settings(config)["workers"] > 0:
+            run_supervisor(config)
+        else:
+            asyncio.run(main(config))
     except KeyboardInterrupt:
         logging.info("Bot stopped by user.")
+    finally:
+        logs.stop()
@@ -0,0 +1,338 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import math
+import time
+
+import aiosqlite
+from aiogram.exceptions import TelegramRetryAfter
+from aiohttp import web
+
+
+logger = logging.getLogger("Metrics")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def metrics_settings(config: dict) -> dict:
+    raw = config.get("metrics") or {}
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "host": raw.get("host") or "127.0.0.1",
+        "port": int(raw.get("port", 9108)),
+    }
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# Children hold the numbers. Hot paths resolve a child once (labels(...)) and keep it,
+# so recording an event is an attribute update with no allocation or dict lookup.
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.value -= amount
+
+
+class HistogramChild:
+    __slots__ = ("upper", "counts", "sum", "count")
+
+    def __init__(self, upper: tuple[float, ...]):
+        self.upper = upper
+        self.counts = [0] * (len(upper) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.upper, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    kind = ""
+    child_class = CounterChild
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _default(self):
+        return self.labels()
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: tuple, child) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+    child_class = CounterChild
+
+    def inc(self, amount: float = 1) -> None:
+        self._default().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+    child_class = GaugeChild
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), registry=None):
+        super().__init__(name, documentation, labelnames, registry)
+        self._function = None
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def set_function(self, function) -> None:
+        # Evaluated at scrape time, for values that are cheap to read but costly to track
+        self._function = function
+
+    def collect(self) -> list[str]:
+        if self._function is not None:
+            try:
+                self._default().set(self._function())
+            except Exception as e:
+                logger.warning(f"Не удалось получить значение {self.name}: {e}")
+        return super().collect()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        registry=None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, values: tuple, child: HistogramChild) -> list[str]:
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets + (math.inf,), child.counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, values, f'le="{_format_value(upper)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+CHAT_MESSAGES = Counter("drops_chat_messages_total", "Chat messages handled by TwitchBot.event_message", ("channel",))
+DRAWS = Counter("drops_draws_total", "Draws created", ("channel", "kind"))
+CLAIMS = Counter("drops_claims_total", "Pending draws claimed by chatting", ("channel",))
+EXPIRED = Counter("drops_expired_total", "Pending draws expired", ("channel",))
+ACTIVE_BOTS = Gauge("drops_active_bots", "Running TwitchBot instances")
+ASYNCIO_TASKS = Gauge("drops_asyncio_tasks", "asyncio tasks alive in the event loop")
+DB_QUERY_SECONDS = Histogram("drops_db_query_seconds", "Database method latency", ("method",))
+DB_QUERY_ERRORS = Counter("drops_db_query_errors_total", "Database methods that raised", ("method",))
+DB_COMMITS = Counter("drops_db_commits_total", "SQLite commits made through aiosqlite")
+HELIX_REQUEST_SECONDS = Histogram("drops_helix_request_seconds", "Helix HTTP request latency", ("endpoint",))
+HELIX_RESPONSES = Counter("drops_helix_responses_total", "Helix HTTP responses", ("endpoint", "status"))
+HELIX_RETRIES = Counter("drops_helix_retries_total", "Helix request retries", ("endpoint",))
+HELIX_QUEUE_SECONDS = Histogram("drops_helix_queue_seconds", "Time Helix requests waited for the rate-limit scheduler", ("priority",))
+HELIX_RATELIMIT_POINTS = Gauge("drops_helix_ratelimit_points", "Helix bucket points left at the last response", ("bucket",))
+HELIX_BREAKER_STATE = Gauge("drops_helix_breaker_state", "Helix circuit breaker: 0 closed, 1 half-open, 2 open", ("endpoint",))
+EVENTSUB_MESSAGES = Counter("drops_eventsub_messages_total", "EventSub WebSocket messages", ("type",))
+EVENTSUB_RECONNECTS = Counter("drops_eventsub_reconnects_total", "EventSub sessions ended or migrated", ("reason",))
+EVENTSUB_CHANNELS = Gauge("drops_eventsub_channels", "Channels whose online state comes from EventSub")
+HELIX_FALLBACKS = Counter("drops_helix_fallbacks_total", "Helix calls answered with the last known value", ("endpoint",))
+TELEGRAM_REQUESTS = Counter("drops_telegram_requests_total", "Bot API calls", ("method",))
+TELEGRAM_ERRORS = Counter("drops_telegram_errors_total", "Bot API calls that failed", ("method",))
+TELEGRAM_FLOOD_WAITS = Counter("drops_telegram_flood_waits_total", "Bot API calls answered with 429", ("method",))
+TELEGRAM_FLOOD_WAIT_SECONDS = Counter("drops_telegram_flood_wait_seconds_total", "Sum of retry_after from 429 answers")
+TELEGRAM_EDITS_SKIPPED = Counter("drops_telegram_edits_skipped_total", "editMessageText calls that changed nothing: answered from the cache or by Telegram", ("reason",))
+LOOP_LAG_SECONDS = Histogram(
+    "drops_loop_lag_seconds",
+    "How late the loop monitor woke up",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+LOOP_STALLS = Counter("drops_loop_stalls_total", "Event loop stalls over the threshold, by handler or loop", ("where",))
+LOOP_STALL_SECONDS = Counter("drops_loop_stall_seconds_total", "Total time the event loop was stalled")
+LOG_RECORDS_DROPPED = Counter("drops_log_dropped_total", "Log records not written: sampled or queue full", ("reason",))
+IPC_FRAMES = Counter("drops_ipc_frames_total", "IPC bus frames", ("op", "direction"))
+IPC_DROPPED = Counter("drops_ipc_dropped_total", "IPC frames not sent", ("reason",))
+IPC_PEERS = Gauge("drops_ipc_peers", "Processes connected to the IPC hub")
+IPC_REQUEST_SECONDS = Histogram(
+    "drops_ipc_request_seconds",
+    "IPC request round trip, by topic prefix",
+    ("topic",),
+    buckets=(0.0001, 0.00025, 0.0005, 0.001) + LATENCY_BUCKETS[1:],
+)
+STATE_ENTRIES = Gauge("drops_state_entries", "Telegram conversation states held in memory", ("store",))
+STATE_EVICTIONS = Counter("drops_state_evictions_total", "Telegram conversation states dropped before the flow ended", ("store", "reason"))
+TELEGRAM_STAGE_SECONDS = Histogram("drops_telegram_stage_seconds", "Private text handling time by flow and stage", ("flow", "stage"))
+TELEGRAM_STAGE_ERRORS = Counter("drops_telegram_stage_errors_total", "Private texts rejected by a stage parser or failed in its handler", ("flow", "stage", "reason"))
+
+ASYNCIO_TASKS.set_function(lambda: len(asyncio.all_tasks()))
+
+
+def instrument_database(cls) -> None:
+    # Wraps every public coroutine method of Database with a latency histogram. Called once
+    # at startup when metrics are enabled, so the bot pays nothing when they are not.
+    if getattr(cls, "_metrics_instrumented", False):
+        return
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _timed(func, DB_QUERY_SECONDS.labels(name), DB_QUERY_ERRORS.labels(name)))
+    cls._metrics_instrumented = True
+
+
+def _timed(func, histogram: HistogramChild, errors: CounterChild):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_commits() -> None:
+    if getattr(aiosqlite.Connection.commit, "_metrics_instrumented", False):
+        return
+    original = aiosqlite.Connection.commit
+    commits = DB_COMMITS.labels()
+
+    @functools.wraps(original)
+    async def commit(self):
+        commits.inc()
+        return await original(self)
+
+    commit._metrics_instrumented = True
+    aiosqlite.Connection.commit = commit
+
+
+class TelegramMetricsMiddleware:
+    # aiogram request middleware: counts Bot API calls, failures and flood waits per method
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        TELEGRAM_REQUESTS.labels(name).inc()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            TELEGRAM_FLOOD_WAITS.labels(name).inc()
+            TELEGRAM_FLOOD_WAIT_SECONDS.inc(e.retry_after)
+            raise
+        except Exception:
+            TELEGRAM_ERRORS.labels(name).inc()
+            raise
+
+
+def instrument_telegram(bot) -> None:
+    bot.session.middleware(TelegramMetricsMiddleware())
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def serve_metrics(config: dict):
+    settings = metrics_settings(config)
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, settings["host"], settings["port"])
+    await site.start()
+    logger.info(f"Метрики доступны на http://{settings['host']}:{settings['port']}/metrics")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
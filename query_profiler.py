@@ -0,0 +1,347 @@
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+import yaml
+
+from db import Database
+
+
+logger = logging.getLogger("QueryProfiler")
+
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def profiler_settings(config: dict) -> dict:
+    raw = config.get("query_profiler") or {}
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "slow_ms": float(raw.get("slow_ms", 50)),
+        "top_n": int(raw.get("top_n", 20)),
+        "max_shapes": int(raw.get("max_shapes", 500)),
+        "window_minutes": float(raw.get("window_minutes", 60)),
+        "report_path": raw.get("report_path") or "slow_queries.json",
+        "dump_seconds": float(raw.get("dump_seconds", 60)),
+    }
+
+
+def normalize_sql(sql: str) -> str:
+    # Query shape: literals and IN-lists collapsed so "id IN (?,?,?)" and "id IN (?,?)" group together
+    shape = _STRING_RE.sub("?", sql)
+    shape = _NUMBER_RE.sub("?", shape)
+    shape = _IN_LIST_RE.sub("(?...)", shape)
+    return _SPACE_RE.sub(" ", shape).strip()
+
+
+def explain(conn: sqlite3.Connection, sql: str, parameters=()) -> list[str]:
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return []
+    try:
+        # A plain Cursor, so the EXPLAIN itself is not traced
+        rows = sqlite3.Cursor(conn).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f"EXPLAIN failed: {e}"]
+    depth = {0: -1}
+    lines = []
+    for row in rows:
+        node, parent, detail = row[0], row[1], row[-1]
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node] + str(detail))
+    return lines
+
+
+class ShapeStats:
+    __slots__ = ("calls", "total", "max", "slow", "plan")
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.plan: list[str] | None = None
+
+    def merge(self, other: "ShapeStats") -> None:
+        self.calls += other.calls
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.slow += other.slow
+        self.plan = self.plan or other.plan
+
+
+class QueryProfiler:
+    # Collects statement timings from every traced connection (aiosqlite runs each one in
+    # its own thread). Stats live in two windows, current and previous, so the top-N always
+    # covers the last window_minutes..2*window_minutes and old shapes age out.
+    def __init__(
+        self,
+        slow_ms: float = 50,
+        max_shapes: int = 500,
+        window_minutes: float = 60,
+        recent_slow: int = 100,
+    ):
+        self.slow_seconds = float(slow_ms) / 1000
+        self.max_shapes = int(max_shapes)
+        self.window_seconds = float(window_minutes) * 60
+        self.recent_slow: deque[dict] = deque(maxlen=recent_slow)
+        self.statements = 0
+        self._lock = threading.Lock()
+        self._current: dict[str, ShapeStats] = {}
+        self._previous: dict[str, ShapeStats] = {}
+        self._window_started = time.monotonic()
+        self._started_at = datetime.datetime.now()
+
+    def _stats(self, shape: str) -> ShapeStats:
+        now = time.monotonic()
+        if now - self._window_started >= self.window_seconds:
+            self._previous, self._current = self._current, {}
+            self._window_started = now
+        stats = self._current.get(shape)
+        if stats is None:
+            if len(self._current) >= self.max_shapes:
+                cheapest = min(self._current, key=lambda k: self._current[k].total)
+                del self._current[cheapest]
+            stats = self._current[shape] = ShapeStats()
+            previous = self._previous.get(shape)
+            if previous is not None:
+                stats.plan = previous.plan
+        return stats
+
+    def record(self, conn: sqlite3.Connection, sql: str, parameters, elapsed: float) -> str:
+        shape = normalize_sql(sql)
+        slow = elapsed >= self.slow_seconds
+        with self._lock:
+            self.statements += 1
+            stats = self._stats(shape)
+            stats.calls += 1
+            stats.total += elapsed
+            stats.max = max(stats.max, elapsed)
+            need_plan = slow and stats.plan is None
+            if slow:
+                stats.slow += 1
+        if slow:
+            # EXPLAIN once per shape and window; later slow runs of the same shape reuse the plan
+            plan = explain(conn, sql, parameters) if need_plan else stats.plan
+            if need_plan:
+                stats.plan = plan
+            entry = {
+                "at": datetime.datetime.now().isoformat(timespec="seconds"),
+                "ms": round(elapsed * 1000, 2),
+                "sql": shape,
+                "plan": plan or [],
+            }
+            self.recent_slow.append(entry)
+            plan_text = "; ".join(p.strip() for p in plan or []) or "-"
+            logger.warning(f"Медленный запрос {entry['ms']:.1f} мс: {shape[:300]} | план: {plan_text}")
+        return shape
+
+    def add_fetch(self, shape: str, elapsed: float) -> None:
+        # Row fetching after execute() belongs to the same shape's total time
+        with self._lock:
+            stats = self._current.get(shape)
+            if stats is not None:
+                stats.total += elapsed
+
+    def top(self, n: int = 20, by: str = "total") -> list[dict]:
+        with self._lock:
+            merged: dict[str, ShapeStats] = {}
+            for window in (self._previous, self._current):
+                for shape, stats in window.items():
+                    merged.setdefault(shape, ShapeStats()).merge(stats)
+        rows = [
+            {
+                "sql": shape,
+                "calls": s.calls,
+                "total_ms": round(s.total * 1000, 2),
+                "avg_ms": round(s.total * 1000 / s.calls, 3) if s.calls else 0.0,
+                "max_ms": round(s.max * 1000, 2),
+                "slow": s.slow,
+                "plan": s.plan or [],
+            }
+            for shape, s in merged.items()
+        ]
+        key = {"total": "total_ms", "max": "max_ms", "calls": "calls", "avg": "avg_ms"}.get(by, "total_ms")
+        rows.sort(key=lambda r: r[key], reverse=True)
+        return rows[:n]
+
+    def snapshot(self, n: int = 20) -> dict:
+        return {
+            "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "since": self._started_at.isoformat(timespec="seconds"),
+            "slow_ms": self.slow_seconds * 1000,
+            "statements": self.statements,
+            "top": self.top(n),
+            "recent_slow": list(self.recent_slow),
+        }
+
+    def dump(self, path: str, n: int = 20) -> None:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(n), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def profiling_factory(profiler: QueryProfiler) -> type[sqlite3.Connection]:
+    # Connection class for Database connections: aiosqlite's db.execute() and db.cursor()
+    # both end up in TracingCursor, which times execute() and the fetches that follow it.
+    class TracingCursor(sqlite3.Cursor):
+        _shape: str | None = None
+
+        def execute(self, sql, parameters=()):
+            started = time.perf_counter()
+            try:
+                return super().execute(sql, parameters)
+            finally:
+                self._shape = profiler.record(self.connection, sql, parameters, time.perf_counter() - started)
+
+        def executemany(self, sql, seq_of_parameters):
+            started = time.perf_counter()
+            try:
+                return super().executemany(sql, seq_of_parameters)
+            finally:
+                self._shape = profiler.record(self.connection, sql, (), time.perf_counter() - started)
+
+        def fetchone(self):
+            started = time.perf_counter()
+            try:
+                return super().fetchone()
+            finally:
+                if self._shape:
+                    profiler.add_fetch(self._shape, time.perf_counter() - started)
+
+        def fetchmany(self, size=None):
+            started = time.perf_counter()
+            try:
+                return super().fetchmany(self.arraysize if size is None else size)
+            finally:
+                if self._shape:
+                    profiler.add_fetch(self._shape, time.perf_counter() - started)
+
+        def fetchall(self):
+            started = time.perf_counter()
+            try:
+                return super().fetchall()
+            finally:
+                if self._shape:
+                    profiler.add_fetch(self._shape, time.perf_counter() - started)
+
+    class TracingConnection(sqlite3.Connection):
+        def cursor(self, factory=TracingCursor):
+            return super().cursor(factory)
+
+        def execute(self, sql, parameters=()):
+            return self.cursor().execute(sql, parameters)
+
+        def executemany(self, sql, seq_of_parameters):
+            return self.cursor().executemany(sql, seq_of_parameters)
+
+    return TracingConnection
+
+
+_profiler: QueryProfiler | None = None
+
+
+def current() -> QueryProfiler | None:
+    return _profiler
+
+
+def install(config: dict) -> QueryProfiler | None:
+    # Traces every Database connection that has no factory of its own
+    global _profiler
+    settings = profiler_settings(config)
+    if not settings["enabled"]:
+        return None
+    _profiler = QueryProfiler(
+        slow_ms=settings["slow_ms"],
+        max_shapes=settings["max_shapes"],
+        window_minutes=settings["window_minutes"],
+    )
+    Database.default_connection_factory = profiling_factory(_profiler)
+    logger.info(f"Профилирование запросов включено, порог {settings['slow_ms']:.0f} мс")
+    return _profiler
+
+
+async def profiler_loop(config: dict):
+    settings = profiler_settings(config)
+    while True:
+        try:
+            await asyncio.sleep(max(5.0, settings["dump_seconds"]))
+            if _profiler is not None:
+                await asyncio.to_thread(_profiler.dump, settings["report_path"], settings["top_n"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Не удалось сохранить отчёт о запросах: {e}")
+
+
+def format_top(rows: list[dict], with_plan: bool = True, sql_width: int = 160) -> str:
+    lines = []
+    for i, row in enumerate(rows, start=1):
+        sql = row["sql"] if len(row["sql"]) <= sql_width else row["sql"][: sql_width - 1] + "…"
+        lines.append(
+            f"{i}. {row['total_ms']:.0f} мс всего, {row['calls']} вызовов, "
+            f"ср. {row['avg_ms']:.2f} мс, макс. {row['max_ms']:.1f} мс, медленных {row['slow']}"
+        )
+        lines.append(f"   {sql}")
+        if with_plan and row.get("plan"):
+            lines.extend(f"   └ {p}" for p in row["plan"])
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Slow-query report for db.Database")
+    subparsers = parser.add_subparsers(dest="command", help="Command to execute")
+
+    parser_report = subparsers.add_parser("report", help="Show the report the bot dumps periodically")
+    parser_report.add_argument("--file", default=None, help="Report file (default from config.yaml)")
+    parser_report.add_argument("--top", type=int, default=20, help="Number of query shapes")
+    parser_report.add_argument("--by", default="total", choices=("total", "max", "calls", "avg"), help="Sort key")
+
+    parser_explain = subparsers.add_parser("explain", help="EXPLAIN QUERY PLAN for a statement")
+    parser_explain.add_argument("sql", help="SQL statement; ? placeholders are bound to NULL")
+    parser_explain.add_argument("--db", default=None, help="Database file (default from config.yaml)")
+
+    args = parser.parse_args()
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    if args.command == "report":
+        path = args.file or profiler_settings(config)["report_path"]
+        if not os.path.exists(path):
+            print(f"Отчёт {path} не найден: включите query_profiler в config.yaml и дождитесь выгрузки")
+            raise SystemExit(1)
+        with open(path, "r", encoding="utf-8") as f:
+            report = json.load(f)
+        key = {"total": "total_ms", "max": "max_ms", "calls": "calls", "avg": "avg_ms"}[args.by]
+        rows = sorted(report["top"], key=lambda r: r[key], reverse=True)[: args.top]
+        print(f"Отчёт от {report['generated_at']} (с {report['since']}), запросов {report['statements']}, порог {report['slow_ms']:.0f} мс")
+        print(format_top(rows, sql_width=400))
+        if report["recent_slow"]:
+            print("\nПоследние медленные:")
+            for entry in report["recent_slow"][-20:]:
+                print(f"  {entry['at']}  {entry['ms']:.1f} мс  {entry['sql'][:200]}")
+    elif args.command == "explain":
+        conn = sqlite3.connect(args.db or config["database"]["db_path"])
+        try:
+            params = (None,) * args.sql.count("?")
+            for line in explain(conn, args.sql, params) or ["(не SELECT/INSERT/UPDATE/DELETE)"]:
+                print(line)
+        finally:
+            conn.close()
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import yaml
+
+from bench_chat import CommitCounter, FakeAuthor, FakeMessage, db_size, make_bot, stub_telegram
+from chat_recorder import read_segments
+
+
+class ReplayClock:
+    # Maps recorded timestamps onto the wall clock: at speed N, a gap of t seconds in the
+    # recording becomes t / N seconds of replay. speed 0 replays as fast as possible.
+    def __init__(self, first_ts: float, speed: float):
+        self.first_ts = first_ts
+        self.speed = float(speed)
+        self.started = time.perf_counter()
+
+    def due(self, ts: float) -> float:
+        if self.speed <= 0:
+            return time.perf_counter()
+        return self.started + (ts - self.first_ts) / self.speed
+
+    async def wait_until(self, ts: float) -> float:
+        due = self.due(ts)
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return due
+
+
+def make_author(data: dict | None) -> FakeAuthor | None:
+    if not data or not data.get("name"):
+        return None
+    author = FakeAuthor(data["name"], bool(data.get("is_broadcaster")))
+    author.display_name = data.get("display_name") or author.name
+    author.id = str(data.get("id") or author.id)
+    author.is_mod = bool(data.get("is_mod", author.is_mod))
+    author.is_subscriber = bool(data.get("is_subscriber", False))
+    author.is_vip = bool(data.get("is_vip", False))
+    return author
+
+
+def prepare_db(source: str | None, dest: str) -> None:
+    if not source:
+        return
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(dest)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+async def run_replay(config: dict, records: list[dict], db_path: str, speed: float, online: bool, seed_value: int) -> dict:
+    random.seed(seed_value)
+    # A replayed bot must not record the replay itself
+    config = dict(config, recording={"enabled": False})
+    channels = sorted({r["channel"] for r in records})
+    bots = {}
+    for channel in channels:
+        bots[channel] = await make_bot(config, db_path, channel, online)
+    telegram = stub_telegram()
+    size_before = db_size(db_path)
+
+    latencies: list[float] = []
+    errors: dict[str, int] = {}
+    by_channel: dict[str, int] = {}
+    in_flight = 0
+    max_in_flight = 0
+
+    async def handle(twitch_bot, msg: FakeMessage, due: float):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            await twitch_bot.event_message(msg)
+        except Exception as e:
+            reason = f"{type(e).__name__}: {e}"[:80]
+            errors[reason] = errors.get(reason, 0) + 1
+        finally:
+            in_flight -= 1
+            latencies.append(time.perf_counter() - due)
+
+    tasks: list[asyncio.Task] = []
+    with CommitCounter() as commits:
+        clock = ReplayClock(records[0]["ts"], speed)
+        for i, record in enumerate(records):
+            due = await clock.wait_until(record["ts"])
+            twitch_bot, fake_channel = bots[record["channel"]]
+            author = make_author(record.get("author"))
+            msg = FakeMessage(record.get("content", ""), author, fake_channel)
+            msg.tags = record.get("tags") or {}
+            msg.timestamp = datetime.datetime.fromtimestamp(record["ts"])
+            by_channel[record["channel"]] = by_channel.get(record["channel"], 0) + 1
+            tasks.append(asyncio.create_task(handle(twitch_bot, msg, due)))
+            if speed <= 0 and i % 100 == 99:
+                await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - clock.started
+        commit_count = commits.count
+
+    latencies.sort()
+
+    def pct(p: float) -> float:
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "messages": len(records),
+        "recorded_seconds": records[-1]["ts"] - records[0]["ts"],
+        "elapsed": elapsed,
+        "msgs_per_s": len(records) / elapsed if elapsed else 0.0,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+        "commits": commit_count,
+        "commits_per_msg": commit_count / len(records),
+        "db_growth": db_size(db_path) - size_before,
+        "max_in_flight": max_in_flight,
+        "errors": errors,
+        "by_channel": by_channel,
+        "chat_replies": sum(ch.sent for _, ch in bots.values()),
+        "telegram_sent": telegram["count"],
+    }
+
+
+def compare(old_path: str, new_path: str, threshold: float) -> int:
+    with open(old_path, "r") as f:
+        old = json.load(f)["result"]
+    with open(new_path, "r") as f:
+        new = json.load(f)["result"]
+
+    regressions = 0
+    for key, label, worse_if_higher in (
+        ("p50_ms", "p50, ms", True),
+        ("p95_ms", "p95, ms", True),
+        ("p99_ms", "p99, ms", True),
+        ("msgs_per_s", "msg/s", False),
+        ("commits_per_msg", "commits/msg", True),
+        ("db_growth", "DB growth, bytes", True),
+    ):
+        prev, cur = old.get(key, 0), new.get(key, 0)
+        change = (cur / prev - 1) if prev else 0.0
+        bad = change > threshold if worse_if_higher else change < -threshold
+        print(f"{label:<18} {prev:>12.2f} -> {cur:>12.2f} ({change * 100:+6.1f}%)  {'REGRESSION' if bad else 'ok'}")
+        regressions += bad
+    errors_old, errors_new = sum(old.get("errors", {}).values()), sum(new.get("errors", {}).values())
+    print(f"{'errors':<18} {errors_old:>12} -> {errors_new:>12}")
+    regressions += errors_new > errors_old
+    print(f"Regressions: {regressions}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded Twitch chat through TwitchBot.event_message")
+    subparsers = parser.add_subparsers(dest="command", help="Command to execute")
+
+    parser_run = subparsers.add_parser("run", help="Replay a recording")
+    parser_run.add_argument("paths", nargs="+", help="Segment files or recording directories")
+    parser_run.add_argument("--speed", type=float, default=1.0, help="Replay speed: 1 = real time, 10 = 10x, 0 = max")
+    parser_run.add_argument("--channel", default=None, help="Replay only this channel")
+    parser_run.add_argument("--limit", type=int, default=0, help="Replay at most this many messages")
+    parser_run.add_argument("--db", default=None, help="Start from a copy of this database (default: empty)")
+    parser_run.add_argument("--offline", action="store_true", help="Treat the stream as offline")
+    parser_run.add_argument("--seed", type=int, default=1, help="Random seed for draws and games")
+    parser_run.add_argument("--json", default=None, help="Write results to this JSON file")
+
+    parser_compare = subparsers.add_parser("compare", help="Compare two JSON result files")
+    parser_compare.add_argument("old", help="Baseline results")
+    parser_compare.add_argument("new", help="New results")
+    parser_compare.add_argument("--threshold", type=float, default=0.2, help="Relative change treated as regression")
+
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        if compare(args.old, args.new, args.threshold):
+            raise SystemExit(1)
+        return
+    if args.command != "run":
+        parser.print_help()
+        return
+
+    records = read_segments(args.paths)
+    if args.channel:
+        records = [r for r in records if r.get("channel") == args.channel.lower()]
+    if args.limit:
+        records = records[: args.limit]
+    if not records:
+        print("Нет сообщений для воспроизведения")
+        raise SystemExit(1)
+
+    with open("config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Replays never write to the source database
+        db_path = os.path.join(tmp_dir, "replay.db")
+        prepare_db(args.db, db_path)
+        res = asyncio.run(run_replay(config, records, db_path, args.speed, not args.offline, args.seed))
+
+    speed = f"{args.speed:g}x" if args.speed > 0 else "max"
+    print(f"Messages: {res['messages']} over {res['recorded_seconds']:.0f}s recorded, channels: {res['by_channel']}, speed: {speed}")
+    print(f"Elapsed: {res['elapsed']:.3f}s ({res['msgs_per_s']:.0f} msg/s)")
+    print(f"Latency p50/p95/p99/max: {res['p50_ms']:.1f} / {res['p95_ms']:.1f} / {res['p99_ms']:.1f} / {res['max_ms']:.1f} ms")
+    print(f"Commits: {res['commits']} ({res['commits_per_msg']:.2f}/msg), DB growth: {res['db_growth'] / 1024:.1f} KiB")
+    print(f"Max in flight: {res['max_in_flight']}, errors: {sum(res['errors'].values())}")
+    for reason, count in sorted(res["errors"].items(), key=lambda kv: -kv[1]):
+        print(f"  {count:>6}  {reason}")
+    print(f"Chat replies: {res['chat_replies']}, Telegram notifications: {res['telegram_sent']}")
+
+    if args.json:
+        report = {
+            "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "paths": args.paths,
+            "speed": args.speed,
+            "seed": args.seed,
+            "result": res,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import sqlite3
+import time
+
+import yaml
+
+from db import RETENTION_TOTALS_SQL
+
+
+logger = logging.getLogger("Retention")
+
+# Per-table policies. `where` selects rows that may leave the live database (cutoff is
+# bound as :cutoff), `key` is what makes archived rows unique so a retried batch never
+# duplicates them, `archive` decides whether rows are copied to the archive database or
+# simply dropped.
+POLICIES: dict[str, dict] = {
+    "active_users": {
+        "days": 30,
+        "archive": False,
+        "key": ("id",),
+        "where": "last_active_at < :cutoff",
+    },
+    "stream_watch_time": {
+        "days": 90,
+        "archive": False,
+        "key": ("session_id", "nickname"),
+        "where": (
+            "session_id IN (SELECT id FROM main.stream_sessions "
+            "WHERE ended_at IS NOT NULL AND ended_at < :cutoff)"
+        ),
+        "aggregate": "stream_session_summaries",
+    },
+    "draws": {
+        "days": 60,
+        "archive": True,
+        "key": ("id",),
+        "where": "status = 'expired' AND created_at < :cutoff",
+    },
+    "giveaway_triggers": {
+        "days": 30,
+        "archive": True,
+        "key": ("id",),
+        "where": "processed_at IS NOT NULL AND processed_at < :cutoff",
+    },
+    "gold_check_activations": {
+        "days": 90,
+        "archive": True,
+        "key": ("id",),
+        "where": (
+            "activated_at < :cutoff AND check_id IN "
+            "(SELECT id FROM main.gold_checks WHERE status <> 'active')"
+        ),
+    },
+}
+
+
+def retention_settings(config: dict) -> dict:
+    raw = config.get("retention") or {}
+    tables = {}
+    overrides = raw.get("tables") or {}
+    for table, policy in POLICIES.items():
+        merged = dict(policy)
+        override = overrides.get(table)
+        if isinstance(override, dict):
+            merged.update({k: v for k, v in override.items() if k in ("days", "archive")})
+        elif override is not None:
+            merged["days"] = override
+        tables[table] = merged
+    return {
+        "enabled": bool(raw.get("enabled", False)),
+        "archive_path": raw.get("archive_path") or "archive.db",
+        "interval_hours": float(raw.get("interval_hours", 6)),
+        "batch_size": int(raw.get("batch_size", 500)),
+        "max_lock_ms": float(raw.get("max_lock_ms", 5)),
+        "batch_sleep_ms": float(raw.get("batch_sleep_ms", 20)),
+        "tables": tables,
+    }
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> list[str]:
+    return [r[1] for r in conn.execute(f'PRAGMA {schema}.table_info("{table}")')]
+
+
+def _ensure_archive_table(conn: sqlite3.Connection, table: str, key: tuple[str, ...]) -> list[str]:
+    live = _columns(conn, "main", table)
+    archived = _columns(conn, "archive", table)
+    if not archived:
+        conn.execute(f'CREATE TABLE archive."{table}" AS SELECT * FROM main."{table}" WHERE 0')
+        conn.execute(f'ALTER TABLE archive."{table}" ADD COLUMN archived_at DATETIME')
+        cols = ", ".join(f'"{c}"' for c in key)
+        conn.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS archive."ux_{table}_key" ON "{table}" ({cols})')
+    else:
+        # Live table gained columns through migrations since the archive was created
+        for col in live:
+            if col not in archived:
+                conn.execute(f'ALTER TABLE archive."{table}" ADD COLUMN "{col}"')
+    return live
+
+
+def _ensure_summaries(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS archive.stream_session_summaries (
+            session_id INTEGER PRIMARY KEY,
+            channel TEXT,
+            started_at DATETIME,
+            ended_at DATETIME,
+            viewers INTEGER,
+            total_seconds INTEGER,
+            max_seconds INTEGER,
+            archived_at DATETIME
+        )
+        """
+    )
+
+
+def _aggregate_stream_sessions(
+    conn: sqlite3.Connection,
+    cutoff: str,
+    now: str,
+    stats: dict,
+    batch_size: int = 500,
+    max_lock_ms: float = 5,
+    batch_sleep_ms: float = 20,
+) -> int:
+    # One summary row per finished session, written before its per-viewer rows go away.
+    # Sessions nobody watched get one too (viewers 0), so they are not scanned again.
+    # INSERT OR IGNORE keeps the first (complete) summary if a run was interrupted midway.
+    # Sessions go in id order, in chunks sized like purge_table's batches.
+    _ensure_summaries(conn)
+    batch = max(1, int(batch_size))
+    limit = batch
+    after = 0
+    aggregated = 0
+    while True:
+        ids = [
+            r[0]
+            for r in conn.execute(
+                """
+                SELECT id FROM main.stream_sessions
+                WHERE ended_at IS NOT NULL AND ended_at < :cutoff AND id > :after
+                  AND id NOT IN (SELECT session_id FROM archive.stream_session_summaries)
+                ORDER BY id LIMIT :limit
+                """,
+                {"cutoff": cutoff, "after": after, "limit": limit},
+            )
+        ]
+        if not ids:
+            break
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                """
+                INSERT OR IGNORE INTO archive.stream_session_summaries
+                    (session_id, channel, started_at, ended_at, viewers, total_seconds, max_seconds, archived_at)
+                SELECT s.id, s.channel, s.started_at, s.ended_at,
+                       COUNT(w.nickname), COALESCE(SUM(w.seconds), 0), COALESCE(MAX(w.seconds), 0), :now
+                FROM main.stream_sessions s
+                LEFT JOIN main.stream_watch_time w ON w.session_id = s.id
+                WHERE s.id BETWEEN :first AND :last AND s.ended_at IS NOT NULL AND s.ended_at < :cutoff
+                GROUP BY s.id
+                """,
+                {"cutoff": cutoff, "now": now, "first": ids[0], "last": ids[-1]},
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        held_ms = (time.perf_counter() - started) * 1000
+        aggregated += max(0, cur.rowcount)
+        stats["batches"] += 1
+        stats["max_lock_ms"] = max(stats["max_lock_ms"], held_ms)
+        after = ids[-1]
+
+        if len(ids) < limit:
+            break
+        if held_ms > max_lock_ms and limit > 10:
+            limit = max(10, limit // 2)
+        elif held_ms < max_lock_ms / 2 and limit < batch:
+            limit = min(batch, limit * 2)
+        if batch_sleep_ms:
+            time.sleep(batch_sleep_ms / 1000)
+    return aggregated
+
+
+def purge_table(
+    conn: sqlite3.Connection,
+    table: str,
+    policy: dict,
+    now: datetime.datetime,
+    batch_size: int = 500,
+    max_lock_ms: float = 5,
+    batch_sleep_ms: float = 20,
+    dry_run: bool = False,
+) -> dict:
+    cutoff = (now - datetime.timedelta(days=float(policy["days"]))).isoformat(sep=" ")
+    stamp = now.isoformat(sep=" ")
+    where = policy["where"]
+    stats = {"table": table, "cutoff": cutoff, "moved": 0, "deleted": 0, "batches": 0, "max_lock_ms": 0.0}
+
+    if dry_run:
+        stats["candidates"] = conn.execute(
+            f'SELECT COUNT(*) FROM main."{table}" WHERE {where}', {"cutoff": cutoff}
+        ).fetchone()[0]
+        return stats
+
+    if policy.get("aggregate") == "stream_session_summaries":
+        stats["aggregated"] = _aggregate_stream_sessions(
+            conn, cutoff, stamp, stats, batch_size, max_lock_ms, batch_sleep_ms
+        )
+
+    # Unqualified CREATE goes to main, not the attached archive
+    conn.execute(RETENTION_TOTALS_SQL)
+    cols = _ensure_archive_table(conn, table, policy["key"]) if policy["archive"] else []
+    col_list = ", ".join(f'"{c}"' for c in cols)
+    batch = max(1, int(batch_size))
+    limit = batch
+
+    while True:
+        # Candidate rowids are picked outside the write transaction; the lock is only held
+        # for the copy + delete of one small batch.
+        rowids = [
+            r[0]
+            for r in conn.execute(
+                f'SELECT rowid FROM main."{table}" WHERE {where} ORDER BY rowid LIMIT :limit',
+                {"cutoff": cutoff, "limit": limit},
+            )
+        ]
+        if not rowids:
+            break
+        # The policy condition is re-checked under the lock in case a row changed meanwhile
+        params = {"cutoff": cutoff, "now": stamp, **{f"r{i}": rid for i, rid in enumerate(rowids)}}
+        in_batch = f'rowid IN ({",".join(f":r{i}" for i in range(len(rowids)))}) AND {where}'
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if policy["archive"]:
+                conn.execute(
+                    f'INSERT OR IGNORE INTO archive."{table}" ({col_list}, archived_at) '
+                    f'SELECT {col_list}, :now FROM main."{table}" WHERE {in_batch}',
+                    params,
+                )
+            cur = conn.execute(f'DELETE FROM main."{table}" WHERE {in_batch}', params)
+            # Same transaction as the delete: totals (e.g. /stats draws) never lose rows
+            conn.execute(
+                """
+                INSERT INTO main.retention_totals (table_name, removed) VALUES (?, ?)
+                ON CONFLICT(table_name) DO UPDATE SET removed = removed + excluded.removed
+                """,
+                (table, cur.rowcount),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        held_ms = (time.perf_counter() - started) * 1000
+
+        stats["batches"] += 1
+        stats["deleted"] += cur.rowcount
+        if policy["archive"]:
+            stats["moved"] += cur.rowcount
+        stats["max_lock_ms"] = max(stats["max_lock_ms"], held_ms)
+
+        if len(rowids) < limit:
+            break
+        # Keep each write transaction under max_lock_ms on this machine
+        if held_ms > max_lock_ms and limit > 10:
+            limit = max(10, limit // 2)
+        elif held_ms < max_lock_ms / 2 and limit < batch:
+            limit = min(batch, limit * 2)
+        if batch_sleep_ms:
+            time.sleep(batch_sleep_ms / 1000)
+
+    return stats
+
+
+def run_retention(db_path: str, settings: dict, dry_run: bool = False, now: datetime.datetime | None = None) -> list[dict]:
+    now = now or datetime.datetime.now()
+    # isolation_level=None: transactions are managed explicitly per batch
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    results = []
+    try:
+        conn.execute("ATTACH DATABASE ? AS archive", (settings["archive_path"],))
+        for table, policy in settings["tables"].items():
+            if not policy.get("days"):
+                continue
+            if not _columns(conn, "main", table):
+                continue
+            stats = purge_table(
+                conn,
+                table,
+                policy,
+                now,
+                batch_size=settings["batch_size"],
+                max_lock_ms=settings["max_lock_ms"],
+                batch_sleep_ms=settings["batch_sleep_ms"],
+                dry_run=dry_run,
+            )
+            results.append(stats)
+            if stats["deleted"]:
+                logger.info(
+                    f"Retention {table}: удалено {stats['deleted']}, в архив {stats['moved']}, "
+                    f"пачек {stats['batches']}, max lock {stats['max_lock_ms']:.1f}мс"
+                )
+    finally:
+        conn.close()
+    return results
+
+
+async def retention_loop(config: dict):
+    settings = retention_settings(config)
+    db_path = config["database"]["db_path"]
+    interval = max(60.0, settings["interval_hours"] * 3600)
+    while True:
+        try:
+            await asyncio.to_thread(run_retention, db_path, settings)
+            await asyncio.sleep(interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка retention: {e}")
+            await asyncio.sleep(300)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old rows from the live database into the archive")
+    subparsers = parser.add_subparsers(dest="command", help="Command to execute")
+
+    parser_run = subparsers.add_parser("run", help="Apply retention policies now")
+    parser_run.add_argument("--dry-run", action="store_true", help="Only count rows that would be moved")
+
+    subparsers.add_parser("policies", help="Show effective policies")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    try:
+        with open("config.yaml", "r") as f:
+            config = yaml.safe_load(f) or {}
+    except FileNotFoundError:
+        config = {}
+    settings = retention_settings(config)
+    db_path = config.get("database", {}).get("db_path", "rewards.db")
+
+    if args.command == "run":
+        for stats in run_retention(db_path, settings, dry_run=args.dry_run):
+            if args.dry_run:
+                print(f"{stats['table']:<24} before {stats['cutoff'][:19]}  candidates={stats['candidates']}")
+            else:
+                print(
+                    f"{stats['table']:<24} deleted={stats['deleted']:<8} archived={stats['moved']:<8} "
+                    f"batches={stats['batches']:<5} max_lock={stats['max_lock_ms']:.1f}ms"
+                )
+    elif args.command == "policies":
+        print(f"Archive: {settings['archive_path']}")
+        for table, policy in settings["tables"].items():
+            mode = "archive" if policy["archive"] else "delete"
+            days = policy["days"] or "off"
+            print(f"{table:<24} days={days:<6} mode={mode}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
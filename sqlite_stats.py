@@ -0,0 +1,136 @@
+import ctypes
+import logging
+import os
+import sqlite3
+import sys
+import threading
+
+import _sqlite3
+
+
+logger = logging.getLogger("SqliteStats")
+
+# sqlite3_stmt_status() counters, see https://www.sqlite.org/c3ref/c_stmtstatus_counter.html
+STMT_STATUS = {
+    "fullscan_step": 1,
+    "sort": 2,
+    "autoindex": 3,
+    "vm_step": 4,
+}
+
+
+def _load_library():
+    # The stdlib module does not expose sqlite3_stmt_status(); call it through the same
+    # libsqlite3 the _sqlite3 extension is linked against.
+    try:
+        lib = ctypes.CDLL(_sqlite3.__file__)
+        lib.sqlite3_db_filename.restype = ctypes.c_char_p
+        lib.sqlite3_db_filename.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+        lib.sqlite3_next_stmt.restype = ctypes.c_void_p
+        lib.sqlite3_next_stmt.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+        lib.sqlite3_stmt_status.restype = ctypes.c_int
+        lib.sqlite3_stmt_status.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        return lib
+    except (OSError, AttributeError) as e:
+        logger.warning(f"sqlite3_stmt_status недоступен: {e}")
+        return None
+
+
+_lib = _load_library()
+
+# CPython versions whose pysqlite Connection struct starts with PyObject_HEAD followed by
+# the sqlite3* handle; other implementations and versions get no statement counters
+HANDLE_LAYOUT_VERSIONS = ((3, 8), (3, 13))
+
+
+def _handle_offset() -> int | None:
+    low, high = HANDLE_LAYOUT_VERSIONS
+    if sys.implementation.name != "cpython" or not low <= sys.version_info[:2] <= high:
+        logger.warning(
+            f"sqlite3_stmt_status: раскладка Connection не проверена для "
+            f"{sys.implementation.name} {sys.version_info[0]}.{sys.version_info[1]}, счётчики выключены"
+        )
+        return None
+    # sizeof(PyObject), also right for builds with a larger object header
+    return object.__basicsize__
+
+
+_offset = _handle_offset() if _lib is not None else None
+
+
+def connection_handle(conn: sqlite3.Connection, database: str) -> int | None:
+    # Reads the sqlite3* right after the object header. The pointer is only trusted if
+    # SQLite reports the same main database file behind it as the connection itself.
+    if _offset is None or database == ":memory:":
+        return None
+    try:
+        rows = conn.execute("PRAGMA database_list").fetchall()
+    except sqlite3.Error:
+        return None
+    expected = next((row[2] for row in rows if row[1] == "main"), "")
+    if not expected:
+        return None
+    try:
+        handle = ctypes.c_void_p.from_address(id(conn) + _offset).value
+        if not handle:
+            return None
+        filename = _lib.sqlite3_db_filename(handle, b"main")
+    except (OSError, ValueError):
+        return None
+    if not filename or os.path.realpath(filename.decode()) != os.path.realpath(expected):
+        return None
+    return handle
+
+
+def drain_stmt_status(handle: int) -> dict[str, int]:
+    # Sums and resets the counters of every prepared statement still alive on the connection
+    totals = dict.fromkeys(STMT_STATUS, 0)
+    stmt = _lib.sqlite3_next_stmt(handle, None)
+    while stmt:
+        for name, op in STMT_STATUS.items():
+            totals[name] += _lib.sqlite3_stmt_status(stmt, op, 1)
+        stmt = _lib.sqlite3_next_stmt(handle, stmt)
+    return totals
+
+
+class StmtStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.totals = dict.fromkeys(STMT_STATUS, 0)
+        self.connections = 0
+        self.untracked = 0
+
+    def add(self, counts: dict[str, int] | None) -> None:
+        with self._lock:
+            if counts is None:
+                self.untracked += 1
+                return
+            self.connections += 1
+            for name, value in counts.items():
+                self.totals[name] += value
+
+    def take(self) -> dict[str, int]:
+        with self._lock:
+            snapshot = dict(self.totals, connections=self.connections, untracked=self.untracked)
+            self.totals = dict.fromkeys(STMT_STATUS, 0)
+            self.connections = 0
+            self.untracked = 0
+            return snapshot
+
+
+def stmt_stats_factory(stats: StmtStats) -> type[sqlite3.Connection]:
+    # Connection class for Database(connection_factory=...): statement counters are
+    # collected right before each connection closes.
+    class StmtStatsConnection(sqlite3.Connection):
+        def __init__(self, database, *args, **kwargs):
+            super().__init__(database, *args, **kwargs)
+            self._stmt_handle = connection_handle(self, str(database))
+            self._stmt_collected = False
+
+        def close(self):
+            if not self._stmt_collected:
+                self._stmt_collected = True
+                stats.add(drain_stmt_status(self._stmt_handle) if self._stmt_handle else None)
+            super().close()
+
+    return StmtStatsConnection
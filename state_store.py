@@ -0,0 +1,178 @@
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+
+from metrics import STATE_ENTRIES, STATE_EVICTIONS
+
+
+logger = logging.getLogger("StateStore")
+
+
+def state_settings(config: dict) -> dict:
+    raw = config.get("telegram_state") or {}
+    return {
+        "path": raw.get("path", "telegram_state.db"),
+        "ttl_minutes": float(raw.get("ttl_minutes", 60)),
+        "max_entries": max(1, int(raw.get("max_entries", 10000))),
+        "sweep_seconds": float(raw.get("sweep_seconds", 60)),
+    }
+
+
+class StateBackend:
+    # One SQLite file for every store of the process, apart from the main database so these
+    # small writes never queue behind its write lock. In WAL mode with synchronous=NORMAL a
+    # write is a few tens of microseconds, cheap enough to do inline in a handler.
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS states (
+                store TEXT NOT NULL,
+                key INTEGER NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (store, key)
+            ) WITHOUT ROWID
+            """
+        )
+
+    def load(self, store: str, now: float) -> list[tuple[int, dict, float]]:
+        self.conn.execute("DELETE FROM states WHERE store = ? AND expires_at <= ?", (store, now))
+        rows = self.conn.execute(
+            "SELECT key, value, expires_at FROM states WHERE store = ? ORDER BY expires_at", (store,)
+        ).fetchall()
+        return [(key, json.loads(value), expires_at) for key, value, expires_at in rows]
+
+    def put(self, store: str, key: int, value: dict, expires_at: float) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO states (store, key, value, expires_at) VALUES (?, ?, ?, ?)",
+            (store, key, json.dumps(value, ensure_ascii=False), expires_at),
+        )
+
+    def delete(self, store: str, key: int) -> None:
+        self.conn.execute("DELETE FROM states WHERE store = ? AND key = ?", (store, key))
+
+    def delete_expired(self, store: str, now: float) -> None:
+        self.conn.execute("DELETE FROM states WHERE store = ? AND expires_at <= ?", (store, now))
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class StateStore:
+    # Per-user state of a multi-step Telegram flow, used like a dict. An entry expires `ttl`
+    # seconds after it was last written, the least recently used ones are dropped beyond
+    # max_entries, and with a backend attached every write goes through to SQLite so a flow
+    # survives a restart. Changing a returned dict in place is not persisted: assign it back.
+    def __init__(self, name: str, ttl: float = 3600, max_entries: int = 10000, sweep_seconds: float = 60):
+        self.name = name
+        self.ttl = float(ttl)
+        self.max_entries = int(max_entries)
+        self.sweep_seconds = float(sweep_seconds)
+        self.backend: StateBackend | None = None
+        self._entries: OrderedDict[int, tuple[dict, float]] = OrderedDict()
+        self._next_sweep = time.time() + self.sweep_seconds
+        self._size = STATE_ENTRIES.labels(name)
+
+    @classmethod
+    def from_config(cls, name: str, config: dict) -> "StateStore":
+        settings = state_settings(config)
+        return cls(name, settings["ttl_minutes"] * 60, settings["max_entries"], settings["sweep_seconds"])
+
+    def attach(self, backend: StateBackend) -> int:
+        # Entries written before a restart come back; what is already in memory wins
+        self.backend = backend
+        restored = 0
+        try:
+            rows = backend.load(self.name, time.time())
+        except sqlite3.Error as e:
+            logger.warning(f"Состояния {self.name}: не удалось загрузить из {backend.path}: {e}")
+            return 0
+        for key, value, expires_at in rows:
+            if key not in self._entries:
+                self._entries[key] = (value, expires_at)
+                restored += 1
+        self._trim()
+        self._size.set(len(self._entries))
+        return restored
+
+    def _persist(self, action: str, *args) -> None:
+        if self.backend is None:
+            return
+        try:
+            getattr(self.backend, action)(self.name, *args)
+        except sqlite3.Error as e:
+            # The flow carries on from memory, it just would not survive a restart
+            logger.warning(f"Состояния {self.name}: не удалось записать в {self.backend.path}: {e}")
+
+    def _evict(self, key: int, reason: str) -> None:
+        del self._entries[key]
+        STATE_EVICTIONS.labels(self.name, reason).inc()
+        self._persist("delete", key)
+
+    def _trim(self) -> None:
+        while len(self._entries) > self.max_entries:
+            key = next(iter(self._entries))
+            self._evict(key, "lru")
+
+    def sweep(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        self._next_sweep = now + self.sweep_seconds
+        expired = [key for key, (_, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            STATE_EVICTIONS.labels(self.name, "ttl").inc(len(expired))
+        self._persist("delete_expired", now)
+        self._size.set(len(self._entries))
+        return len(expired)
+
+    def get(self, key: int, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[1] <= time.time():
+            self._evict(key, "ttl")
+            self._size.set(len(self._entries))
+            return default
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def set(self, key: int, value: dict, ttl: float | None = None) -> None:
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else float(ttl))
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        self._persist("put", key, value, expires_at)
+        self._trim()
+        if now >= self._next_sweep:
+            self.sweep(now)
+        self._size.set(len(self._entries))
+
+    def pop(self, key: int, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        self._persist("delete", key)
+        self._size.set(len(self._entries))
+        return entry[0] if entry[1] > time.time() else default
+
+    def __getitem__(self, key: int) -> dict:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: int, value: dict) -> None:
+        self.set(key, value)
+
+    def __contains__(self, key: int) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._entries)
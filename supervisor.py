@@ -0,0 +1,185 @@
+import asyncio
+import bisect
+import copy
+import hashlib
+import logging
+import multiprocessing
+import os
+import signal
+import time
+
+
+logger = logging.getLogger("Supervisor")
+
+
+def supervisor_settings(config: dict) -> dict:
+    raw = config.get("supervisor") or {}
+    return {
+        "workers": max(0, int(raw.get("workers", 0))),
+        "vnodes": max(1, int(raw.get("vnodes", 64))),
+        "restart_max_seconds": float(raw.get("restart_max_seconds", 60)),
+        "stable_seconds": float(raw.get("stable_seconds", 60)),
+    }
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.sha1(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    # Consistent hashing: each node owns `vnodes` points on the ring and a key goes to the
+    # next point clockwise. Going from K to K+1 nodes moves about 1/(K+1) of the keys.
+    def __init__(self, nodes: list[str], vnodes: int = 64):
+        points = sorted((_point(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._nodes = [n for _, n in points]
+
+    def node_for(self, key) -> str:
+        i = bisect.bisect(self._keys, _point(str(key))) % len(self._keys)
+        return self._nodes[i]
+
+
+class Shard:
+    def __init__(self, index: int, count: int, vnodes: int = 64):
+        self.index = index
+        self.count = count
+        self.name = f"worker{index}"
+        self.ring = HashRing([f"worker{i}" for i in range(count)], vnodes)
+
+    def owns(self, channel_id: int) -> bool:
+        return self.ring.node_for(channel_id) == self.name
+
+
+def process_config(config: dict, name: str, offset: int) -> dict:
+    # Every process writes its own log, slow-query report and Helix cache and serves metrics
+    # on its own port
+    config = copy.deepcopy(config)
+    for section, key, default in (("logging", "file", "bot.log"), ("query_profiler", "report_path", "slow_queries.json")):
+        raw = config.get(section) or {}
+        base, ext = os.path.splitext(raw.get(key) or default)
+        raw[key] = f"{base}.{name}{ext}"
+        config[section] = raw
+    helix = config.get("helix") or {}
+    # An empty cache_path keeps the cache in memory only, in every process
+    if helix.get("cache_path", "helix_cache.json"):
+        base, ext = os.path.splitext(helix.get("cache_path", "helix_cache.json"))
+        helix["cache_path"] = f"{base}.{name}{ext}"
+        config["helix"] = helix
+    metrics = config.get("metrics") or {}
+    metrics["port"] = int(metrics.get("port", 9108)) + offset
+    config["metrics"] = metrics
+    return config
+
+
+def _run_child(config: dict, name: str, offset: int, coro_factory) -> None:
+    # SIGTERM from the supervisor ends asyncio.run like Ctrl+C, so logs are flushed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    from log_setup import setup_logging
+
+    config = process_config(config, name, offset)
+    logs = setup_logging(config)
+    try:
+        asyncio.run(coro_factory(config))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logs.stop()
+
+
+def worker_main(config: dict, index: int, count: int) -> None:
+    import main
+
+    shard = Shard(index, count, supervisor_settings(config)["vnodes"])
+    _run_child(config, shard.name, index + 1, lambda c: main.main(c, shard=shard, telegram=False))
+
+
+def telegram_main(config: dict) -> None:
+    import main
+
+    _run_child(config, "telegram", 0, lambda c: main.main(c, twitch=False))
+
+
+class Supervisor:
+    # Starts the child processes, restarts any that exit with a growing pause (reset once a
+    # child has run for stable_seconds) and stops them all on Ctrl+C or SIGTERM
+    def __init__(self, restart_max_seconds: float = 60, stable_seconds: float = 60):
+        self.restart_max_seconds = float(restart_max_seconds)
+        self.stable_seconds = float(stable_seconds)
+        self.children: dict[str, dict] = {}
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stopping = False
+
+    def add(self, name: str, target, args: tuple) -> None:
+        self.children[name] = {"target": target, "args": args, "process": None, "started_at": 0.0, "delay": 1.0, "restart_at": 0.0, "restarts": 0}
+
+    def _start(self, name: str) -> None:
+        child = self.children[name]
+        process = self._ctx.Process(target=child["target"], args=child["args"], name=name)
+        process.start()
+        child["process"] = process
+        child["started_at"] = time.monotonic()
+        logger.info(f"Процесс {name} запущен (pid {process.pid})")
+
+    def _check(self, name: str, now: float) -> None:
+        child = self.children[name]
+        process = child["process"]
+        if process is not None and process.is_alive():
+            return
+        if process is not None:
+            if now - child["started_at"] >= self.stable_seconds:
+                child["delay"] = 1.0
+            child["restart_at"] = now + child["delay"]
+            logger.error(f"Процесс {name} завершился (код {process.exitcode}), перезапуск через {child['delay']:.0f} с")
+            child["delay"] = min(self.restart_max_seconds, child["delay"] * 2)
+            child["process"] = None
+            return
+        if now >= child["restart_at"]:
+            child["restarts"] += 1
+            self._start(name)
+
+    def stop(self, *_) -> None:
+        self._stopping = True
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        for name in self.children:
+            self._start(name)
+        try:
+            while not self._stopping:
+                time.sleep(0.5)
+                now = time.monotonic()
+                for name in self.children:
+                    self._check(name, now)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.shutdown()
+
+    def shutdown(self, timeout: float = 10) -> None:
+        processes = [c["process"] for c in self.children.values() if c["process"] is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Процесс {process.name} не остановился за {timeout:.0f} с, kill")
+                process.kill()
+                process.join()
+        logger.info("Все процессы остановлены")
+
+
+def run_supervisor(config: dict) -> None:
+    import main
+    from db import Database
+
+    settings = supervisor_settings(config)
+    # Migrations and backfills run once here, before the workers race for them
+    asyncio.run(main.prepare_startup(config, Database(config["database"]["db_path"])))
+    supervisor = Supervisor(settings["restart_max_seconds"], settings["stable_seconds"])
+    supervisor.add("telegram", telegram_main, (config,))
+    for i in range(settings["workers"]):
+        supervisor.add(f"worker{i}", worker_main, (config, i, settings["workers"]))
+    logger.info(f"Супервизор: процесс Telegram и {settings['workers']} Twitch-воркеров")
+    supervisor.run()
@@ -7,13 +7,23 @@ import re
 import os
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.types import CallbackQuery, InlineKeyboardButton, Message, FSInputFile
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 import yaml
 
+import query_profiler
+from backup import backup_settings, create_backup, list_backups, prune_backups, verify_backup
 from db import Database
+from edit_cache import EditCache
+from ipc import Bus, BusError
+from live_messages import LiveMessageUpdater
+from state_store import StateBackend, StateStore, state_settings
+from text_router import InputError, TextRouter
+from telegram_webhook import run_webhook, webhook_settings
 
 
 logger = logging.getLogger("TelegramBot")
@@ -30,18 +40,44 @@ TWITCH_CHANNEL = str(config.get("twitch", {}).get("channel", "")).replace("#", "
 TWITCH_CHAT_URL = f"https://www.twitch.tv/popout/{TWITCH_CHANNEL}/chat?popout=" if TWITCH_CHANNEL else ""
 
 
-bot = Bot(token=TOKEN)
+def make_bot() -> Bot:
+    # telegram.api_server points the bot at a local Bot API server (or fake_telegram.py)
+    api_server = config["telegram"].get("api_server")
+    if api_server:
+        return Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(api_server)))
+    return Bot(token=TOKEN)
+
+
+# Built on first use (init_bot), so importing this module does not create an HTTP session
+# or validate the token: bot.py, replays and benchmarks import it for the handlers alone
+bot: Bot | None = None
+check_updater: LiveMessageUpdater | None = None
+# Set by main: the IPC bus to the Twitch bots, and the last stream state each one reported
+bus: Bus | None = None
+stream_states: dict[int, bool] = {}
 dp = Dispatcher()
 db = Database(config["database"]["db_path"])
 
-withdraw_sessions: dict[int, dict] = {}
-admin_reason_wait: dict[int, dict] = {}
-admin_check_sessions: dict[int, dict] = {}
-admin_giveaway_sessions: dict[int, dict] = {}
-admin_conversion_wait: dict[int, dict] = {}
-author_sessions: dict[int, dict] = {}
-admin_channel_sessions: dict[int, dict] = {}
-channel_request_sessions: dict[int, dict] = {}
+# Where each user is in a multi-step flow. Entries expire after telegram_state.ttl_minutes;
+# start_telegram_bot attaches the SQLite file so unfinished flows survive a restart.
+withdraw_sessions = StateStore.from_config("withdraw", config)
+admin_reason_wait = StateStore.from_config("admin_reason", config)
+admin_check_sessions = StateStore.from_config("admin_check", config)
+admin_giveaway_sessions = StateStore.from_config("admin_giveaway", config)
+admin_conversion_wait = StateStore.from_config("admin_conversion", config)
+author_sessions = StateStore.from_config("author", config)
+admin_channel_sessions = StateStore.from_config("admin_channel", config)
+channel_request_sessions = StateStore.from_config("channel_request", config)
+STATE_STORES = (
+    withdraw_sessions,
+    admin_reason_wait,
+    admin_check_sessions,
+    admin_giveaway_sessions,
+    admin_conversion_wait,
+    author_sessions,
+    admin_channel_sessions,
+    channel_request_sessions,
+)
 DEFAULT_CHANNEL_ID: int | None = None
 
 BOT_USERNAME: str | None = None
@@ -70,6 +106,64 @@ def format_dt(value) -> str:
     except Exception:
         return s
 
+def install_edit_cache(b: Bot) -> None:
+    entries = int(config["telegram"].get("edit_cache_entries", 10000))
+    if entries > 0:
+        b.session.middleware(EditCache(entries))
+
+
+def init_bot() -> Bot:
+    global bot, check_updater
+    if bot is None:
+        bot = make_bot()
+        install_edit_cache(bot)
+    if check_updater is None:
+        check_updater = LiveMessageUpdater(bot, interval=float(config["telegram"].get("live_edit_interval_seconds", 3)))
+    return bot
+
+
+def attach_bus(b: Bus):
+    global bus
+    bus = b
+    bus.on("notify", on_bus_notify)
+    bus.on("stream", on_bus_stream)
+
+
+async def on_bus_notify(data: dict):
+    await notify_user(int(data["telegram_id"]), str(data["text"]))
+
+
+def on_bus_stream(data: dict):
+    stream_states[int(data["channel_id"])] = bool(data["online"])
+
+
+async def signal(topic: str, data=None):
+    # Wakes whoever handles it (the channel's Twitch bot, the bot manager) right away;
+    # without the bus they notice on their next poll of the database
+    if bus is not None:
+        await bus.publish(topic, data)
+
+
+async def update_channel_settings(channel_id: int, **kwargs):
+    await db.update_channel_settings(channel_id, **kwargs)
+    await signal(f"settings:{int(channel_id)}")
+
+
+async def channel_status_line(channel_id: int) -> str:
+    # Asks the channel's Twitch bot directly; falls back to the last stream event it sent
+    if bus is not None:
+        try:
+            status = await bus.request(f"status:{int(channel_id)}", timeout=1)
+            stream = "в эфире" if status.get("online") else "офлайн"
+            game = ", идёт «Угадай число»" if status.get("number_game") else ""
+            return f"Бот: <b>работает</b>, стрим {stream}{game}\n"
+        except BusError:
+            pass
+    if int(channel_id) in stream_states:
+        return f"Стрим: <b>{'в эфире' if stream_states[int(channel_id)] else 'офлайн'}</b> (бот не ответил)\n"
+    return ""
+
+
 async def get_default_channel_id() -> int | None:
     global DEFAULT_CHANNEL_ID
     if DEFAULT_CHANNEL_ID:
@@ -349,9 +443,11 @@ async def cb_admin_channel_settings(query: CallbackQuery):
         )
         settings = await db.get_channel_settings(channel_id)
     drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
+    status_line = await channel_status_line(channel_id)
     text = (
         "⚙️ <b>Настройки дропов</b>\n"
-        f"Канал: <b>{ch['login']}</b>\n\n"
+        f"Канал: <b>{ch['login']}</b>\n"
+        f"{status_line}\n"
         f"Дропы: <b>{'ВКЛ' if drops_enabled else 'ВЫКЛ'}</b>\n"
         f"Интервал: <b>{settings.get('min_interval_minutes')}</b>–<b>{settings.get('max_interval_minutes')}</b> мин\n"
         f"Активность: <b>{settings.get('active_timeout_minutes')}</b> мин\n"
@@ -377,7 +473,7 @@ async def cb_admin_channel_toggle_drops(query: CallbackQuery):
         return
     settings = await db.get_channel_settings(channel_id)
     drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
-    await db.update_channel_settings(channel_id, drops_enabled=0 if drops_enabled else 1)
+    await update_channel_settings(channel_id, drops_enabled=0 if drops_enabled else 1)
     await cb_admin_channel_settings(query)
 
 
@@ -563,9 +659,11 @@ async def cb_author_settings(query: CallbackQuery):
         )
         settings = await db.get_channel_settings(channel_id)
     drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
+    status_line = await channel_status_line(channel_id)
     text = (
         "⚙️ <b>Настройки дропов</b>\n"
-        f"Канал: <b>{ch['login']}</b>\n\n"
+        f"Канал: <b>{ch['login']}</b>\n"
+        f"{status_line}\n"
         f"Дропы: <b>{'ВКЛ' if drops_enabled else 'ВЫКЛ'}</b>\n"
         f"Интервал: <b>{settings.get('min_interval_minutes')}</b>–<b>{settings.get('max_interval_minutes')}</b> мин\n"
         f"Активность: <b>{settings.get('active_timeout_minutes')}</b> мин\n"
@@ -592,7 +690,7 @@ async def cb_author_toggle_drops(query: CallbackQuery):
         return
     settings = await db.get_channel_settings(channel_id)
     drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
-    await db.update_channel_settings(channel_id, drops_enabled=0 if drops_enabled else 1)
+    await update_channel_settings(channel_id, drops_enabled=0 if drops_enabled else 1)
     await cb_author_settings(query)
 
 
@@ -995,6 +1093,7 @@ async def cb_sg_actions(query: CallbackQuery):
         sess = admin_giveaway_sessions.get(query.from_user.id) or {}
         channel_id = sess.get("channel_id")
         if channel_id:
+            await signal(f"trigger:{int(channel_id)}")
             await render_stream_giveaways(query.message, int(channel_id))
         return
 
@@ -1171,6 +1270,7 @@ async def cb_admin_pick_instant_channel(query: CallbackQuery):
         await query.answer("Некорректный ID", show_alert=True)
         return
     trigger_id = await db.create_giveaway_trigger(channel_id, query.from_user.id)
+    await signal(f"trigger:{channel_id}")
     ch = await db.get_channel_by_id(channel_id)
     channel_label = ch["login"] if ch else str(channel_id)
     await query.answer("Запрос отправлен", show_alert=True)
@@ -1241,6 +1341,7 @@ async def cb_admin_clip(query: CallbackQuery):
         await query.answer("Канал не настроен", show_alert=True)
         return
     trigger_id = await db.create_clip_trigger(channel_id, query.from_user.id)
+    await signal(f"trigger:{channel_id}")
     await query.answer("Запрос отправлен", show_alert=True)
     try:
         await query.message.edit_text(
@@ -1315,11 +1416,63 @@ async def cmd_backup(message: Message):
     if not os.path.exists(db_path):
         await message.answer("Файл базы данных не найден.")
         return
+    settings = backup_settings(config)
     try:
-        await message.answer_document(FSInputFile(db_path), caption="Резервная копия базы данных")
+        parts = await asyncio.to_thread(create_backup, db_path, settings["dir"], settings)
+    except Exception as e:
+        logger.error(f"Не удалось создать backup: {e}")
+        await message.answer("Не удалось создать резервную копию.")
+        return
+    try:
+        for i, path in enumerate(parts, start=1):
+            caption = "Резервная копия базы данных"
+            if len(parts) > 1:
+                caption += f" (часть {i}/{len(parts)})"
+            await message.answer_document(FSInputFile(path), caption=caption)
     except Exception as e:
         logger.error(f"Не удалось отправить backup: {e}")
         await message.answer("Не удалось отправить файл базы данных.")
+    await asyncio.to_thread(prune_backups, settings["dir"], settings["keep"])
+
+
+@dp.message(Command("backup_verify"))
+async def cmd_backup_verify(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    settings = backup_settings(config)
+    groups = await asyncio.to_thread(list_backups, settings["dir"])
+    if not groups:
+        await message.answer("Резервных копий пока нет.")
+        return
+    name, parts = list(groups.items())[-1]
+    result = await asyncio.to_thread(verify_backup, parts)
+    if not result.get("ok"):
+        await message.answer(f"❌ {os.path.basename(name)}: {result.get('error') or result.get('integrity')}")
+        return
+    rows = sum(result["tables"].values())
+    await message.answer(
+        f"✅ {os.path.basename(name)}: integrity ok, таблиц {len(result['tables'])}, строк {rows}"
+    )
+
+
+@dp.message(Command("slow_queries"))
+async def cmd_slow_queries(message: Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    profiler = query_profiler.current()
+    if profiler is None:
+        await message.answer("Профилирование запросов выключено (query_profiler.enabled в config.yaml).")
+        return
+    parts = (message.text or "").split()
+    by = parts[1] if len(parts) > 1 and parts[1] in ("total", "max", "calls", "avg") else "total"
+    rows = profiler.top(10, by=by)
+    if not rows:
+        await message.answer("Запросов пока не было.")
+        return
+    text = f"Топ запросов по {by} (всего {profiler.statements}, порог {profiler.slow_seconds * 1000:.0f} мс):\n\n"
+    text += query_profiler.format_top(rows, sql_width=200)
+    for i in range(0, len(text), 4000):
+        await message.answer(text[i : i + 4000], parse_mode=None)
 
 
 def withdraw_admin_kb(withdrawal_id: int):
@@ -1377,583 +1530,465 @@ async def withdraw_photo(message: Message):
     session = withdraw_sessions.get(message.from_user.id)
     if not session or session.get("stage") != "photo":
         return
-    session["photo_id"] = message.photo[-1].file_id
-    session["stage"] = "price"
+    withdraw_sessions[message.from_user.id] = {**session, "photo_id": message.photo[-1].file_id, "stage": "price"}
     await message.answer("Укажи цену в GOLD (целым числом). Минимум: 1000")
 
 
+def split_fields(text: str) -> list[str]:
+    return [p for p in (part.strip() for part in text.split("|")) if p]
+
+
+def parse_withdraw_price(text: str) -> int:
+    try:
+        amount = int(text)
+    except ValueError:
+        raise InputError("Цена должна быть целым числом GOLD. Пример: 1500")
+    if amount < 1000:
+        raise InputError("Минимальная сумма вывода: 1000 GOLD")
+    return amount
+
+
+def parse_twitch_login(text: str) -> str:
+    login = text.strip().lower().replace("https://", "").replace("http://", "")
+    login = login.replace("twitch.tv/", "").replace("twitch.tv\\", "").strip("/")
+    login = login.lstrip("@")
+    if not re.fullmatch(r"[a-z0-9_]{3,25}", login or ""):
+        raise InputError("Некорректный логин. Пример: <code>mychannel</code>")
+    return login
+
+
+def parse_contact(text: str) -> str:
+    contact = text.strip()
+    if not contact:
+        raise InputError("Контакт не должен быть пустым.")
+    return contact
+
+
+def parse_note(text: str) -> str:
+    note = text.strip()
+    return "" if note == "-" or note.lower() in ("нет", "no") else note
+
+
+def parse_interval(text: str) -> dict:
+    parts = text.replace("-", " ").split()
+    if len(parts) != 2:
+        raise InputError("Отправь интервал: <code>MIN MAX</code>")
+    try:
+        min_v = int(parts[0])
+        max_v = int(parts[1])
+    except ValueError:
+        raise InputError("Значения должны быть числами.")
+    if min_v <= 0 or max_v <= 0 or min_v >= max_v:
+        raise InputError("MIN должен быть меньше MAX и больше 0.")
+    return {"min_interval_minutes": min_v, "max_interval_minutes": max_v}
+
+
+def parse_minutes(field: str, example: int):
+    def parse(text: str) -> dict:
+        try:
+            value = int(text.strip())
+        except ValueError:
+            raise InputError(f"Нужно число. Пример: <code>{example}</code>")
+        if value <= 0:
+            raise InputError("Значение должно быть больше 0.")
+        return {field: value}
+
+    return parse
+
+
+def parse_reward(text: str) -> dict:
+    parts = split_fields(text)
+    if len(parts) < 2:
+        raise InputError("Формат: <code>Название | Вес | Кол-во | Вкл(0/1) | Описание</code>")
+    try:
+        weight = int(parts[1])
+    except ValueError:
+        raise InputError("Вес должен быть числом.")
+    quantity = 1
+    enabled = 1
+    if len(parts) > 2:
+        try:
+            quantity = int(parts[2])
+        except ValueError:
+            raise InputError("Кол-во должно быть числом.")
+    if len(parts) > 3:
+        try:
+            enabled = int(parts[3])
+        except ValueError:
+            raise InputError("Вкл должно быть 0 или 1.")
+    if enabled not in (0, 1):
+        raise InputError("Вкл должно быть 0 или 1.")
+    if weight < 0 or quantity <= 0:
+        raise InputError("Проверь данные и попробуй ещё раз.")
+    return {
+        "name": parts[0],
+        "description": parts[4] if len(parts) > 4 else "",
+        "weight": weight,
+        "quantity": quantity,
+        "enabled": enabled,
+    }
+
+
+def parse_guess_game(text: str) -> tuple[str, int | None, int, int]:
+    # ПРИЗ | ЧИСЛО | MIN MAX, ПРИЗ | MIN MAX или просто ПРИЗ (диапазон 1..100)
+    parts = split_fields(text)
+    if not parts:
+        raise InputError("Некорректные данные.")
+    number = None
+    if len(parts) == 1:
+        range_part = "1 100"
+    elif len(parts) == 2:
+        range_part = parts[1]
+    else:
+        try:
+            number = int(parts[1])
+        except ValueError:
+            number = None
+        range_part = parts[2]
+    r = range_part.replace("-", " ").split()
+    if len(r) != 2:
+        raise InputError("Диапазон должен быть двумя числами. Пример: <code>1 100</code>")
+    try:
+        min_v = int(r[0])
+        max_v = int(r[1])
+    except ValueError:
+        raise InputError("Диапазон должен быть числами. Пример: <code>1 100</code>")
+    if min_v >= max_v:
+        raise InputError("MIN должен быть меньше MAX.")
+    if number is not None and (number < min_v or number > max_v):
+        raise InputError("ЧИСЛО должно быть внутри диапазона.")
+    return parts[0], number, min_v, max_v
+
+
+def parse_planned_giveaway(text: str) -> tuple[str, int]:
+    title, sep, count_raw = text.partition("|")
+    try:
+        winners_count = int(count_raw.strip() if sep else "1")
+    except ValueError:
+        raise InputError("Кол-во победителей должно быть числом. Пример: <code>AKR12 | 2</code>")
+    if not title.strip() or winners_count <= 0:
+        raise InputError("Некорректные данные. Пример: <code>AKR12 | 2</code>")
+    return title.strip(), winners_count
+
+
+def parse_check_params(text: str) -> tuple[int, int]:
+    parts = text.strip().split()
+    if len(parts) != 2:
+        raise InputError("Отправь два числа: <code>N M</code>\nПример: <code>100 5</code>")
+    try:
+        amount = int(parts[0])
+        max_activations = int(parts[1])
+    except ValueError:
+        raise InputError("N и M должны быть числами. Пример: <code>100 5</code>")
+    if amount <= 0 or max_activations <= 0:
+        raise InputError("N и M должны быть больше 0.")
+    return amount, max_activations
+
+
+async def load_admin_channel(message: Message, sess: dict) -> dict | None:
+    channel_id = sess.get("channel_id")
+    ch = await db.get_channel_by_id(int(channel_id)) if channel_id else None
+    if not ch:
+        admin_channel_sessions.pop(message.from_user.id, None)
+        await message.answer("Канал не найден.", reply_markup=back_kb())
+        return None
+    return {**sess, "channel": ch}
+
+
+async def load_owner_channel(message: Message, sess: dict) -> dict | None:
+    channel_id = sess.get("channel_id")
+    ch = await get_owner_channel(message.from_user.id, int(channel_id)) if channel_id else None
+    if not ch:
+        author_sessions.pop(message.from_user.id, None)
+        await message.answer("Нет доступа к каналу.", reply_markup=back_kb())
+        return None
+    return {**sess, "channel": ch}
+
+
+async def load_giveaway_channel(message: Message, sess: dict) -> dict | None:
+    if not sess.get("channel_id"):
+        admin_giveaway_sessions.pop(message.from_user.id, None)
+        await message.answer("Канал не настроен.")
+        return None
+    return sess
+
+
+# Checked in this order; a user can be in several flows at once (an admin editing a channel
+# they also own), the first one with a handler for its stage gets the text
+text_router = TextRouter(ADMIN_IDS)
+text_router.flow("withdraw", withdraw_sessions, exclusive=True)
+text_router.flow("channel_request", channel_request_sessions)
+# As before the router: a channel session on a stage nobody handles is dropped
+text_router.flow("admin_channel", admin_channel_sessions, admin_only=True, load=load_admin_channel, drop_unknown=True)
+text_router.flow("author", author_sessions, load=load_owner_channel, drop_unknown=True)
+text_router.flow("admin_giveaway", admin_giveaway_sessions, admin_only=True, load=load_giveaway_channel)
+text_router.flow("admin_check", admin_check_sessions, admin_only=True)
+
+
 @dp.message(F.chat.type == "private", F.text, ~F.text.startswith("/"))
 async def private_text_router(message: Message):
-    text = (message.text or "").strip()
+    await text_router.dispatch(message, (message.text or "").strip())
 
-    session = withdraw_sessions.get(message.from_user.id)
-    if session:
-        if session.get("stage") == "price":
-            try:
-                amount = int(text)
-            except Exception:
-                await message.answer("Цена должна быть целым числом GOLD. Пример: 1500")
-                return
-            if amount < 1000:
-                await message.answer("Минимальная сумма вывода: 1000 GOLD")
-                return
-            session["price"] = str(amount)
-            session["stage"] = "pattern"
-            await message.answer("Укажи паттерн.")
-            return
 
-        if session.get("stage") == "pattern":
-            pattern = text
-            try:
-                price_gold = int(session.get("price") or 0)
-            except Exception:
-                price_gold = 0
-            if price_gold < 1000:
-                await message.answer("Минимальная сумма вывода: 1000 GOLD")
-                return
+@text_router.stage("withdraw", "price", parse_withdraw_price)
+async def withdraw_price(message: Message, session: dict, amount: int):
+    withdraw_sessions[message.from_user.id] = {**session, "price": str(amount), "stage": "pattern"}
+    await message.answer("Укажи паттерн.")
 
-            withdrawal_id = await db.create_withdrawal(
-                telegram_id=message.from_user.id,
-                telegram_username=message.from_user.username or "",
-                item_name="G22 flock",
-                photo_file_id=session.get("photo_id"),
-                price=str(price_gold),
-                pattern=pattern,
-            )
 
-            debit = await db.apply_gold_delta_once(
-                telegram_id=message.from_user.id,
-                amount=-price_gold,
-                source_type="withdrawal",
-                source_id=withdrawal_id,
-            )
-            if not debit.get("ok"):
-                await db.delete_withdrawal(withdrawal_id)
-                if debit.get("status") == "insufficient":
-                    await message.answer(
-                        f"Недостаточно GOLD для вывода.\n💰 Баланс: {debit.get('balance', 0)}"
-                    )
-                else:
-                    await message.answer("Не удалось списать GOLD. Попробуй позже.")
-                withdraw_sessions.pop(message.from_user.id, None)
-                return
-
-            withdrawal = await db.get_withdrawal(withdrawal_id)
-            caption = withdrawal_caption(withdrawal)
-            try:
-                admin_msg = await bot.send_photo(
-                    ADMIN_CHAT_ID,
-                    withdrawal.get("photo_file_id"),
-                    caption=caption,
-                    reply_markup=withdraw_admin_kb(withdrawal_id),
-                    parse_mode="HTML",
-                )
-            except Exception:
-                await db.apply_gold_delta_once(
-                    telegram_id=message.from_user.id,
-                    amount=price_gold,
-                    source_type="withdrawal_rollback",
-                    source_id=withdrawal_id,
-                )
-                await db.delete_withdrawal(withdrawal_id)
-                await message.answer("Не удалось отправить заявку в админ-чат. Попробуй позже.")
-                withdraw_sessions.pop(message.from_user.id, None)
-                return
+@text_router.stage("withdraw", "pattern")
+async def withdraw_pattern(message: Message, session: dict, pattern: str):
+    try:
+        price_gold = int(session.get("price") or 0)
+    except Exception:
+        price_gold = 0
+    if price_gold < 1000:
+        await message.answer("Минимальная сумма вывода: 1000 GOLD")
+        return
+
+    withdrawal_id = await db.create_withdrawal(
+        telegram_id=message.from_user.id,
+        telegram_username=message.from_user.username or "",
+        item_name="G22 flock",
+        photo_file_id=session.get("photo_id"),
+        price=str(price_gold),
+        pattern=pattern,
+    )
 
-            await db.set_withdrawal_admin_message(
-                withdrawal_id=withdrawal_id,
-                admin_chat_id=admin_msg.chat.id,
-                admin_message_id=admin_msg.message_id,
+    debit = await db.apply_gold_delta_once(
+        telegram_id=message.from_user.id,
+        amount=-price_gold,
+        source_type="withdrawal",
+        source_id=withdrawal_id,
+    )
+    if not debit.get("ok"):
+        await db.delete_withdrawal(withdrawal_id)
+        if debit.get("status") == "insufficient":
+            await message.answer(
+                f"Недостаточно GOLD для вывода.\n💰 Баланс: {debit.get('balance', 0)}"
             )
-            withdraw_sessions.pop(message.from_user.id, None)
-            await message.answer("Заявка отправлена. GOLD списан, ожидай решения админа.")
-            return
+        else:
+            await message.answer("Не удалось списать GOLD. Попробуй позже.")
+        withdraw_sessions.pop(message.from_user.id, None)
+        return
 
+    withdrawal = await db.get_withdrawal(withdrawal_id)
+    caption = withdrawal_caption(withdrawal)
+    try:
+        admin_msg = await bot.send_photo(
+            ADMIN_CHAT_ID,
+            withdrawal.get("photo_file_id"),
+            caption=caption,
+            reply_markup=withdraw_admin_kb(withdrawal_id),
+            parse_mode="HTML",
+        )
+    except Exception:
+        await db.apply_gold_delta_once(
+            telegram_id=message.from_user.id,
+            amount=price_gold,
+            source_type="withdrawal_rollback",
+            source_id=withdrawal_id,
+        )
+        await db.delete_withdrawal(withdrawal_id)
+        await message.answer("Не удалось отправить заявку в админ-чат. Попробуй позже.")
+        withdraw_sessions.pop(message.from_user.id, None)
         return
 
-    req_sess = channel_request_sessions.get(message.from_user.id)
-    if req_sess:
-        stage = req_sess.get("stage")
-        if stage == "twitch_login":
-            login = text.strip().lower().replace("https://", "").replace("http://", "")
-            login = login.replace("twitch.tv/", "").replace("twitch.tv\\", "").strip("/")
-            login = login.lstrip("@")
-            if not re.fullmatch(r"[a-z0-9_]{3,25}", login or ""):
-                await message.answer("Некорректный логин. Пример: <code>mychannel</code>", parse_mode="HTML")
-                return
-            existing = await db.get_channel_by_login(login)
-            if existing and existing.get("owner_telegram_id") == message.from_user.id:
-                channel_request_sessions.pop(message.from_user.id, None)
-                await message.answer("Этот канал уже подключён.", reply_markup=back_kb())
-                return
-            req_sess["twitch_login"] = login
-            req_sess["stage"] = "contact"
-            await message.answer("Укажи контакт для связи. Например: <code>@username</code> или Discord.", parse_mode="HTML")
-            return
+    await db.set_withdrawal_admin_message(
+        withdrawal_id=withdrawal_id,
+        admin_chat_id=admin_msg.chat.id,
+        admin_message_id=admin_msg.message_id,
+    )
+    withdraw_sessions.pop(message.from_user.id, None)
+    await message.answer("Заявка отправлена. GOLD списан, ожидай решения админа.")
 
-        if stage == "contact":
-            contact = text.strip()
-            if not contact:
-                await message.answer("Контакт не должен быть пустым.")
-                return
-            req_sess["contact"] = contact
-            req_sess["stage"] = "note"
-            await message.answer("Добавь примечание или отправь <code>-</code>.", parse_mode="HTML")
-            return
 
-        if stage == "note":
-            note = text.strip()
-            if note == "-" or note.lower() in ("нет", "no"):
-                note = ""
-            login = req_sess.get("twitch_login") or ""
-            contact = req_sess.get("contact") or ""
-            try:
-                request_id = await db.create_channel_request(
-                    telegram_id=message.from_user.id,
-                    telegram_username=message.from_user.username or "",
-                    twitch_login=login,
-                    contact=contact,
-                    note=note,
-                )
-            except Exception:
-                channel_request_sessions.pop(message.from_user.id, None)
-                await message.answer("Не удалось отправить заявку. Попробуй позже.")
-                return
+@text_router.stage("channel_request", "twitch_login", parse_twitch_login)
+async def channel_request_login(message: Message, req_sess: dict, login: str):
+    existing = await db.get_channel_by_login(login)
+    if existing and existing.get("owner_telegram_id") == message.from_user.id:
+        channel_request_sessions.pop(message.from_user.id, None)
+        await message.answer("Этот канал уже подключён.", reply_markup=back_kb())
+        return
+    channel_request_sessions[message.from_user.id] = {**req_sess, "twitch_login": login, "stage": "contact"}
+    await message.answer("Укажи контакт для связи. Например: <code>@username</code> или Discord.", parse_mode="HTML")
 
-            text_admin = (
-                "🧩 <b>Заявка на подключение бота</b>\n\n"
-                f"🧾 ID: <code>{request_id}</code>\n"
-                f"👤 TG: @{message.from_user.username or '—'} (id <code>{message.from_user.id}</code>)\n"
-                f"🎥 Twitch: <b>{login}</b>\n"
-                f"📞 Контакт: <b>{contact}</b>"
-            )
-            if note:
-                text_admin += f"\n📝 Примечание: {note}"
-            try:
-                admin_msg = await bot.send_message(
-                    ADMIN_CHAT_ID,
-                    text_admin,
-                    reply_markup=channel_request_admin_kb(request_id),
-                    parse_mode="HTML",
-                )
-                await db.set_channel_request_admin_message(request_id, admin_msg.chat.id, admin_msg.message_id)
-            except Exception:
-                channel_request_sessions.pop(message.from_user.id, None)
-                await message.answer("Не удалось отправить в админ-чат. Попробуй позже.")
-                return
 
-            channel_request_sessions.pop(message.from_user.id, None)
-            await message.answer("Заявка отправлена. Ожидай решения админа.", reply_markup=back_kb())
-            return
+@text_router.stage("channel_request", "contact", parse_contact)
+async def channel_request_contact(message: Message, req_sess: dict, contact: str):
+    channel_request_sessions[message.from_user.id] = {**req_sess, "contact": contact, "stage": "note"}
+    await message.answer("Добавь примечание или отправь <code>-</code>.", parse_mode="HTML")
 
-    admin_sess = admin_channel_sessions.get(message.from_user.id)
-    if admin_sess and message.from_user.id in ADMIN_IDS:
-        stage = admin_sess.get("stage")
-        channel_id = admin_sess.get("channel_id")
-        ch = await db.get_channel_by_id(int(channel_id)) if channel_id else None
-        if not ch:
-            admin_channel_sessions.pop(message.from_user.id, None)
-            await message.answer("Канал не найден.", reply_markup=back_kb())
-            return
 
-        if stage == "set_interval":
-            parts = text.replace("-", " ").split()
-            if len(parts) != 2:
-                await message.answer("Отправь интервал: <code>MIN MAX</code>", parse_mode="HTML")
-                return
-            try:
-                min_v = int(parts[0])
-                max_v = int(parts[1])
-            except Exception:
-                await message.answer("Значения должны быть числами.", parse_mode="HTML")
-                return
-            if min_v <= 0 or max_v <= 0 or min_v >= max_v:
-                await message.answer("MIN должен быть меньше MAX и больше 0.")
-                return
-            await db.update_channel_settings(channel_id, min_interval_minutes=min_v, max_interval_minutes=max_v)
-            admin_channel_sessions.pop(message.from_user.id, None)
-        elif stage == "set_active":
-            try:
-                value = int(text.strip())
-            except Exception:
-                await message.answer("Нужно число. Пример: <code>15</code>", parse_mode="HTML")
-                return
-            if value <= 0:
-                await message.answer("Значение должно быть больше 0.")
-                return
-            await db.update_channel_settings(channel_id, active_timeout_minutes=value)
-            admin_channel_sessions.pop(message.from_user.id, None)
-        elif stage == "set_claim":
-            try:
-                value = int(text.strip())
-            except Exception:
-                await message.answer("Нужно число. Пример: <code>7</code>", parse_mode="HTML")
-                return
-            if value <= 0:
-                await message.answer("Значение должно быть больше 0.")
-                return
-            await db.update_channel_settings(channel_id, claim_timeout_minutes=value)
-            admin_channel_sessions.pop(message.from_user.id, None)
-        elif stage == "reward_add":
-            parts = [p.strip() for p in text.split("|")]
-            parts = [p for p in parts if p != ""]
-            if len(parts) < 2:
-                await message.answer(
-                    "Формат: <code>Название | Вес | Кол-во | Вкл(0/1) | Описание</code>",
-                    parse_mode="HTML",
-                )
-                return
-            name = parts[0]
-            try:
-                weight = int(parts[1])
-            except Exception:
-                await message.answer("Вес должен быть числом.")
-                return
-            quantity = 1
-            enabled = 1
-            description = ""
-            if len(parts) > 2:
-                try:
-                    quantity = int(parts[2])
-                except Exception:
-                    await message.answer("Кол-во должно быть числом.")
-                    return
-            if len(parts) > 3:
-                try:
-                    enabled = int(parts[3])
-                except Exception:
-                    await message.answer("Вкл должно быть 0 или 1.")
-                    return
-            if enabled not in (0, 1):
-                await message.answer("Вкл должно быть 0 или 1.")
-                return
-            if len(parts) > 4:
-                description = parts[4]
-            if not name or weight < 0 or quantity <= 0:
-                await message.answer("Проверь данные и попробуй ещё раз.")
-                return
-            try:
-                await db.create_reward(
-                    channel_id=int(channel_id),
-                    name=name,
-                    description=description,
-                    weight=weight,
-                    quantity=quantity,
-                    enabled=enabled,
-                )
-            except Exception:
-                await message.answer("Не удалось добавить награду.")
-                return
-            admin_channel_sessions.pop(message.from_user.id, None)
-        else:
-            admin_channel_sessions.pop(message.from_user.id, None)
+@text_router.stage("channel_request", "note", parse_note)
+async def channel_request_note(message: Message, req_sess: dict, note: str):
+    login = req_sess.get("twitch_login") or ""
+    contact = req_sess.get("contact") or ""
+    try:
+        request_id = await db.create_channel_request(
+            telegram_id=message.from_user.id,
+            telegram_username=message.from_user.username or "",
+            twitch_login=login,
+            contact=contact,
+            note=note,
+        )
+    except Exception:
+        channel_request_sessions.pop(message.from_user.id, None)
+        await message.answer("Не удалось отправить заявку. Попробуй позже.")
+        return
 
-        settings = await db.get_channel_settings(channel_id)
-        if stage in ("set_interval", "set_active", "set_claim"):
-            drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
-            text_out = (
-                "⚙️ <b>Настройки дропов</b>\n"
-                f"Канал: <b>{ch['login']}</b>\n\n"
-                f"Дропы: <b>{'ВКЛ' if drops_enabled else 'ВЫКЛ'}</b>\n"
-                f"Интервал: <b>{settings.get('min_interval_minutes')}</b>–<b>{settings.get('max_interval_minutes')}</b> мин\n"
-                f"Активность: <b>{settings.get('active_timeout_minutes')}</b> мин\n"
-                f"Таймаут забора: <b>{settings.get('claim_timeout_minutes')}</b> мин"
-            )
-            await message.answer(text_out, reply_markup=admin_settings_kb(int(channel_id), drops_enabled), parse_mode="HTML")
-            return
+    text_admin = (
+        "🧩 <b>Заявка на подключение бота</b>\n\n"
+        f"🧾 ID: <code>{request_id}</code>\n"
+        f"👤 TG: @{message.from_user.username or '—'} (id <code>{message.from_user.id}</code>)\n"
+        f"🎥 Twitch: <b>{login}</b>\n"
+        f"📞 Контакт: <b>{contact}</b>"
+    )
+    if note:
+        text_admin += f"\n📝 Примечание: {note}"
+    try:
+        admin_msg = await bot.send_message(
+            ADMIN_CHAT_ID,
+            text_admin,
+            reply_markup=channel_request_admin_kb(request_id),
+            parse_mode="HTML",
+        )
+        await db.set_channel_request_admin_message(request_id, admin_msg.chat.id, admin_msg.message_id)
+    except Exception:
+        channel_request_sessions.pop(message.from_user.id, None)
+        await message.answer("Не удалось отправить в админ-чат. Попробуй позже.")
+        return
 
-        if stage == "reward_add":
-            rewards = await db.list_rewards(channel_id)
-            if not rewards:
-                text_out = f"🎁 <b>Награды</b>\nКанал: <b>{ch['login']}</b>\n\nПока нет наград."
-            else:
-                lines = []
-                for r in rewards[:10]:
-                    enabled = "ВКЛ" if int(r.get("enabled") or 0) else "ВЫКЛ"
-                    lines.append(f"#{r['id']} — <b>{r['name']}</b> — вес {r['weight']} — кол-во {r['quantity']} — {enabled}")
-                text_out = f"🎁 <b>Награды</b>\nКанал: <b>{ch['login']}</b>\n\n" + "\n".join(lines)
-            await message.answer(text_out, reply_markup=admin_rewards_kb(int(channel_id), rewards), parse_mode="HTML")
-            return
+    channel_request_sessions.pop(message.from_user.id, None)
+    await message.answer("Заявка отправлена. Ожидай решения админа.", reply_markup=back_kb())
 
-    a_sess = author_sessions.get(message.from_user.id)
-    if a_sess:
-        stage = a_sess.get("stage")
-        channel_id = a_sess.get("channel_id")
-        ch = await get_owner_channel(message.from_user.id, int(channel_id)) if channel_id else None
-        if not ch:
-            author_sessions.pop(message.from_user.id, None)
-            await message.answer("Нет доступа к каналу.", reply_markup=back_kb())
-            return
 
-        if stage == "set_interval":
-            parts = text.replace("-", " ").split()
-            if len(parts) != 2:
-                await message.answer("Отправь интервал: <code>MIN MAX</code>", parse_mode="HTML")
-                return
-            try:
-                min_v = int(parts[0])
-                max_v = int(parts[1])
-            except Exception:
-                await message.answer("Значения должны быть числами.", parse_mode="HTML")
-                return
-            if min_v <= 0 or max_v <= 0 or min_v >= max_v:
-                await message.answer("MIN должен быть меньше MAX и больше 0.")
-                return
-            await db.update_channel_settings(channel_id, min_interval_minutes=min_v, max_interval_minutes=max_v)
-            author_sessions.pop(message.from_user.id, None)
-        elif stage == "set_active":
-            try:
-                value = int(text.strip())
-            except Exception:
-                await message.answer("Нужно число. Пример: <code>15</code>", parse_mode="HTML")
-                return
-            if value <= 0:
-                await message.answer("Значение должно быть больше 0.")
-                return
-            await db.update_channel_settings(channel_id, active_timeout_minutes=value)
-            author_sessions.pop(message.from_user.id, None)
-        elif stage == "set_claim":
-            try:
-                value = int(text.strip())
-            except Exception:
-                await message.answer("Нужно число. Пример: <code>7</code>", parse_mode="HTML")
-                return
-            if value <= 0:
-                await message.answer("Значение должно быть больше 0.")
-                return
-            await db.update_channel_settings(channel_id, claim_timeout_minutes=value)
-            author_sessions.pop(message.from_user.id, None)
-        elif stage == "reward_add":
-            parts = [p.strip() for p in text.split("|")]
-            parts = [p for p in parts if p != ""]
-            if len(parts) < 2:
-                await message.answer(
-                    "Формат: <code>Название | Вес | Кол-во | Вкл(0/1) | Описание</code>",
-                    parse_mode="HTML",
-                )
-                return
-            name = parts[0]
-            try:
-                weight = int(parts[1])
-            except Exception:
-                await message.answer("Вес должен быть числом.")
-                return
-            quantity = 1
-            enabled = 1
-            description = ""
-            if len(parts) > 2:
-                try:
-                    quantity = int(parts[2])
-                except Exception:
-                    await message.answer("Кол-во должно быть числом.")
-                    return
-            if len(parts) > 3:
-                try:
-                    enabled = int(parts[3])
-                except Exception:
-                    await message.answer("Вкл должно быть 0 или 1.")
-                    return
-            if enabled not in (0, 1):
-                await message.answer("Вкл должно быть 0 или 1.")
-                return
-            if len(parts) > 4:
-                description = parts[4]
-            if not name or weight < 0 or quantity <= 0:
-                await message.answer("Проверь данные и попробуй ещё раз.")
-                return
-            try:
-                await db.create_reward(
-                    channel_id=int(channel_id),
-                    name=name,
-                    description=description,
-                    weight=weight,
-                    quantity=quantity,
-                    enabled=enabled,
-                )
-            except Exception:
-                await message.answer("Не удалось добавить награду.")
-                return
-            author_sessions.pop(message.from_user.id, None)
-        else:
-            author_sessions.pop(message.from_user.id, None)
+CHANNEL_SETTING_PARSERS = {
+    "set_interval": parse_interval,
+    "set_active": parse_minutes("active_timeout_minutes", 15),
+    "set_claim": parse_minutes("claim_timeout_minutes", 7),
+}
+
 
+def add_channel_stages(flow: str, store: StateStore, settings_kb, rewards_kb) -> None:
+    # The admin and the channel owner go through the same stages, each with their own menus
+
+    async def save_setting(message: Message, sess: dict, fields: dict):
+        channel_id = sess["channel_id"]
+        await update_channel_settings(channel_id, **fields)
+        store.pop(message.from_user.id, None)
         settings = await db.get_channel_settings(channel_id)
-        if stage in ("set_interval", "set_active", "set_claim"):
-            drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
-            text_out = (
-                "⚙️ <b>Настройки дропов</b>\n"
-                f"Канал: <b>{ch['login']}</b>\n\n"
-                f"Дропы: <b>{'ВКЛ' if drops_enabled else 'ВЫКЛ'}</b>\n"
-                f"Интервал: <b>{settings.get('min_interval_minutes')}</b>–<b>{settings.get('max_interval_minutes')}</b> мин\n"
-                f"Активность: <b>{settings.get('active_timeout_minutes')}</b> мин\n"
-                f"Таймаут забора: <b>{settings.get('claim_timeout_minutes')}</b> мин"
-            )
-            await message.answer(text_out, reply_markup=author_settings_kb(int(channel_id), drops_enabled), parse_mode="HTML")
-            return
+        drops_enabled = int(settings.get("drops_enabled") or 0) if settings else 0
+        text_out = (
+            "⚙️ <b>Настройки дропов</b>\n"
+            f"Канал: <b>{sess['channel']['login']}</b>\n\n"
+            f"Дропы: <b>{'ВКЛ' if drops_enabled else 'ВЫКЛ'}</b>\n"
+            f"Интервал: <b>{settings.get('min_interval_minutes')}</b>–<b>{settings.get('max_interval_minutes')}</b> мин\n"
+            f"Активность: <b>{settings.get('active_timeout_minutes')}</b> мин\n"
+            f"Таймаут забора: <b>{settings.get('claim_timeout_minutes')}</b> мин"
+        )
+        await message.answer(text_out, reply_markup=settings_kb(int(channel_id), drops_enabled), parse_mode="HTML")
 
-        if stage == "reward_add":
-            rewards = await db.list_rewards(channel_id)
-            if not rewards:
-                text_out = f"🎁 <b>Награды</b>\nКанал: <b>{ch['login']}</b>\n\nПока нет наград."
-            else:
-                lines = []
-                for r in rewards[:10]:
-                    enabled = "ВКЛ" if int(r.get("enabled") or 0) else "ВЫКЛ"
-                    lines.append(f"#{r['id']} — <b>{r['name']}</b> — вес {r['weight']} — кол-во {r['quantity']} — {enabled}")
-                text_out = f"🎁 <b>Награды</b>\nКанал: <b>{ch['login']}</b>\n\n" + "\n".join(lines)
-            await message.answer(text_out, reply_markup=author_rewards_kb(int(channel_id), rewards), parse_mode="HTML")
+    async def add_reward(message: Message, sess: dict, reward: dict):
+        channel_id = sess["channel_id"]
+        try:
+            await db.create_reward(channel_id=int(channel_id), **reward)
+        except Exception:
+            await message.answer("Не удалось добавить награду.")
             return
+        store.pop(message.from_user.id, None)
+        login = sess["channel"]["login"]
+        rewards = await db.list_rewards(channel_id)
+        if not rewards:
+            text_out = f"🎁 <b>Награды</b>\nКанал: <b>{login}</b>\n\nПока нет наград."
+        else:
+            lines = []
+            for r in rewards[:10]:
+                enabled = "ВКЛ" if int(r.get("enabled") or 0) else "ВЫКЛ"
+                lines.append(f"#{r['id']} — <b>{r['name']}</b> — вес {r['weight']} — кол-во {r['quantity']} — {enabled}")
+            text_out = f"🎁 <b>Награды</b>\nКанал: <b>{login}</b>\n\n" + "\n".join(lines)
+        await message.answer(text_out, reply_markup=rewards_kb(int(channel_id), rewards), parse_mode="HTML")
 
-    if message.from_user.id in ADMIN_IDS:
-        gsess = admin_giveaway_sessions.get(message.from_user.id)
-        if gsess and gsess.get("stage") == "guess_setup":
-            channel_id = gsess.get("channel_id")
-            if not channel_id:
-                admin_giveaway_sessions.pop(message.from_user.id, None)
-                await message.answer("Канал не настроен.")
-                return
-            parts = [p.strip() for p in text.split("|")]
-            parts = [p for p in parts if p]
-            if not parts:
-                await message.answer("Некорректные данные.")
-                return
-            prize = parts[0]
-            number = None
-            range_part = None
-            if len(parts) == 1:
-                range_part = "1 100"
-            elif len(parts) == 2:
-                range_part = parts[1]
-            else:
-                try:
-                    number = int(parts[1])
-                except Exception:
-                    number = None
-                range_part = parts[2]
-
-            if not range_part:
-                await message.answer("Укажи диапазон. Пример: <code>AKR12 | 1 100</code>", parse_mode="HTML")
-                return
-            r = range_part.replace("-", " ").split()
-            if len(r) != 2:
-                await message.answer("Диапазон должен быть двумя числами. Пример: <code>1 100</code>", parse_mode="HTML")
-                return
-            try:
-                min_v = int(r[0])
-                max_v = int(r[1])
-            except Exception:
-                await message.answer("Диапазон должен быть числами. Пример: <code>1 100</code>", parse_mode="HTML")
-                return
-            if min_v >= max_v:
-                await message.answer("MIN должен быть меньше MAX.")
-                return
-            if number is None:
-                number = random.randint(min_v, max_v)
-            if number < min_v or number > max_v:
-                await message.answer("ЧИСЛО должно быть внутри диапазона.")
-                return
+    for stage, parse in CHANNEL_SETTING_PARSERS.items():
+        text_router.stage(flow, stage, parse)(save_setting)
+    text_router.stage(flow, "reward_add", parse_reward)(add_reward)
 
-            try:
-                reward_id = await db.create_reward(
-                    channel_id=int(channel_id),
-                    name=prize,
-                    description="guess_game",
-                    weight=0,
-                    quantity=1,
-                    enabled=0,
-                )
-                trigger_id = await db.create_number_guess_trigger(
-                    channel_id=int(channel_id),
-                    requested_by=message.from_user.id,
-                    reward_id=int(reward_id),
-                    guess_number=int(number),
-                    guess_min=int(min_v),
-                    guess_max=int(max_v),
-                )
-            except Exception:
-                admin_giveaway_sessions.pop(message.from_user.id, None)
-                await message.answer("Не удалось создать игру.")
-                return
 
-            admin_giveaway_sessions.pop(message.from_user.id, None)
-            await message.answer(
-                "Игра запущена.\n"
-                f"Приз: {prize}\n"
-                f"Диапазон: {min_v}..{max_v}\n"
-                f"Триггер: {trigger_id}\n"
-                f"Загаданное число: {number}"
-            )
-            return
+add_channel_stages("admin_channel", admin_channel_sessions, admin_settings_kb, admin_rewards_kb)
+add_channel_stages("author", author_sessions, author_settings_kb, author_rewards_kb)
 
-        if gsess and gsess.get("stage") == "create":
-            channel_id = gsess.get("channel_id")
-            if not channel_id:
-                admin_giveaway_sessions.pop(message.from_user.id, None)
-                await message.answer("Канал не настроен.")
-                return
-            raw = text
-            if "|" in raw:
-                title_part, count_part = raw.split("|", 1)
-                title = title_part.strip()
-                count_raw = count_part.strip()
-            else:
-                title = raw.strip()
-                count_raw = "1"
-            try:
-                winners_count = int(count_raw)
-            except Exception:
-                await message.answer("Кол-во победителей должно быть числом. Пример: <code>AKR12 | 2</code>", parse_mode="HTML")
-                return
-            if not title or winners_count <= 0:
-                await message.answer("Некорректные данные. Пример: <code>AKR12 | 2</code>", parse_mode="HTML")
-                return
-            try:
-                planned_id = await db.create_planned_giveaway(int(channel_id), title, winners_count, message.from_user.id)
-            except Exception:
-                await message.answer("Не удалось создать розыгрыш.")
-                admin_giveaway_sessions.pop(message.from_user.id, None)
-                return
-            admin_giveaway_sessions.pop(message.from_user.id, None)
-            await message.answer(f"Создан розыгрыш #{planned_id}: {title} (победителей: {winners_count})")
-            return
 
-        sess = admin_check_sessions.get(message.from_user.id)
-        if sess and sess.get("stage") == "params":
-            parts = text.strip().split()
-            if len(parts) != 2:
-                await message.answer(
-                    "Отправь два числа: <code>N M</code>\nПример: <code>100 5</code>",
-                    parse_mode="HTML",
-                )
-                return
-            try:
-                amount = int(parts[0])
-                max_activations = int(parts[1])
-            except Exception:
-                await message.answer(
-                    "N и M должны быть числами. Пример: <code>100 5</code>",
-                    parse_mode="HTML",
-                )
-                return
-            if amount <= 0 or max_activations <= 0:
-                await message.answer("N и M должны быть больше 0.")
-                return
-            sess["amount"] = amount
-            sess["max_activations"] = max_activations
-            sess["stage"] = "channel"
-            channels = await db.list_check_channels()
-            if not channels:
-                await message.answer("Сначала добавь канал: /add_check_channel CHAT_ID Название")
-                admin_check_sessions.pop(message.from_user.id, None)
-                return
-            await message.answer(
-                f"Чек: <b>{amount} GOLD</b>, активаций: <b>{max_activations}</b>\n\nВыбери канал для публикации:",
-                reply_markup=check_channel_kb(channels),
-                parse_mode="HTML",
-            )
-            return
+@text_router.stage("admin_giveaway", "guess_setup", parse_guess_game)
+async def admin_guess_setup(message: Message, gsess: dict, game: tuple[str, int | None, int, int]):
+    prize, number, min_v, max_v = game
+    channel_id = gsess["channel_id"]
+    if number is None:
+        number = random.randint(min_v, max_v)
+    try:
+        reward_id = await db.create_reward(
+            channel_id=int(channel_id),
+            name=prize,
+            description="guess_game",
+            weight=0,
+            quantity=1,
+            enabled=0,
+        )
+        trigger_id = await db.create_number_guess_trigger(
+            channel_id=int(channel_id),
+            requested_by=message.from_user.id,
+            reward_id=int(reward_id),
+            guess_number=int(number),
+            guess_min=int(min_v),
+            guess_max=int(max_v),
+        )
+    except Exception:
+        admin_giveaway_sessions.pop(message.from_user.id, None)
+        await message.answer("Не удалось создать игру.")
+        return
+    await signal(f"trigger:{int(channel_id)}")
+
+    admin_giveaway_sessions.pop(message.from_user.id, None)
+    await message.answer(
+        "Игра запущена.\n"
+        f"Приз: {prize}\n"
+        f"Диапазон: {min_v}..{max_v}\n"
+        f"Триггер: {trigger_id}\n"
+        f"Загаданное число: {number}"
+    )
 
-    return
+
+@text_router.stage("admin_giveaway", "create", parse_planned_giveaway)
+async def admin_giveaway_create(message: Message, gsess: dict, giveaway: tuple[str, int]):
+    title, winners_count = giveaway
+    try:
+        planned_id = await db.create_planned_giveaway(int(gsess["channel_id"]), title, winners_count, message.from_user.id)
+    except Exception:
+        await message.answer("Не удалось создать розыгрыш.")
+        admin_giveaway_sessions.pop(message.from_user.id, None)
+        return
+    admin_giveaway_sessions.pop(message.from_user.id, None)
+    await message.answer(f"Создан розыгрыш #{planned_id}: {title} (победителей: {winners_count})")
+
+
+@text_router.stage("admin_check", "params", parse_check_params)
+async def admin_check_params(message: Message, sess: dict, params: tuple[int, int]):
+    amount, max_activations = params
+    admin_check_sessions[message.from_user.id] = {
+        **sess,
+        "amount": amount,
+        "max_activations": max_activations,
+        "stage": "channel",
+    }
+    channels = await db.list_check_channels()
+    if not channels:
+        await message.answer("Сначала добавь канал: /add_check_channel CHAT_ID Название")
+        admin_check_sessions.pop(message.from_user.id, None)
+        return
+    await message.answer(
+        f"Чек: <b>{amount} GOLD</b>, активаций: <b>{max_activations}</b>\n\nВыбери канал для публикации:",
+        reply_markup=check_channel_kb(channels),
+        parse_mode="HTML",
+    )
 
 
 @dp.callback_query(F.data.startswith("wd:"))
@@ -2215,11 +2250,14 @@ def check_channels_menu_kb():
 
 
 def check_message_text(amount: int, max_activations: int, activated_count: int) -> str:
-    return (
+    text = (
         f"🧾 Новый чек на {amount} GOLD\n"
         f"🔁 Активаций: {max_activations}\n"
         f"✅ Активировано: {activated_count}"
     )
+    if activated_count >= max_activations:
+        text += "\n\n⛔️ Чек закончился"
+    return text
 
 
 def check_activate_kb(bot_username: str, code: str):
@@ -2382,22 +2420,24 @@ async def cmd_start(message: Message):
             return
         result = await db.activate_gold_check(code, message.from_user.id)
         if result.get("status") == "activated":
-            balance = await db.get_gold_balance(message.from_user.id)
-            await message.answer(f"✅ Чек активирован: +{result['amount']} GOLD\n💰 Баланс: {balance}")
             try:
                 bot_username = await get_bot_username()
-                await bot.edit_message_text(
-                    chat_id=int(result["channel_id"]),
-                    message_id=int(result["message_id"]),
-                    text=check_message_text(
-                        int(result["amount"]),
-                        int(result["max_activations"]),
-                        int(result["activated_count"]),
-                    ),
+                activated_count = int(result["activated_count"])
+                max_activations = int(result["max_activations"])
+                check_updater.publish(
+                    int(result["channel_id"]),
+                    int(result["message_id"]),
+                    check_message_text(int(result["amount"]), max_activations, activated_count),
                     reply_markup=check_activate_kb(bot_username, code),
+                    final=activated_count >= max_activations,
+                    seq=activated_count,
                 )
             except Exception:
                 pass
+            balance = result.get("balance")
+            if balance is None:
+                balance = await db.get_gold_balance(message.from_user.id)
+            await message.answer(f"✅ Чек активирован: +{result['amount']} GOLD\n💰 Баланс: {balance}")
             return
         if result.get("status") == "already":
             await message.answer("Ты уже активировал этот чек.")
@@ -2426,13 +2466,31 @@ async def cmd_start(message: Message):
     await message.answer(text, reply_markup=menu_kb(is_admin, is_linked), parse_mode="HTML")
 
 
+def open_state_stores() -> None:
+    path = state_settings(config)["path"]
+    if not path or any(store.backend for store in STATE_STORES):
+        return
+    backend = StateBackend(path)
+    restored = sum(store.attach(backend) for store in STATE_STORES)
+    if restored:
+        logger.info(f"Восстановлено незавершённых диалогов: {restored}")
+
+
 async def start_telegram_bot():
+    init_bot()
     await db.init()
+    open_state_stores()
+    settings = webhook_settings(config)
+    if settings["mode"] == "webhook":
+        await run_webhook(dp, bot, settings)
+        return
+    # getUpdates is refused while a webhook is set, e.g. after switching back from webhook mode
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 
 async def notify_user(telegram_id: int, text: str):
     try:
-        await bot.send_message(telegram_id, text)
+        await init_bot().send_message(telegram_id, text)
     except Exception as e:
         logger.error(f"Не удалось отправить сообщение в TG {telegram_id}: {e}")
@@ -0,0 +1,217 @@
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import statistics
+import time
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+
+logger = logging.getLogger("TelegramWebhook")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def webhook_settings(config: dict) -> dict:
+    raw = config.get("telegram_webhook") or {}
+    mode = str((config.get("telegram") or {}).get("updates") or "polling").lower()
+    return {
+        "mode": mode if mode in ("polling", "webhook") else "polling",
+        "host": raw.get("host") or "127.0.0.1",
+        "port": int(raw.get("port", 8443)),
+        "path": "/" + str(raw.get("path") or "telegram").strip("/"),
+        "public_url": (raw.get("public_url") or "").rstrip("/"),
+        "secret_token": raw.get("secret_token") or "",
+        "workers": max(1, int(raw.get("workers", 16))),
+        "queue_size": max(1, int(raw.get("queue_size", 1000))),
+        "max_connections": min(100, max(1, int(raw.get("max_connections", 40)))),
+        "drop_pending_updates": bool(raw.get("drop_pending_updates", False)),
+        "record_path": raw.get("record_path") or "",
+        "drain_seconds": float(raw.get("drain_seconds", 10)),
+    }
+
+
+class WebhookServer:
+    # Receives updates from Telegram over HTTP. A POST is answered as soon as its update is
+    # queued; `workers` tasks take updates off the queue and run them through the
+    # dispatcher. With the queue full the request is held open, so Telegram (at most
+    # max_connections requests at a time) slows down instead of tasks piling up here.
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        path: str = "/telegram",
+        secret_token: str = "",
+        workers: int = 16,
+        queue_size: int = 1000,
+        record_path: str = "",
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = int(workers)
+        self.queue: asyncio.Queue[Update] = asyncio.Queue(int(queue_size))
+        self.record_path = record_path
+        self.stats: dict[str, int] = {}
+        self._record = None
+        self._tasks: list[asyncio.Task] = []
+        self._runner: web.AppRunner | None = None
+        self.base_url = ""
+
+    @classmethod
+    def from_config(cls, dp: Dispatcher, bot: Bot, settings: dict) -> "WebhookServer":
+        return cls(
+            dp,
+            bot,
+            settings["path"],
+            settings["secret_token"],
+            settings["workers"],
+            settings["queue_size"],
+            settings["record_path"],
+        )
+
+    def _count(self, key: str) -> None:
+        self.stats[key] = self.stats.get(key, 0) + 1
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self._count("forbidden")
+            logger.warning(f"Webhook: запрос без верного секрета от {request.remote}")
+            return web.Response(status=403)
+        try:
+            payload = await request.json()
+            update = Update.model_validate(payload, context={"bot": self.bot})
+        except Exception as e:
+            self._count("bad_request")
+            logger.warning(f"Webhook: не апдейт: {e}")
+            return web.Response(status=400)
+        if self._record is not None:
+            self._record.write(json.dumps(payload, ensure_ascii=False) + "\n")
+        self._count("received")
+        await self.queue.put(update)
+        return web.Response()
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                self._count("errors")
+                logger.error(f"Webhook: ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8443) -> str:
+        if self.record_path:
+            self._record = open(self.record_path, "a", encoding="utf-8", buffering=1)
+        self._tasks = [asyncio.create_task(self._worker(), name=f"webhook:worker{i}") for i in range(self.workers)]
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        sock = site._server.sockets[0]
+        self.base_url = f"http://{host}:{sock.getsockname()[1]}"
+        logger.info(f"Webhook: слушаем {self.base_url}{self.path}, обработчиков: {self.workers}")
+        return self.base_url
+
+    async def join(self) -> None:
+        await self.queue.join()
+
+    async def stop(self, drain_seconds: float = 10) -> None:
+        # No new updates once the site is down; the ones already accepted (Telegram got a
+        # 200 for them and will not resend) are processed for up to drain_seconds
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self.join(), drain_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Webhook: за {drain_seconds:g} с не обработано апдейтов: {self.queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._record is not None:
+            self._record.close()
+            self._record = None
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, settings: dict) -> None:
+    server = WebhookServer.from_config(dp, bot, settings)
+    await server.start(settings["host"], settings["port"])
+    if settings["public_url"]:
+        await bot.set_webhook(
+            settings["public_url"] + settings["path"],
+            secret_token=settings["secret_token"] or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=settings["max_connections"],
+            drop_pending_updates=settings["drop_pending_updates"],
+        )
+        logger.info(f"Webhook установлен: {settings['public_url']}{settings['path']}")
+    else:
+        # Behind a proxy that registers the webhook itself, or fed locally by `post`
+        logger.warning("Webhook: telegram_webhook.public_url не задан, setWebhook не вызывается")
+    await dp.emit_startup(bot=bot)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop(settings["drain_seconds"])
+        await dp.emit_shutdown(bot=bot)
+
+
+async def post_updates(args) -> None:
+    # Replays recorded updates (one JSON object per line, as written by record_path) into a
+    # running webhook server
+    with open(args.file, "r", encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    headers = {SECRET_HEADER: args.secret} if args.secret else {}
+    statuses: dict[int, int] = {}
+    latencies: list[float] = []
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def post(http: aiohttp.ClientSession, update: dict) -> None:
+        async with limit:
+            started = time.perf_counter()
+            async with http.post(args.url, json=update, headers=headers) as resp:
+                await resp.read()
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        for _ in range(args.repeat):
+            await asyncio.gather(*(post(http, u) for u in updates))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(f"Posted {len(latencies)} updates in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), statuses: {statuses}")
+    if latencies:
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"Response p50/p99: {statistics.median(latencies) * 1000:.1f} / {p99 * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="POST recorded Telegram updates to a webhook server")
+    parser.add_argument("file", help="JSON lines, one Update per line (telegram_webhook.record_path)")
+    parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    parser.add_argument("--secret", default="", help="telegram_webhook.secret_token")
+    parser.add_argument("--concurrency", type=int, default=40, help="Parallel requests, like setWebhook max_connections")
+    parser.add_argument("--repeat", type=int, default=1, help="Send the file this many times")
+    args = parser.parse_args()
+    asyncio.run(post_updates(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,449 @@
 import asyncio
-import datetime
+import contextlib
+import heapq
+import itertools
+import json
 import logging
+import math
+import os
+import tempfile
+import time
 
 import aiohttp
 
+from metrics import (
+    HELIX_BREAKER_STATE,
+    HELIX_FALLBACKS,
+    HELIX_QUEUE_SECONDS,
+    HELIX_RATELIMIT_POINTS,
+    HELIX_REQUEST_SECONDS,
+    HELIX_RESPONSES,
+    HELIX_RETRIES,
+)
+
 
 logger = logging.getLogger("Helix")
 
+HELIX_API_BASE = "https://api.twitch.tv/helix"
+TWITCH_AUTH_BASE = "https://id.twitch.tv"
+
+# Lower goes first: a clip is asked for by a viewer right now, lookups gate bot start-up,
+# stream polling can wait for the next refill
+PRIORITY_CLIP = 0
+PRIORITY_LOOKUP = 1
+PRIORITY_POLL = 2
+PRIORITY_NAMES = {PRIORITY_CLIP: "clip", PRIORITY_LOOKUP: "lookup", PRIORITY_POLL: "poll"}
+
+# Whole-call budgets, retries and waiting for the scheduler included
+DEFAULT_DEADLINES = {"streams": 30.0, "users": 60.0, "clips": 20.0, "eventsub/subscriptions": 20.0}
+
+
+def helix_settings(config: dict) -> dict:
+    raw = config.get("helix") or {}
+    return {
+        "cache_path": raw.get("cache_path", "helix_cache.json"),
+        "user_ttl_hours": float(raw.get("user_ttl_hours", 168)),
+        "poll_reserve": float(raw.get("poll_reserve", 0.1)),
+        "deadline_seconds": {**DEFAULT_DEADLINES, **{k: float(v) for k, v in (raw.get("deadline_seconds") or {}).items()}},
+        "breaker_failures": int(raw.get("breaker_failures", 5)),
+        "breaker_open_seconds": float(raw.get("breaker_open_seconds", 30)),
+    }
+
+
+class HelixUnavailable(Exception):
+    pass
+
+
+class HelixCache:
+    # App tokens and login -> user id lookups shared by every HelixClient in the process and
+    # kept on disk, so a restart with many channels neither re-authenticates per bot nor
+    # looks every channel up again. Concurrent misses for the same key share one request.
+    def __init__(self, path: str | None = None, user_ttl: float = 7 * 86400):
+        self.path = path
+        self.user_ttl = float(user_ttl)
+        self._tokens: dict[str, dict] = {}
+        self._users: dict[str, dict] = {}
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._write_lock = asyncio.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._tokens = dict(data.get("tokens") or {})
+            self._users = dict(data.get("users") or {})
+        except (OSError, ValueError) as e:
+            logger.warning(f"Helix: кэш {self.path} не прочитан, начинаем с пустого: {e}")
+
+    def _write(self, data: dict) -> None:
+        # Holds an app token: readable by the owner only (NamedTemporaryFile creates it with
+        # 0600), replaced atomically. A temp file of its own per write, so another cache on
+        # the same path can never truncate or interleave with it.
+        directory = os.path.dirname(os.path.abspath(self.path))
+        f = tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=directory, prefix=f"{os.path.basename(self.path)}.", suffix=".tmp", delete=False
+        )
+        try:
+            with f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(f.name, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(f.name)
+            raise
+
+    async def save(self) -> None:
+        if not self.path:
+            return
+        now = time.time()
+        data = {
+            "tokens": {k: v for k, v in self._tokens.items() if v["expires_at"] > now},
+            "users": {k: v for k, v in self._users.items() if now - v["fetched_at"] < self.user_ttl},
+        }
+        async with self._write_lock:
+            try:
+                await asyncio.to_thread(self._write, data)
+            except OSError as e:
+                logger.warning(f"Helix: не удалось сохранить кэш {self.path}: {e}")
+
+    def get_token(self, key: str) -> str | None:
+        entry = self._tokens.get(key)
+        if entry and time.time() < entry["expires_at"] - 60:
+            return entry["token"]
+        return None
+
+    def set_token(self, key: str, token: str, expires_in: float) -> None:
+        self._tokens[key] = {"token": token, "expires_at": time.time() + expires_in}
+
+    def drop_token(self, key: str, token: str | None) -> None:
+        # Only the token that was rejected: another client may already have replaced it
+        entry = self._tokens.get(key)
+        if entry and entry["token"] == token:
+            del self._tokens[key]
+
+    def get_user(self, login: str, stale: bool = False) -> str | None:
+        entry = self._users.get(login)
+        if entry and (stale or time.time() - entry["fetched_at"] < self.user_ttl):
+            return entry["id"]
+        return None
+
+    def set_user(self, login: str, user_id: str) -> None:
+        self._users[login] = {"id": user_id, "fetched_at": time.time()}
+
+    async def single_flight(self, key: tuple, factory):
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(factory())
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: a caller that gives up must not cancel the request for the others
+        return await asyncio.shield(fut)
+
+
+_shared_caches: dict[str | None, HelixCache] = {}
+
+
+def shared_cache(config: dict | None = None) -> HelixCache:
+    # Without a config (benchmarks, one-off scripts) the cache lives in memory only
+    settings = helix_settings(config or {})
+    path = (settings["cache_path"] or None) if config is not None else None
+    cache = _shared_caches.get(path)
+    if cache is None:
+        cache = _shared_caches[path] = HelixCache(path, settings["user_ttl_hours"] * 3600)
+    return cache
+
+
+class _Ticket:
+    __slots__ = ("reported",)
+
+    def __init__(self):
+        self.reported = False
+
+
+class HelixScheduler:
+    # Every request against one Helix rate-limit bucket asks for a slot here first. The
+    # bucket is modelled from Ratelimit-Limit/-Remaining/-Reset: points left at the last
+    # response, refilling linearly until the reset time. A request is only let through when
+    # the model says a point is available; waiting requests go in priority order. Polling
+    # may not dig into the last `poll_reserve` share of the bucket, so once the bucket is
+    # low polls go out at the refill rate, spread over the reset window, and clips still
+    # get through.
+    def __init__(self, name: str = "app", poll_reserve: float = 0.1):
+        self.name = name
+        self.poll_reserve = min(max(float(poll_reserve), 0.0), 0.9)
+        self.limit: int | None = None
+        self.inflight = 0
+        # Sent but not answered yet: Twitch may or may not have counted them
+        self._unreported = 0
+        self._points = 0.0
+        self._points_at = 0.0
+        self._refill = 0.0
+        self._queue: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self._points_metric = HELIX_RATELIMIT_POINTS.labels(name)
+        self._wait_metrics = {p: HELIX_QUEUE_SECONDS.labels(n) for p, n in PRIORITY_NAMES.items()}
+
+    def points(self, now: float) -> float:
+        if self.limit is None:
+            return 0.0
+        return min(float(self.limit), self._points + (now - self._points_at) * self._refill)
+
+    def _wait_for(self, priority: int, now: float) -> float:
+        if self.limit is None:
+            # Bucket size unknown until the first response: one request at a time
+            return 0.0 if self.inflight == 0 else math.inf
+        floor = self.limit * self.poll_reserve if priority >= PRIORITY_POLL else 0.0
+        missing = floor + 1 - self.points(now)
+        if missing <= 0:
+            return 0.0
+        return missing / self._refill if self._refill > 0 else math.inf
+
+    def update(self, ticket: _Ticket, status: int, headers) -> bool:
+        # True when the response carried the Ratelimit-* headers and the model took them
+        if not ticket.reported:
+            ticket.reported = True
+            self._unreported -= 1
+        try:
+            limit = int(headers["Ratelimit-Limit"])
+            remaining = int(headers["Ratelimit-Remaining"])
+            reset = float(headers["Ratelimit-Reset"])
+        except (KeyError, TypeError, ValueError):
+            return False
+        if status == 429:
+            remaining = 0
+        now = time.monotonic()
+        # Requests still unanswered are assumed not counted yet. Responses of one burst come
+        # back in any order, so while some are outstanding the lowest estimate wins; with
+        # none outstanding the header is exact and replaces the model.
+        estimate = float(remaining - self._unreported)
+        if self.limit is None or self._unreported == 0 or estimate < self.points(now):
+            self._points = estimate
+            self._points_at = now
+        self.limit = max(1, limit)
+        # Reset is when the bucket is full again; whole seconds, so only trusted with a
+        # noticeable gap to refill
+        until_reset = reset - time.time()
+        if limit - remaining >= max(2, limit * 0.05) and until_reset > 0:
+            self._refill = (limit - remaining) / until_reset
+        elif self._refill <= 0:
+            self._refill = limit / 60
+        self._points_metric.set(self._points)
+        self._kick()
+        return True
+
+    def _take(self, now: float) -> None:
+        if self.limit is not None:
+            self._points = self.points(now) - 1
+            self._points_at = now
+        self.inflight += 1
+        self._unreported += 1
+
+    def _release(self, ticket: _Ticket) -> None:
+        if not ticket.reported:
+            # No answer (network error, timeout): whether it counted stays unknown
+            ticket.reported = True
+            self._unreported -= 1
+        self.inflight = max(0, self.inflight - 1)
+        self._kick()
+
+    def _kick(self) -> None:
+        if self._wake is not None:
+            self._wake.set()
+
+    def _ensure_running(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._task and not self._task.done():
+            return
+        if self._loop is not loop:
+            self._wake = asyncio.Event()
+        self._loop = loop
+        self._queue = [item for item in self._queue if not item[2].done()]
+        self._task = loop.create_task(self._dispatch(), name=f"helix-scheduler:{self.name}")
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._wake.clear()
+            while self._queue and self._queue[0][2].done():
+                heapq.heappop(self._queue)
+            if not self._queue:
+                # Nothing waiting: stop, the next slot() starts a new dispatcher
+                self._task = None
+                return
+            priority, _, fut = self._queue[0]
+            now = time.monotonic()
+            wait = self._wait_for(priority, now)
+            if wait <= 0:
+                heapq.heappop(self._queue)
+                self._take(now)
+                fut.set_result(None)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), None if math.isinf(wait) else wait)
+            except asyncio.TimeoutError:
+                pass
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int):
+        self._ensure_running()
+        fut = self._loop.create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), fut))
+        self._kick()
+        started = time.monotonic()
+        ticket = _Ticket()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # Let through just as the caller gave up: the request is not sent
+                self._release(ticket)
+            else:
+                self._kick()
+            raise
+        self._wait_metrics.get(priority, self._wait_metrics[PRIORITY_POLL]).observe(time.monotonic() - started)
+        try:
+            yield ticket
+        finally:
+            self._release(ticket)
+
+
+_shared_schedulers: dict[str, HelixScheduler] = {}
+
+
+def shared_scheduler(key: str, config: dict | None = None) -> HelixScheduler:
+    scheduler = _shared_schedulers.get(key)
+    if scheduler is None:
+        name = "user" if key.endswith("|user") else "app"
+        scheduler = _shared_schedulers[key] = HelixScheduler(name, helix_settings(config or {})["poll_reserve"])
+    return scheduler
+
+
+class CircuitBreaker:
+    # Per endpoint. Closed: requests go out, consecutive failures (network errors, timeouts,
+    # 5xx) are counted. Open after `failures` of them: requests fail at once for
+    # `open_seconds`. Half-open after that: one probe goes out, its result closes or reopens.
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name: str, failures: int = 5, open_seconds: float = 30):
+        self.name = name
+        self.max_failures = max(1, int(failures))
+        self.open_seconds = max(0.0, float(open_seconds))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._state_metric = HELIX_BREAKER_STATE.labels(name)
+        self._state_metric.set(0)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        self._state_metric.set(self.STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                return False
+            self._probing = True
+        return True
+
+    def success(self) -> None:
+        self._probing = False
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+            logger.info(f"Helix: /{self.name} снова отвечает, предохранитель закрыт")
+
+    def failure(self) -> None:
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.max_failures):
+            self._set_state(self.OPEN)
+            self.opened_at = time.monotonic()
+            logger.warning(
+                f"Helix: /{self.name} не отвечает (ошибок подряд: {self.failures}), "
+                f"запросы приостановлены на {self.open_seconds:g} с"
+            )
+
+    def abandon(self) -> None:
+        # The caller was cancelled mid-request: no verdict, let the next call probe
+        self._probing = False
+
+
+_shared_breakers: dict[str, CircuitBreaker] = {}
+
+
+def shared_breaker(key: str, config: dict | None = None) -> CircuitBreaker:
+    breaker = _shared_breakers.get(key)
+    if breaker is None:
+        settings = helix_settings(config or {})
+        breaker = _shared_breakers[key] = CircuitBreaker(
+            key.rsplit("|", 1)[-1], settings["breaker_failures"], settings["breaker_open_seconds"]
+        )
+    return breaker
+
 
 class HelixClient:
-    def __init__(self, client_id: str, client_secret: str, user_token: str | None = None):
+    def __init__(
+        self,
+        client_id: str,
+        client_secret: str,
+        user_token: str | None = None,
+        api_base: str | None = None,
+        auth_base: str | None = None,
+        cache: HelixCache | None = None,
+        scheduler: HelixScheduler | None = None,
+        user_scheduler: HelixScheduler | None = None,
+        breakers: dict[str, CircuitBreaker] | None = None,
+        config: dict | None = None,
+    ):
         self.client_id = client_id
         self.client_secret = client_secret
         self.user_token = user_token
+        self.api_base = (api_base or HELIX_API_BASE).rstrip("/")
+        self.auth_base = (auth_base or TWITCH_AUTH_BASE).rstrip("/")
+        self.cache = cache if cache is not None else shared_cache(config)
+        # Helix counts app-token calls per client id and user-token calls per user
+        bucket = f"{self.api_base}|{self.client_id}"
+        self.scheduler = scheduler or shared_scheduler(bucket, config)
+        self.user_scheduler = user_scheduler or shared_scheduler(f"{bucket}|user", config)
+        self._token_key = f"{self.auth_base}|{self.client_id}"
         self._token: str | None = None
-        self._token_expires_at: datetime.datetime | None = None
+        self.breakers = breakers if breakers is not None else {}
+        self._config = config
+        self.deadlines = helix_settings(config or {})["deadline_seconds"]
+        self._last_online: dict[str, bool] = {}
+
+    @classmethod
+    def from_config(cls, config: dict, user_token: str | None = None) -> "HelixClient":
+        return cls(
+            client_id=config["twitch"]["client_id"],
+            client_secret=config["twitch"]["client_secret"],
+            user_token=user_token,
+            api_base=config["twitch"].get("helix_api_base"),
+            auth_base=config["twitch"].get("auth_base"),
+            config=config,
+        )
 
     async def _ensure_token(self):
-        if self._token and self._token_expires_at:
-            if datetime.datetime.now() < (self._token_expires_at - datetime.timedelta(seconds=30)):
-                return
-        await self._fetch_app_token()
+        token = self.cache.get_token(self._token_key)
+        if token is None:
+            token = await self.cache.single_flight(("token", self._token_key), self._fetch_app_token)
+        self._token = token
 
-    async def _fetch_app_token(self):
-        url = "https://id.twitch.tv/oauth2/token"
+    async def _fetch_app_token(self) -> str:
+        url = f"{self.auth_base}/oauth2/token"
         data = {
             "client_id": self.client_id,
             "client_secret": self.client_secret,
@@ -32,10 +452,15 @@ class HelixClient:
 
         delay = 1
         for attempt in range(6):
+            if attempt:
+                HELIX_RETRIES.labels("token").inc()
             try:
+                started = time.perf_counter()
                 async with aiohttp.ClientSession() as session:
                     async with session.post(url, data=data, timeout=aiohttp.ClientTimeout(total=15)) as resp:
                         payload = await resp.json()
+                        HELIX_REQUEST_SECONDS.labels("token").observe(time.perf_counter() - started)
+                        HELIX_RESPONSES.labels("token", resp.status).inc()
                         if resp.status != 200:
                             raise RuntimeError(f"token_http_{resp.status}: {payload}")
 
@@ -44,10 +469,10 @@ class HelixClient:
                 if not token or expires_in <= 0:
                     raise RuntimeError(f"bad_token_payload: {payload}")
 
-                self._token = token
-                self._token_expires_at = datetime.datetime.now() + datetime.timedelta(seconds=expires_in)
+                self.cache.set_token(self._token_key, token, expires_in)
+                await self.cache.save()
                 logger.info("Helix: app access token получен")
-                return
+                return token
             except Exception as e:
                 logger.error(f"Helix: не удалось получить app token (attempt={attempt + 1}): {e}")
                 await asyncio.sleep(min(30, delay))
@@ -55,126 +480,210 @@ class HelixClient:
 
         raise RuntimeError("Helix: app token не получен после ретраев")
 
-    async def is_stream_online(self, user_login: str) -> bool:
-        await self._ensure_token()
-        url = "https://api.twitch.tv/helix/streams"
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        # One per endpoint for the whole process unless given: once Twitch is down for one
+        # channel it is down for all of them
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = shared_breaker(f"{self.api_base}|{endpoint}", self._config)
+        return breaker
+
+    async def _send(
+        self,
+        endpoint: str,
+        method: str,
+        params: dict,
+        priority: int,
+        app_auth: bool,
+        progress: dict,
+        body: dict | None = None,
+    ) -> tuple[int, dict]:
+        scheduler = self.scheduler if app_auth else self.user_scheduler
+        if app_auth:
+            await self._ensure_token()
         headers = {
             "Client-ID": self.client_id,
-            "Authorization": f"Bearer {self._token}",
+            "Authorization": f"Bearer {self._token if app_auth else self.user_token}",
         }
-        params = {"user_login": user_login}
+        progress["stage"] = "queue"
+        async with scheduler.slot(priority) as ticket:
+            progress["stage"] = "sent"
+            started = time.perf_counter()
+            async with aiohttp.ClientSession() as session:
+                async with session.request(
+                    method,
+                    f"{self.api_base}/{endpoint}",
+                    headers=headers,
+                    params=params,
+                    json=body,
+                    timeout=aiohttp.ClientTimeout(total=15),
+                ) as resp:
+                    progress["ratelimit"] = scheduler.update(ticket, resp.status, resp.headers)
+                    payload = await resp.json()
+                    HELIX_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+                    HELIX_RESPONSES.labels(endpoint, resp.status).inc()
+                    return resp.status, payload
 
+    async def _request(
+        self,
+        endpoint: str,
+        method: str,
+        params: dict,
+        priority: int,
+        app_auth: bool = True,
+        attempts: int = 6,
+        max_delay: float = 30,
+        ok: tuple[int, ...] = (200,),
+        body: dict | None = None,
+    ) -> dict | None:
+        # Raises HelixUnavailable when the breaker is open or the endpoint's deadline runs out
+        # before an answer; the deadline bounds token fetching, queueing, requests and backoff
+        breaker = self.breaker(endpoint)
+        started = time.monotonic()
+        deadline = started + self.deadlines.get(endpoint, DEFAULT_DEADLINES["streams"])
         delay = 1
-        for attempt in range(6):
+        for attempt in range(attempts):
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            if not breaker.allow():
+                raise HelixUnavailable(f"/{endpoint}: предохранитель открыт")
+            if attempt:
+                HELIX_RETRIES.labels(endpoint).inc()
+            progress = {"stage": "token"}
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        url,
-                        headers=headers,
-                        params=params,
-                        timeout=aiohttp.ClientTimeout(total=15),
-                    ) as resp:
-                        payload = await resp.json()
-
-                        if resp.status == 401:
-                            self._token = None
-                            self._token_expires_at = None
-                            await self._ensure_token()
-                            headers["Authorization"] = f"Bearer {self._token}"
-                            continue
-
-                        if resp.status != 200:
-                            raise RuntimeError(f"streams_http_{resp.status}: {payload}")
-
-                data = payload.get("data", [])
-                return bool(data)
+                status, payload = await asyncio.wait_for(
+                    self._send(endpoint, method, params, priority, app_auth, progress, body), left
+                )
+            except asyncio.CancelledError:
+                breaker.abandon()
+                raise
+            except asyncio.TimeoutError:
+                if progress["stage"] == "queue":
+                    # Out of budget while queued for our own rate limit: says nothing about Twitch
+                    breaker.abandon()
+                    break
+                breaker.failure()
+                error = "таймаут"
             except Exception as e:
-                logger.error(f"Helix: ошибка GET /streams (attempt={attempt + 1}): {e}")
-                await asyncio.sleep(min(30, delay))
-                delay = min(30, delay * 2)
+                breaker.failure()
+                error = str(e) or type(e).__name__
+            else:
+                if status >= 500:
+                    breaker.failure()
+                else:
+                    breaker.success()
 
-        return False
+                if status == 401:
+                    if not app_auth:
+                        logger.error(f"Helix: {endpoint}_http_401: {payload}")
+                        return None
+                    # The next attempt fetches a new token, within the same deadline
+                    self.cache.drop_token(self._token_key, self._token)
+                    self._token = None
+                    continue
 
-    async def get_user_id(self, user_login: str) -> str | None:
-        await self._ensure_token()
-        url = "https://api.twitch.tv/helix/users"
-        headers = {
-            "Client-ID": self.client_id,
-            "Authorization": f"Bearer {self._token}",
-        }
-        params = {"login": user_login}
+                if status == 429 and status not in ok and progress.get("ratelimit"):
+                    # The scheduler now holds further requests until the bucket refills;
+                    # without Ratelimit-* headers it knows nothing, so back off as for errors
+                    continue
 
-        delay = 1
-        for attempt in range(6):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(
-                        url,
-                        headers=headers,
-                        params=params,
-                        timeout=aiohttp.ClientTimeout(total=15),
-                    ) as resp:
-                        payload = await resp.json()
+                if status in ok:
+                    return payload
+                error = f"{endpoint}_http_{status}: {payload}"
 
-                        if resp.status == 401:
-                            self._token = None
-                            self._token_expires_at = None
-                            await self._ensure_token()
-                            headers["Authorization"] = f"Bearer {self._token}"
-                            continue
+            logger.error(f"Helix: ошибка {method} /{endpoint} (attempt={attempt + 1}): {error}")
+            pause = min(max_delay, delay, deadline - time.monotonic())
+            if pause > 0:
+                await asyncio.sleep(pause)
+            delay = min(max_delay, delay * 2)
 
-                        if resp.status != 200:
-                            raise RuntimeError(f"users_http_{resp.status}: {payload}")
+        raise HelixUnavailable(f"/{endpoint}: нет ответа за {time.monotonic() - started:.1f} с")
 
-                data = payload.get("data", [])
-                if not data:
-                    return None
-                return data[0].get("id")
-            except Exception as e:
-                logger.error(f"Helix: ошибка GET /users (attempt={attempt + 1}): {e}")
-                await asyncio.sleep(min(30, delay))
-                delay = min(30, delay * 2)
+    async def is_stream_online(self, user_login: str) -> bool:
+        # While Twitch is down the last answer stands: an outage must not end every stream
+        try:
+            payload = await self._request("streams", "GET", {"user_login": user_login}, PRIORITY_POLL)
+        except HelixUnavailable as e:
+            HELIX_FALLBACKS.labels("streams").inc()
+            last = self._last_online.get(user_login, False)
+            logger.warning(f"Helix: {e}, для {user_login} остаётся последнее значение (online={last})")
+            return last
+        online = bool(payload and payload.get("data"))
+        self._last_online[user_login] = online
+        return online
 
-        return None
+    async def get_user_id(self, user_login: str) -> str | None:
+        login = (user_login or "").strip().lower()
+        user_id = self.cache.get_user(login)
+        if user_id is not None:
+            return user_id
+        try:
+            user_id = await self.cache.single_flight(("user", login), lambda: self._fetch_user_id(login))
+        except HelixUnavailable as e:
+            # An expired cache entry is still the right id: logins rarely change owners
+            user_id = self.cache.get_user(login, stale=True)
+            HELIX_FALLBACKS.labels("users").inc()
+            logger.warning(f"Helix: {e}, id {login} из устаревшего кэша: {user_id}")
+            return user_id
+        if user_id:
+            self.cache.set_user(login, user_id)
+            await self.cache.save()
+        return user_id
+
+    async def _fetch_user_id(self, user_login: str) -> str | None:
+        payload = await self._request("users", "GET", {"login": user_login}, PRIORITY_LOOKUP)
+        data = (payload or {}).get("data", [])
+        if not data:
+            return None
+        return data[0].get("id")
 
     async def create_clip(self, broadcaster_id: str, has_delay: bool = True) -> str | None:
         if not self.user_token:
             logger.error("Helix: user_token отсутствует для создания клипа")
             return None
-        url = "https://api.twitch.tv/helix/clips"
-        headers = {
-            "Client-ID": self.client_id,
-            "Authorization": f"Bearer {self.user_token}",
-        }
         params = {"broadcaster_id": broadcaster_id, "has_delay": "true" if has_delay else "false"}
+        try:
+            payload = await self._request(
+                "clips", "POST", params, PRIORITY_CLIP, app_auth=False, attempts=4, max_delay=10, ok=(200, 202)
+            )
+        except HelixUnavailable as e:
+            logger.error(f"Helix: клип не создан: {e}")
+            return None
+        data = (payload or {}).get("data", [])
+        if not data:
+            return None
+        return data[0].get("id")
 
-        delay = 1
-        for attempt in range(4):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        url,
-                        headers=headers,
-                        params=params,
-                        timeout=aiohttp.ClientTimeout(total=15),
-                    ) as resp:
-                        payload = await resp.json()
-
-                        if resp.status == 401:
-                            logger.error(f"Helix: clips_http_401: {payload}")
-                            return None
-
-                        if resp.status != 202 and resp.status != 200:
-                            raise RuntimeError(f"clips_http_{resp.status}: {payload}")
-
-                data = payload.get("data", [])
-                if not data:
-                    return None
-                clip_id = data[0].get("id")
-                return clip_id
-            except Exception as e:
-                logger.error(f"Helix: ошибка POST /clips (attempt={attempt + 1}): {e}")
-                await asyncio.sleep(min(10, delay))
-                delay = min(10, delay * 2)
-
-        return None
+    async def create_eventsub_subscription(self, sub_type: str, broadcaster_id: str, session_id: str) -> str | None:
+        # WebSocket transports only accept user tokens. Returns the subscription status,
+        # "enabled" when it is live on the session, "cost_exceeded" at the subscription limit
+        if not self.user_token:
+            logger.error("Helix: user_token отсутствует для подписки EventSub")
+            return None
+        body = {
+            "type": sub_type,
+            "version": "1",
+            "condition": {"broadcaster_user_id": broadcaster_id},
+            "transport": {"method": "websocket", "session_id": session_id},
+        }
+        try:
+            # 409: already subscribed on this session; 429 here means the subscription cost
+            # limit, which retrying does not fix
+            payload = await self._request(
+                "eventsub/subscriptions", "POST", {}, PRIORITY_LOOKUP, app_auth=False, attempts=3, ok=(202, 409, 429), body=body
+            )
+        except HelixUnavailable as e:
+            logger.error(f"Helix: подписка {sub_type} для {broadcaster_id} не создана: {e}")
+            return None
+        if not payload:
+            return None
+        if payload.get("status") == 409:
+            return "enabled"
+        if payload.get("status") == 429:
+            return "cost_exceeded"
+        data = payload.get("data") or []
+        if not data:
+            logger.warning(f"Helix: подписка {sub_type} для {broadcaster_id} отклонена: {payload.get('message')}")
+            return None
+        return data[0].get("status")